@@ -1,36 +1,318 @@
-import sqlite3
-from datetime import datetime
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from connection_pool import ITER_BATCH_SIZE, get_connection, iter_batches
+from sequences import next_document_number
+from money import BASE_CURRENCY, Money, to_minor, from_minor, allocate_residual
+from dashboard_metrics import update_cash_balance
+from master_data import get_master_data
+
+try:
+    import numpy
+except ImportError:  # NumPy is optional, multi-period matrices fall back to lists
+    numpy = None
+
+
+def balance_as_of_join(alias, operator='<='):
+    """
+    Join the latest cumulative rollup row per account on or before a date (bound as
+    the parameter), or strictly before it with operator='<'
+    """
+    return f'''
+    LEFT JOIN account_period_balances {alias} ON {alias}.account_id = a.account_id
+    AND {alias}.balance_date = (
+        SELECT MAX(balance_date) FROM account_period_balances
+        WHERE account_id = a.account_id AND balance_date {operator} ?
+    )
+'''
+
+
+# Latest cumulative rollup row per account on or before a date (bound as the parameter)
+BALANCE_AS_OF_JOIN = balance_as_of_join('b')
+
+# Per-account daily movements with running totals, aggregated from the raw journal lines
+PERIOD_BALANCES_QUERY = '''
+    SELECT
+        account_id,
+        entry_date as balance_date,
+        debits as debit_amount,
+        credits as credit_amount,
+        SUM(debits) OVER running as cumulative_debit,
+        SUM(credits) OVER running as cumulative_credit
+    FROM (
+        SELECT
+            jel.account_id,
+            je.entry_date,
+            SUM(jel.debit_base_currency) as debits,
+            SUM(jel.credit_base_currency) as credits
+        FROM journal_entry_lines jel
+        JOIN journal_entries je ON jel.entry_id = je.entry_id
+        WHERE je.status = 'Posted'
+        GROUP BY jel.account_id, je.entry_date
+    )
+    WINDOW running AS (PARTITION BY account_id ORDER BY entry_date ROWS UNBOUNDED PRECEDING)
+'''
+
+
+def rebuild_period_balances(cursor):
+    """Recreate the account_period_balances rollup from the journal lines"""
+    cursor.execute('DELETE FROM account_period_balances')
+    cursor.execute(f'''
+        INSERT INTO account_period_balances
+        (account_id, balance_date, debit_amount, credit_amount, cumulative_debit, cumulative_credit)
+        {PERIOD_BALANCES_QUERY}
+    ''')
+    cursor.execute('SELECT COUNT(*) FROM account_period_balances')
+    return cursor.fetchone()[0]
+
+
+def update_period_balances(cursor, account_id, balance_date, debit, credit, account_code=None):
+    """Add a posting to the rollup row for its date and shift later running totals"""
+    # Start the day's row from the previous running totals if it does not exist yet
+    cursor.execute('''
+        INSERT OR IGNORE INTO account_period_balances
+        (account_id, balance_date, debit_amount, credit_amount, cumulative_debit, cumulative_credit)
+        SELECT ?, ?, 0, 0, COALESCE(MAX(cumulative_debit), 0), COALESCE(MAX(cumulative_credit), 0)
+        FROM (
+            SELECT cumulative_debit, cumulative_credit FROM account_period_balances
+            WHERE account_id = ? AND balance_date < ?
+            ORDER BY balance_date DESC LIMIT 1
+        )
+    ''', (account_id, balance_date, account_id, balance_date))
+    
+    cursor.execute('''
+        UPDATE account_period_balances
+        SET debit_amount = debit_amount + ?, credit_amount = credit_amount + ?
+        WHERE account_id = ? AND balance_date = ?
+    ''', (debit, credit, account_id, balance_date))
+    
+    # Backdated postings also move the running totals of every later day
+    cursor.execute('''
+        UPDATE account_period_balances
+        SET cumulative_debit = cumulative_debit + ?, cumulative_credit = cumulative_credit + ?
+        WHERE account_id = ? AND balance_date >= ?
+    ''', (debit, credit, account_id, balance_date))
+
+    update_cash_balance(cursor, account_id, debit, credit, account_code)
+
+
+def journal_line_amounts(lines, currency=BASE_CURRENCY, exchange_rate=1.0):
+    """
+    Convert journal lines to integer minor units and check that they balance
+    lines = [(account_id, debit, credit, description), ...] with numbers or Money amounts
+    Returns [(account_id, debit, credit, debit_base, credit_base, description), ...]
+    """
+    rows = [(account_id, to_minor(debit, currency), to_minor(credit, currency), line_desc)
+            for account_id, debit, credit, line_desc in lines]
+    
+    # Validate double entry (debits must equal credits) exactly, in minor units
+    total_debits = sum(row[1] for row in rows)
+    total_credits = sum(row[2] for row in rows)
+    
+    if total_debits != total_credits:
+        raise ValueError(f"Unbalanced entry: Debits={from_minor(total_debits, currency):.2f}, "
+                         f"Credits={from_minor(total_credits, currency):.2f}")
+    
+    # Convert to base currency, putting any rounding difference on the largest credit
+    debits_base = [Money(row[1], currency).convert(exchange_rate).minor for row in rows]
+    credits_base = [Money(row[2], currency).convert(exchange_rate).minor for row in rows]
+    allocate_residual(credits_base, sum(debits_base))
+    
+    return [(account_id, debit, credit, debit_base, credit_base, line_desc)
+            for (account_id, debit, credit, line_desc), debit_base, credit_base
+            in zip(rows, debits_base, credits_base)]
+
+
+# General ledger row columns and order. The order matches idx_journal_lines_account_date,
+# so a page is read straight from the index; line_id makes it unique for keyset paging.
+GENERAL_LEDGER_COLUMNS = '''
+    jel.line_id,
+    jel.entry_id,
+    je.entry_number,
+    jel.entry_date,
+    je.entry_type,
+    je.reference,
+    jel.description,
+    jel.debit_amount,
+    jel.credit_amount,
+    je.currency
+'''
+GENERAL_LEDGER_ORDER = 'jel.entry_date, jel.entry_id, jel.line_id'
+GENERAL_LEDGER_ORDER_DESC = 'jel.entry_date DESC, jel.entry_id DESC, jel.line_id DESC'
+
+# Cumulative debits and credits of every active account as of a date (bound as the parameter)
+TRIAL_BALANCE_QUERY = f'''
+    SELECT 
+        a.account_code,
+        a.account_name,
+        a.account_type,
+        COALESCE(b.cumulative_debit, 0) as total_debits,
+        COALESCE(b.cumulative_credit, 0) as total_credits
+    FROM chart_of_accounts a
+    {BALANCE_AS_OF_JOIN}
+    WHERE a.is_active = 1
+    ORDER BY a.account_code
+'''
+
+# Net debit balance of every active account at the end of the period, before the period
+# starts and before the financial year starts (bound in that order), all from the rollup
+FINANCIAL_STATEMENT_QUERY = f'''
+    SELECT 
+        a.account_code,
+        a.account_name,
+        a.account_type,
+        COALESCE(c.cumulative_debit - c.cumulative_credit, 0) as closing_balance,
+        COALESCE(p.cumulative_debit - p.cumulative_credit, 0) as period_opening_balance,
+        COALESCE(y.cumulative_debit - y.cumulative_credit, 0) as year_opening_balance
+    FROM chart_of_accounts a
+    {balance_as_of_join('c')}
+    {balance_as_of_join('p', '<')}
+    {balance_as_of_join('y', '<')}
+    WHERE a.is_active = 1
+    ORDER BY a.account_code
+'''
+
+# Profit & Loss sections: (section, account type, account code prefix)
+PROFIT_AND_LOSS_SECTIONS = (
+    ('revenue', 'Revenue', ''),
+    ('cogs', 'Expense', '5'),
+    ('expenses', 'Expense', '6'),
+)
+
+# Balance Sheet sections: (section, account type); liabilities and equity are credit balances
+BALANCE_SHEET_SECTIONS = (
+    ('assets', 'Asset'),
+    ('liabilities', 'Liability'),
+    ('equity', 'Equity'),
+)
+
+# Equity accounts that show the profit not yet closed off to equity
+RETAINED_EARNINGS_ACCOUNT = ('3200', 'Retained Earnings')
+CURRENT_YEAR_EARNINGS_ACCOUNT = ('3300', 'Current Year Earnings')
+
+# Net debit balance of every active account at each cutoff date (bound in the VALUES list).
+# ORDER BY ... LIMIT 1 seeks the rollup index, MAX() would scan it for each cutoff.
+PERIOD_MATRIX_QUERY = '''
+    WITH cutoffs(cutoff) AS (VALUES {cutoffs})
+    SELECT 
+        a.account_id,
+        k.cutoff,
+        COALESCE((
+            SELECT b.cumulative_debit - b.cumulative_credit
+            FROM account_period_balances b
+            WHERE b.account_id = a.account_id AND b.balance_date <= k.cutoff
+            ORDER BY b.balance_date DESC LIMIT 1
+        ), 0) as balance
+    FROM chart_of_accounts a
+    CROSS JOIN cutoffs k
+    WHERE a.is_active = 1
+'''
+
+# Rows yielded by the streaming iter_* reports, with amounts in major units
+TrialBalanceRow = namedtuple('TrialBalanceRow', 'account_code account_name account_type debit_balance credit_balance')
+ProfitLossRow = namedtuple('ProfitLossRow', 'section account_code account_name amount')
+LedgerRow = namedtuple('LedgerRow', 'line_id entry_id entry_number entry_date entry_type reference description '
+                                    'debit_amount credit_amount currency balance')
+
+
+def trial_balance_amounts(account_type, debits, credits):
+    """Split an account's debits and credits into its (debit_balance, credit_balance) trial balance columns"""
+    if account_type in ['Asset', 'Expense']:
+        balance = debits - credits
+        if balance > 0:
+            return balance, 0
+        return 0, abs(balance)
+
+    # Liability, Equity, Revenue
+    balance = credits - debits
+    if balance > 0:
+        return 0, balance
+    return abs(balance), 0
+
+
+def profit_and_loss_section(account_type, account_code):
+    """Profit & Loss section of an account, or None if it is not reported there"""
+    for section, section_type, prefix in PROFIT_AND_LOSS_SECTIONS:
+        if account_type == section_type and account_code.startswith(prefix):
+            return section
+    return None
+
+
+def month_periods(first_month, count):
+    """
+    Calendar month periods [(date_from, date_to), ...] starting with the month of
+    first_month ('YYYY-MM' or a date in the month), e.g. month_periods('2025-04', 12)
+    """
+    year, month = int(first_month[:4]), int(first_month[5:7])
+    periods = []
+    for _ in range(count):
+        next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+        last_day = date(next_year, next_month, 1) - timedelta(days=1)
+        periods.append((f"{year:04d}-{month:02d}-01", last_day.isoformat()))
+        year, month = next_year, next_month
+    return periods
+
+
+def comparative_periods(periods, years=1):
+    """The same periods the given number of years earlier, for prior-year comparatives"""
+    def shift(day):
+        day = date.fromisoformat(day)
+        year = day.year - years
+        if (day + timedelta(days=1)).day == 1:
+            # Month ends stay month ends, so February follows leap years
+            next_month = date(year + day.month // 12, day.month % 12 + 1, 1)
+            return (next_month - timedelta(days=1)).isoformat()
+        return day.replace(year=year).isoformat()
+    return [(shift(date_from), shift(date_to)) for date_from, date_to in periods]
+
+
+def _day_before(day):
+    # '' sorts before every date, so a period without a start opens at zero
+    if not day:
+        return ''
+    return (date.fromisoformat(day) - timedelta(days=1)).isoformat()
+
+
+def financial_year_start(date_to, year_start='01-01'):
+    """
+    First day of the financial year containing date_to. year_start is the
+    company's financial year start, either 'MM-DD' or a full 'YYYY-MM-DD' date.
+    """
+    month_day = (year_start or '01-01')[-5:]
+    start = f"{date_to[:4]}-{month_day}"
+    if start > date_to:
+        start = f"{int(date_to[:4]) - 1:04d}-{month_day}"
+    return start
+
 
 class AccountingManager:
     def __init__(self, db_path="accounting_data.db"):
         self.db_path = db_path
+        self.master_data = get_master_data(db_path)
         
-    def connect(self):
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+    def connect(self, session=None):
+        if session is not None:
+            return session.scope()
+        return get_connection(self.db_path)
     
     def create_journal_entry(self, entry_date, entry_type, reference, description, 
-                            currency='GBP', exchange_rate=1.0, lines=[]):
+                            currency='GBP', exchange_rate=1.0, lines=[], session=None):
         """
         Create a journal entry with automatic double-entry validation
         lines = [(account_id, debit, credit, description), ...]
+        Amounts are major units in the entry currency, or Money values.
+        Pass a Session to post inside a larger unit of work.
         """
-        conn = self.connect()
+        try:
+            line_amounts = journal_line_amounts(lines, currency, exchange_rate)
+        except ValueError as e:
+            return False, None, str(e)
+        
+        conn = self.connect(session)
         cursor = conn.cursor()
         
         try:
-            # Validate double entry (debits must equal credits)
-            total_debits = sum(line[1] for line in lines)
-            total_credits = sum(line[2] for line in lines)
-            
-            if round(total_debits, 2) != round(total_credits, 2):
-                return False, None, f"Unbalanced entry: Debits={total_debits:.2f}, Credits={total_credits:.2f}"
-            
-            # Generate entry number
-            cursor.execute('SELECT COUNT(*) as count FROM journal_entries')
-            count = cursor.fetchone()['count']
-            entry_number = f"JE-{count + 1:06d}"
+            # Allocate entry number
+            entry_number = next_document_number(cursor, 'JE')
             
             # Insert journal entry header
             cursor.execute('''
@@ -44,19 +326,28 @@ class AccountingManager:
             entry_id = cursor.lastrowid
             
             # Insert journal entry lines
-            for line in lines:
-                account_id, debit, credit, line_desc = line
-                
-                # Convert to base currency if needed
-                debit_base = debit * exchange_rate
-                credit_base = credit * exchange_rate
+            account_totals = {}
+            for line in line_amounts:
+                account_id, debit, credit, debit_base, credit_base, line_desc = line
                 
                 cursor.execute('''
                     INSERT INTO journal_entry_lines
                     (entry_id, account_id, debit_amount, credit_amount, 
-                     debit_base_currency, credit_base_currency, description)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (entry_id, account_id, debit, credit, debit_base, credit_base, line_desc))
+                     debit_base_currency, credit_base_currency, description, entry_date)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (entry_id, account_id, debit, credit, debit_base, credit_base, line_desc, entry_date))
+                
+                totals = account_totals.setdefault(account_id, [0, 0])
+                totals[0] += debit_base
+                totals[1] += credit_base
+            
+            # Maintain the daily balance rollup in the same transaction
+            for account_id, (debit_base, credit_base) in account_totals.items():
+                account = self.master_data.get(cursor, 'accounts', account_id)
+                if not account:
+                    raise Exception(f"Account {account_id} not found")
+                update_period_balances(cursor, account_id, entry_date, debit_base, credit_base,
+                                       account['account_code'])
             
             conn.commit()
             return True, entry_number, "Journal entry created successfully"
@@ -81,27 +372,26 @@ class AccountingManager:
         
         account_type = account['account_type']
         
-        # Build query
+        # Look up the running totals of the latest rollup row up to the date
         query = '''
-            SELECT 
-                COALESCE(SUM(debit_base_currency), 0) as total_debits,
-                COALESCE(SUM(credit_base_currency), 0) as total_credits
-            FROM journal_entry_lines jel
-            JOIN journal_entries je ON jel.entry_id = je.entry_id
-            WHERE jel.account_id = ? AND je.status = 'Posted'
+            SELECT cumulative_debit, cumulative_credit
+            FROM account_period_balances
+            WHERE account_id = ?
         '''
         
         params = [account_id]
         
         if date_to:
-            query += ' AND je.entry_date <= ?'
+            query += ' AND balance_date <= ?'
             params.append(date_to)
         
+        query += ' ORDER BY balance_date DESC LIMIT 1'
+        
         cursor.execute(query, params)
         result = cursor.fetchone()
         
-        total_debits = result['total_debits']
-        total_credits = result['total_credits']
+        total_debits = result['cumulative_debit'] if result else 0
+        total_credits = result['cumulative_credit'] if result else 0
         
         # Calculate balance based on account type
         # Asset and Expense accounts: Debit balance (Debits - Credits)
@@ -112,36 +402,67 @@ class AccountingManager:
             balance = total_credits - total_debits
         
         conn.close()
-        return balance
+        return from_minor(balance)
     
-    def get_trial_balance(self, date_to=None):
-        """Generate trial balance report"""
+    def get_all_account_balances(self, date_to=None):
+        """
+        Get the balance of every active account up to a date in one query
+        Returns account dicts in account code order with 'balance' (the account's own
+        postings) and 'total_balance' (including all child accounts, so parent
+        accounts show subtotals).
+        """
         conn = self.connect()
         cursor = conn.cursor()
         
-        query = '''
-            SELECT 
+        cursor.execute(f'''
+            SELECT
+                a.account_id,
                 a.account_code,
                 a.account_name,
                 a.account_type,
-                COALESCE(SUM(jel.debit_base_currency), 0) as total_debits,
-                COALESCE(SUM(jel.credit_base_currency), 0) as total_credits
+                a.parent_account_id,
+                COALESCE(b.cumulative_debit, 0) as total_debits,
+                COALESCE(b.cumulative_credit, 0) as total_credits
             FROM chart_of_accounts a
-            LEFT JOIN journal_entry_lines jel ON a.account_id = jel.account_id
-            LEFT JOIN journal_entries je ON jel.entry_id = je.entry_id
+            {BALANCE_AS_OF_JOIN}
             WHERE a.is_active = 1
-        '''
+            ORDER BY a.account_code
+        ''', (date_to or '9999-12-31',))
         
-        params = []
+        accounts = [dict(row) for row in cursor.fetchall()]
+        conn.close()
         
-        if date_to:
-            query += ' AND (je.entry_date <= ? OR je.entry_date IS NULL)'
-            params.append(date_to)
+        by_id = {acc['account_id']: acc for acc in accounts}
+        totals = dict.fromkeys(by_id, 0)
         
-        query += ' AND (je.status = "Posted" OR je.status IS NULL)'
-        query += ' GROUP BY a.account_id ORDER BY a.account_code'
+        for acc in accounts:
+            # Same sign convention as get_account_balance
+            if acc['account_type'] in ['Asset', 'Expense']:
+                balance = acc.pop('total_debits') - acc.pop('total_credits')
+            else:
+                balance = acc.pop('total_credits') - acc.pop('total_debits')
+            acc['balance'] = balance
         
-        cursor.execute(query, params)
+            # Add the balance to the account and each of its ancestors
+            account_id = acc['account_id']
+            visited = set()
+            while account_id in totals and account_id not in visited:
+                totals[account_id] += balance
+                visited.add(account_id)
+                account_id = by_id[account_id]['parent_account_id']
+        
+        for acc in accounts:
+            acc['balance'] = from_minor(acc['balance'])
+            acc['total_balance'] = from_minor(totals[acc['account_id']])
+        
+        return accounts
+
+    def get_trial_balance(self, date_to=None):
+        """Generate trial balance report"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        cursor.execute(TRIAL_BALANCE_QUERY, (date_to or '9999-12-31',))
         results = cursor.fetchall()
         
         trial_balance = []
@@ -149,34 +470,17 @@ class AccountingManager:
         total_credits = 0
         
         for row in results:
-            debits = row['total_debits']
-            credits = row['total_credits']
-            
             # Calculate balance based on account type
-            if row['account_type'] in ['Asset', 'Expense']:
-                balance = debits - credits
-                if balance > 0:
-                    debit_balance = balance
-                    credit_balance = 0
-                else:
-                    debit_balance = 0
-                    credit_balance = abs(balance)
-            else:  # Liability, Equity, Revenue
-                balance = credits - debits
-                if balance > 0:
-                    credit_balance = balance
-                    debit_balance = 0
-                else:
-                    credit_balance = 0
-                    debit_balance = abs(balance)
+            debit_balance, credit_balance = trial_balance_amounts(
+                row['account_type'], row['total_debits'], row['total_credits'])
             
             if debit_balance != 0 or credit_balance != 0:
                 trial_balance.append({
                     'account_code': row['account_code'],
                     'account_name': row['account_name'],
                     'account_type': row['account_type'],
-                    'debit_balance': debit_balance,
-                    'credit_balance': credit_balance
+                    'debit_balance': from_minor(debit_balance),
+                    'credit_balance': from_minor(credit_balance)
                 })
                 
                 total_debits += debit_balance
@@ -184,219 +488,478 @@ class AccountingManager:
         
         conn.close()
         
-        return trial_balance, total_debits, total_credits
+        return trial_balance, from_minor(total_debits), from_minor(total_credits)
+    
+    def iter_trial_balance(self, date_to=None, batch_size=ITER_BATCH_SIZE):
+        """Stream the trial balance as TrialBalanceRow tuples, batch_size rows at a time"""
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(TRIAL_BALANCE_QUERY, (date_to or '9999-12-31',))
+            
+            for code, name, account_type, debits, credits in iter_batches(cursor, batch_size=batch_size):
+                debit_balance, credit_balance = trial_balance_amounts(account_type, debits, credits)
+                if debit_balance != 0 or credit_balance != 0:
+                    yield TrialBalanceRow(code, name, account_type,
+                                          from_minor(debit_balance), from_minor(credit_balance))
+        finally:
+            conn.close()
     
     def get_profit_and_loss(self, date_from, date_to):
         """Generate Profit & Loss Statement"""
+        return self.get_financial_statements(date_from, date_to)['profit_and_loss']
+    
+    def iter_profit_and_loss(self, date_from, date_to, batch_size=ITER_BATCH_SIZE):
+        """Stream the Profit & Loss accounts as ProfitLossRow tuples, in account code order"""
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            # The financial year opening balance is not needed, so bind the period start for it
+            cursor.execute(FINANCIAL_STATEMENT_QUERY, (date_to, date_from, date_from))
+            
+            for code, name, account_type, closing, opening, _ in iter_batches(cursor, batch_size=batch_size):
+                section = profit_and_loss_section(account_type, code)
+                amount = closing - opening
+                if section and amount != 0:
+                    yield ProfitLossRow(section, code, name, from_minor(-amount if account_type == 'Revenue' else amount))
+        finally:
+            conn.close()
+    
+    def get_balance_sheet(self, date_to):
+        """Generate Balance Sheet"""
+        return self.get_financial_statements(None, date_to)['balance_sheet']
+    
+    def get_financial_statements(self, date_from, date_to):
+        """
+        Generate the Profit & Loss for date_from to date_to and the Balance Sheet at
+        date_to together, from one query over the chart of accounts and the balance
+        rollup. Accounts are classified into statement sections in memory, and profit
+        not yet closed off to equity is shown as Retained Earnings (earlier financial
+        years) and Current Year Earnings. date_from defaults to the financial year start.
+        Returns {'profit_and_loss': {...}, 'balance_sheet': {...}}
+        """
         conn = self.connect()
         cursor = conn.cursor()
         
-        # Get Revenue
-        cursor.execute('''
-            SELECT 
-                a.account_code,
-                a.account_name,
-                COALESCE(SUM(jel.credit_base_currency - jel.debit_base_currency), 0) as amount
-            FROM chart_of_accounts a
-            LEFT JOIN journal_entry_lines jel ON a.account_id = jel.account_id
-            LEFT JOIN journal_entries je ON jel.entry_id = je.entry_id
-            WHERE a.account_type = 'Revenue' 
-            AND a.is_active = 1
-            AND je.status = 'Posted'
-            AND je.entry_date >= ? AND je.entry_date <= ?
-            GROUP BY a.account_id
-            HAVING amount != 0
-            ORDER BY a.account_code
-        ''', (date_from, date_to))
-        
-        revenue_accounts = [dict(row) for row in cursor.fetchall()]
-        total_revenue = sum(acc['amount'] for acc in revenue_accounts)
+        year_start = self._financial_year_start(cursor, date_to)
+        date_from = date_from or year_start
         
-        # Get Cost of Sales
-        cursor.execute('''
-            SELECT 
-                a.account_code,
-                a.account_name,
-                COALESCE(SUM(jel.debit_base_currency - jel.credit_base_currency), 0) as amount
-            FROM chart_of_accounts a
-            LEFT JOIN journal_entry_lines jel ON a.account_id = jel.account_id
-            LEFT JOIN journal_entries je ON jel.entry_id = je.entry_id
-            WHERE a.account_type = 'Expense' 
-            AND a.account_code LIKE '5%'
-            AND a.is_active = 1
-            AND je.status = 'Posted'
-            AND je.entry_date >= ? AND je.entry_date <= ?
-            GROUP BY a.account_id
-            HAVING amount != 0
-            ORDER BY a.account_code
-        ''', (date_from, date_to))
+        cursor.execute(FINANCIAL_STATEMENT_QUERY, (date_to, date_from, year_start))
+        results = cursor.fetchall()
+        conn.close()
         
-        cogs_accounts = [dict(row) for row in cursor.fetchall()]
-        total_cogs = sum(acc['amount'] for acc in cogs_accounts)
+        sections = {section: [] for section, *_ in PROFIT_AND_LOSS_SECTIONS + BALANCE_SHEET_SECTIONS}
+        balance_sheet_sections = {account_type: section for section, account_type in BALANCE_SHEET_SECTIONS}
+        prior_earnings = 0
+        current_earnings = 0
         
-        # Get Operating Expenses
-        cursor.execute('''
-            SELECT 
-                a.account_code,
-                a.account_name,
-                COALESCE(SUM(jel.debit_base_currency - jel.credit_base_currency), 0) as amount
-            FROM chart_of_accounts a
-            LEFT JOIN journal_entry_lines jel ON a.account_id = jel.account_id
-            LEFT JOIN journal_entries je ON jel.entry_id = je.entry_id
-            WHERE a.account_type = 'Expense' 
-            AND a.account_code LIKE '6%'
-            AND a.is_active = 1
-            AND je.status = 'Posted'
-            AND je.entry_date >= ? AND je.entry_date <= ?
-            GROUP BY a.account_id
-            HAVING amount != 0
-            ORDER BY a.account_code
-        ''', (date_from, date_to))
+        for row in results:
+            account_type = row['account_type']
+            closing = row['closing_balance']
+            
+            if account_type in ['Revenue', 'Expense']:
+                # Balances are net debits, profit is a net credit
+                prior_earnings -= row['year_opening_balance']
+                current_earnings -= closing - row['year_opening_balance']
+                
+                section = profit_and_loss_section(account_type, row['account_code'])
+                amount = closing - row['period_opening_balance']
+                if account_type == 'Revenue':
+                    amount = -amount
+            else:
+                section = balance_sheet_sections.get(account_type)
+                amount = closing if account_type == 'Asset' else -closing
+            
+            if section:
+                sections[section].append({
+                    'account_code': row['account_code'],
+                    'account_name': row['account_name'],
+                    'amount': amount
+                })
         
-        expense_accounts = [dict(row) for row in cursor.fetchall()]
-        total_expenses = sum(acc['amount'] for acc in expense_accounts)
+        # Roll unclosed profit into equity, on the earnings accounts if the chart has them
+        for (code, name), earnings in ((RETAINED_EARNINGS_ACCOUNT, prior_earnings),
+                                       (CURRENT_YEAR_EARNINGS_ACCOUNT, current_earnings)):
+            account = next((acc for acc in sections['equity'] if acc['account_code'] == code), None)
+            if account is None:
+                account = {'account_code': code, 'account_name': name, 'amount': 0}
+                sections['equity'].append(account)
+            account['amount'] += earnings
+        sections['equity'].sort(key=lambda acc: acc['account_code'])
         
-        gross_profit = total_revenue - total_cogs
-        net_profit = gross_profit - total_expenses
+        # Totals are exact integer sums, converted to pounds only for the report
+        totals = {}
+        for section, accounts in sections.items():
+            accounts = sections[section] = [acc for acc in accounts if acc['amount'] != 0]
+            totals[section] = sum(acc['amount'] for acc in accounts)
+            for acc in accounts:
+                acc['amount'] = from_minor(acc['amount'])
         
-        conn.close()
+        gross_profit = totals['revenue'] - totals['cogs']
+        net_profit = gross_profit - totals['expenses']
         
         return {
-            'revenue': revenue_accounts,
-            'total_revenue': total_revenue,
-            'cogs': cogs_accounts,
-            'total_cogs': total_cogs,
-            'gross_profit': gross_profit,
-            'expenses': expense_accounts,
-            'total_expenses': total_expenses,
-            'net_profit': net_profit
+            'profit_and_loss': {
+                'revenue': sections['revenue'],
+                'total_revenue': from_minor(totals['revenue']),
+                'cogs': sections['cogs'],
+                'total_cogs': from_minor(totals['cogs']),
+                'gross_profit': from_minor(gross_profit),
+                'expenses': sections['expenses'],
+                'total_expenses': from_minor(totals['expenses']),
+                'net_profit': from_minor(net_profit)
+            },
+            'balance_sheet': {
+                'assets': sections['assets'],
+                'total_assets': from_minor(totals['assets']),
+                'liabilities': sections['liabilities'],
+                'total_liabilities': from_minor(totals['liabilities']),
+                'equity': sections['equity'],
+                'total_equity': from_minor(totals['equity']),
+                'retained_earnings': from_minor(prior_earnings),
+                'current_year_earnings': from_minor(current_earnings),
+                'total_liabilities_equity': from_minor(totals['liabilities'] + totals['equity'])
+            }
         }
     
-    def get_balance_sheet(self, date_to):
-        """Generate Balance Sheet"""
+    def _financial_year_start(self, cursor, date_to):
+        """Start of the company's financial year containing date_to"""
+        cursor.execute('SELECT financial_year_start FROM company_settings ORDER BY id LIMIT 1')
+        settings = cursor.fetchone()
+        return financial_year_start(date_to, settings['financial_year_start'] if settings else None)
+    
+    def get_period_matrix(self, periods, use_numpy=None):
+        """
+        Get the net debit movement and closing balance of every active account for
+        several periods with one query, which reads the balance rollup at each period
+        boundary. periods = [(date_from, date_to), ...]; a date_from of None means
+        from the first posting.
+        Returns (accounts, movements, closing): accounts in code order, and matrices
+        where movements[i][p] and closing[i][p] are the minor-unit amounts of account i
+        in period p. The matrices are NumPy arrays when NumPy is installed, or lists
+        of lists with use_numpy=False.
+        """
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        elif use_numpy and numpy is None:
+            raise ImportError("NumPy is not installed")
+        
+        # The balance before a period is the balance at the end of the day before it
+        openings = [_day_before(date_from) for date_from, date_to in periods]
+        closings = [date_to for date_from, date_to in periods]
+        cutoffs = sorted(set(openings + closings))
+        column = {cutoff: i for i, cutoff in enumerate(cutoffs)}
+        
         conn = self.connect()
         cursor = conn.cursor()
         
-        # Get Assets
         cursor.execute('''
-            SELECT 
-                a.account_code,
-                a.account_name,
-                COALESCE(SUM(jel.debit_base_currency - jel.credit_base_currency), 0) as amount
-            FROM chart_of_accounts a
-            LEFT JOIN journal_entry_lines jel ON a.account_id = jel.account_id
-            LEFT JOIN journal_entries je ON jel.entry_id = je.entry_id
-            WHERE a.account_type = 'Asset' 
-            AND a.is_active = 1
-            AND je.status = 'Posted'
-            AND je.entry_date <= ?
-            GROUP BY a.account_id
-            HAVING amount != 0
-            ORDER BY a.account_code
-        ''', (date_to,))
+            SELECT account_id, account_code, account_name, account_type
+            FROM chart_of_accounts WHERE is_active = 1 ORDER BY account_code
+        ''')
+        accounts = [dict(row) for row in cursor.fetchall()]
+        
+        cursor.execute(PERIOD_MATRIX_QUERY.format(cutoffs=', '.join(['(?)'] * len(cutoffs))), cutoffs)
+        results = cursor.fetchall()
+        conn.close()
         
-        asset_accounts = [dict(row) for row in cursor.fetchall()]
-        total_assets = sum(acc['amount'] for acc in asset_accounts)
+        row_of = {acc['account_id']: i for i, acc in enumerate(accounts)}
+        opening_columns = [column[cutoff] for cutoff in openings]
+        closing_columns = [column[cutoff] for cutoff in closings]
         
-        # Get Liabilities
-        cursor.execute('''
-            SELECT 
-                a.account_code,
-                a.account_name,
-                COALESCE(SUM(jel.credit_base_currency - jel.debit_base_currency), 0) as amount
-            FROM chart_of_accounts a
-            LEFT JOIN journal_entry_lines jel ON a.account_id = jel.account_id
-            LEFT JOIN journal_entries je ON jel.entry_id = je.entry_id
-            WHERE a.account_type = 'Liability' 
-            AND a.is_active = 1
-            AND je.status = 'Posted'
-            AND je.entry_date <= ?
-            GROUP BY a.account_id
-            HAVING amount != 0
-            ORDER BY a.account_code
-        ''', (date_to,))
+        if use_numpy:
+            balances = numpy.zeros((len(accounts), len(cutoffs)), dtype=numpy.int64)
+            if results:
+                account_ids, cutoff_dates, amounts = zip(*results)
+                balances[[row_of[account_id] for account_id in account_ids],
+                         [column[cutoff] for cutoff in cutoff_dates]] = amounts
+            closing = balances[:, closing_columns]
+            return accounts, closing - balances[:, opening_columns], closing
         
-        liability_accounts = [dict(row) for row in cursor.fetchall()]
-        total_liabilities = sum(acc['amount'] for acc in liability_accounts)
+        balances = [[0] * len(cutoffs) for _ in accounts]
+        for account_id, cutoff, amount in results:
+            balances[row_of[account_id]][column[cutoff]] = amount
         
-        # Get Equity
-        cursor.execute('''
-            SELECT 
-                a.account_code,
-                a.account_name,
-                COALESCE(SUM(jel.credit_base_currency - jel.debit_base_currency), 0) as amount
-            FROM chart_of_accounts a
-            LEFT JOIN journal_entry_lines jel ON a.account_id = jel.account_id
-            LEFT JOIN journal_entries je ON jel.entry_id = je.entry_id
-            WHERE a.account_type = 'Equity' 
-            AND a.is_active = 1
-            AND je.status = 'Posted'
-            AND je.entry_date <= ?
-            GROUP BY a.account_id
-            HAVING amount != 0
-            ORDER BY a.account_code
-        ''', (date_to,))
+        closing = [[row[c] for c in closing_columns] for row in balances]
+        movements = [[row[c] - row[o] for c, o in zip(closing_columns, opening_columns)] for row in balances]
+        return accounts, movements, closing
+    
+    def get_multi_period_profit_and_loss(self, periods, use_numpy=None):
+        """
+        Generate the Profit & Loss for several periods at once, e.g. twelve months and
+        their prior-year comparatives, from one get_period_matrix() query.
+        Returns the get_profit_and_loss() structure with a list of amounts, one per
+        period, in place of each amount.
+        """
+        accounts, movements, closing = self.get_period_matrix(periods, use_numpy)
+        
+        sections = {section: [] for section, *_ in PROFIT_AND_LOSS_SECTIONS}
+        totals = {section: [0] * len(periods) for section in sections}
         
-        equity_accounts = [dict(row) for row in cursor.fetchall()]
-        total_equity = sum(acc['amount'] for acc in equity_accounts)
+        for acc, amounts in zip(accounts, movements):
+            section = profit_and_loss_section(acc['account_type'], acc['account_code'])
+            if section is None or not any(amounts):
+                continue
+            
+            sign = -1 if acc['account_type'] == 'Revenue' else 1
+            amounts = [sign * int(amount) for amount in amounts]
+            sections[section].append({
+                'account_code': acc['account_code'],
+                'account_name': acc['account_name'],
+                'amounts': [from_minor(amount) for amount in amounts]
+            })
+            totals[section] = [total + amount for total, amount in zip(totals[section], amounts)]
         
-        total_liabilities_equity = total_liabilities + total_equity
+        gross_profit = [revenue - cogs for revenue, cogs in zip(totals['revenue'], totals['cogs'])]
+        net_profit = [gross - expenses for gross, expenses in zip(gross_profit, totals['expenses'])]
         
-        conn.close()
+        def major(amounts):
+            return [from_minor(amount) for amount in amounts]
         
         return {
-            'assets': asset_accounts,
-            'total_assets': total_assets,
-            'liabilities': liability_accounts,
-            'total_liabilities': total_liabilities,
-            'equity': equity_accounts,
-            'total_equity': total_equity,
-            'total_liabilities_equity': total_liabilities_equity
+            'periods': list(periods),
+            'revenue': sections['revenue'],
+            'total_revenue': major(totals['revenue']),
+            'cogs': sections['cogs'],
+            'total_cogs': major(totals['cogs']),
+            'gross_profit': major(gross_profit),
+            'expenses': sections['expenses'],
+            'total_expenses': major(totals['expenses']),
+            'net_profit': major(net_profit)
         }
     
+    def get_multi_period_trial_balance(self, periods, use_numpy=None):
+        """
+        Generate the trial balance at the end of several periods from one
+        get_period_matrix() query. Returns (trial_balance, total_debits, total_credits)
+        like get_trial_balance(), with a list of amounts per period in place of each amount.
+        """
+        accounts, movements, closing = self.get_period_matrix(periods, use_numpy)
+        
+        trial_balance = []
+        total_debits = [0] * len(periods)
+        total_credits = [0] * len(periods)
+        
+        for acc, balances in zip(accounts, closing):
+            if not any(balances):
+                continue
+            
+            columns = [trial_balance_amounts(acc['account_type'], int(balance), 0) for balance in balances]
+            trial_balance.append({
+                'account_code': acc['account_code'],
+                'account_name': acc['account_name'],
+                'account_type': acc['account_type'],
+                'debit_balances': [from_minor(debit) for debit, credit in columns],
+                'credit_balances': [from_minor(credit) for debit, credit in columns]
+            })
+            total_debits = [total + debit for total, (debit, credit) in zip(total_debits, columns)]
+            total_credits = [total + credit for total, (debit, credit) in zip(total_credits, columns)]
+        
+        return (trial_balance, [from_minor(total) for total in total_debits],
+                [from_minor(total) for total in total_credits])
+    
     def get_general_ledger(self, account_id, date_from=None, date_to=None):
         """Get general ledger for a specific account"""
         conn = self.connect()
         cursor = conn.cursor()
         
         # Get account info
-        cursor.execute('SELECT account_code, account_name, account_type FROM chart_of_accounts WHERE account_id = ?', 
-                      (account_id,))
-        account = cursor.fetchone()
+        account = self._get_ledger_account(cursor, account_id)
         
         if not account:
             conn.close()
             return None, []
         
         # Get opening balance
-        opening_balance = 0
-        if date_from:
-            cursor.execute('''
-                SELECT 
-                    COALESCE(SUM(debit_base_currency), 0) as debits,
-                    COALESCE(SUM(credit_base_currency), 0) as credits
-                FROM journal_entry_lines jel
-                JOIN journal_entries je ON jel.entry_id = je.entry_id
-                WHERE jel.account_id = ? AND je.entry_date < ? AND je.status = 'Posted'
-            ''', (account_id, date_from))
-            
-            result = cursor.fetchone()
-            if account['account_type'] in ['Asset', 'Expense']:
-                opening_balance = result['debits'] - result['credits']
-            else:
-                opening_balance = result['credits'] - result['debits']
+        opening_balance = self._opening_balance(cursor, account_id, date_from)
         
         # Get transactions
-        query = '''
-            SELECT 
-                je.entry_number,
-                je.entry_date,
-                je.entry_type,
-                je.reference,
-                jel.description,
-                jel.debit_amount,
-                jel.credit_amount,
-                je.currency
+        query, params = self._general_ledger_query(GENERAL_LEDGER_COLUMNS, account_id, date_from, date_to)
+        query += f' ORDER BY {GENERAL_LEDGER_ORDER}'
+        
+        cursor.execute(query, params)
+        transactions = [dict(row) for row in cursor.fetchall()]
+        
+        # Calculate running balance in minor units
+        self._add_running_balances(account, transactions, opening_balance)
+        
+        conn.close()
+        
+        return dict(account), transactions, from_minor(opening_balance)
+    
+    def iter_general_ledger(self, account_id, date_from=None, date_to=None, batch_size=ITER_BATCH_SIZE):
+        """
+        Stream the general ledger of an account as LedgerRow tuples with running
+        balances, batch_size rows at a time, so exports read any account in constant memory
+        """
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            
+            account = self._get_ledger_account(cursor, account_id)
+            if not account:
+                return
+            
+            balance = self._opening_balance(cursor, account_id, date_from)
+            sign = 1 if account['account_type'] in ['Asset', 'Expense'] else -1
+            
+            query, params = self._general_ledger_query(GENERAL_LEDGER_COLUMNS, account_id, date_from, date_to)
+            cursor.execute(query + f' ORDER BY {GENERAL_LEDGER_ORDER}', params)
+            
+            for row in iter_batches(cursor, batch_size=batch_size):
+                *columns, debit, credit, currency = row
+                balance += sign * (debit - credit)
+                yield LedgerRow(*columns, from_minor(debit, currency), from_minor(credit, currency),
+                                currency, from_minor(balance))
+        finally:
+            conn.close()
+    
+    def get_general_ledger_page(self, account_id, date_from=None, date_to=None, after=None, limit=200):
+        """
+        Get one page of the general ledger for a specific account
+        Pages are keyset-paginated: pass the cursor returned with a page as after= to
+        get the next one. The cursor also carries the running balance at the end of
+        the page, so balances continue without reading earlier lines again.
+        Returns (transactions, next_cursor); next_cursor is None after the last page.
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        account = self._get_ledger_account(cursor, account_id)
+        
+        if not account:
+            conn.close()
+            return [], None
+        
+        if after is None:
+            balance = self._opening_balance(cursor, account_id, date_from)
+        else:
+            balance = after[3]
+        
+        query, params = self._general_ledger_query(GENERAL_LEDGER_COLUMNS, account_id,
+                                                   date_from, date_to, after=after)
+        query += f' ORDER BY {GENERAL_LEDGER_ORDER} LIMIT ?'
+        params.append(limit)
+        
+        cursor.execute(query, params)
+        transactions = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        
+        balance = self._add_running_balances(account, transactions, balance)
+        
+        next_cursor = None
+        if len(transactions) == limit:
+            last = transactions[-1]
+            next_cursor = (last['entry_date'], last['entry_id'], last['line_id'], balance)
+        
+        return transactions, next_cursor
+    
+    def get_general_ledger_cursor(self, account_id, offset, date_from=None, date_to=None, checkpoint=None):
+        """
+        Get the cursor for a general ledger page starting at row offset, so that a
+        screen can jump into the middle of an account without reading the pages before it.
+        checkpoint = (checkpoint_offset, cursor) is a cursor already known, e.g. of a
+        page loaded before: rows are counted from it, forwards or backwards, instead
+        of from the first row. Returns None for the first row or an offset past the end.
+        """
+        if offset <= 0:
+            return None
+        
+        start_offset, start = checkpoint if checkpoint and checkpoint[1] else (0, None)
+        if offset == start_offset:
+            return start
+        
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        account = self._get_ledger_account(cursor, account_id)
+        
+        # Key of the last row before the offset, counted from the checkpoint row
+        if offset > start_offset:
+            query, params = self._general_ledger_query('jel.entry_date, jel.entry_id, jel.line_id',
+                                                       account_id, date_from, date_to, after=start)
+            query += f' ORDER BY {GENERAL_LEDGER_ORDER} LIMIT 1 OFFSET ?'
+            params.append(offset - start_offset - 1)
+        else:
+            query, params = self._general_ledger_query('jel.entry_date, jel.entry_id, jel.line_id',
+                                                       account_id, date_from, date_to, through=start)
+            query += f' ORDER BY {GENERAL_LEDGER_ORDER_DESC} LIMIT 1 OFFSET ?'
+            params.append(start_offset - offset)
+        cursor.execute(query, params)
+        key = cursor.fetchone()
+        
+        if not account or not key:
+            conn.close()
+            return None
+        
+        # Running balance up to and including that row, from the rows between it and the checkpoint
+        totals_columns = ('COALESCE(SUM(jel.debit_amount), 0) as debits, '
+                          'COALESCE(SUM(jel.credit_amount), 0) as credits')
+        if start is None:
+            balance, sign = self._opening_balance(cursor, account_id, date_from), 1
+            query, params = self._general_ledger_query(totals_columns, account_id, date_from, date_to,
+                                                       through=tuple(key))
+        elif offset > start_offset:
+            balance, sign = start[3], 1
+            query, params = self._general_ledger_query(totals_columns, account_id, date_from, date_to,
+                                                       after=start, through=tuple(key))
+        else:
+            balance, sign = start[3], -1
+            query, params = self._general_ledger_query(totals_columns, account_id, date_from, date_to,
+                                                       after=tuple(key), through=start)
+        cursor.execute(query, params)
+        totals = cursor.fetchone()
+        conn.close()
+        
+        if account['account_type'] in ['Asset', 'Expense']:
+            balance += sign * (totals['debits'] - totals['credits'])
+        else:
+            balance += sign * (totals['credits'] - totals['debits'])
+        
+        return (key['entry_date'], key['entry_id'], key['line_id'], balance)
+    
+    def count_general_ledger(self, account_id, date_from=None, date_to=None):
+        """Count the general ledger lines of an account, e.g. to size a scrollbar"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        query, params = self._general_ledger_query('COUNT(*)', account_id, date_from, date_to)
+        cursor.execute(query, params)
+        count = cursor.fetchone()[0]
+        
+        conn.close()
+        return count
+    
+    def _get_ledger_account(self, cursor, account_id):
+        cursor.execute('SELECT account_code, account_name, account_type FROM chart_of_accounts WHERE account_id = ?', 
+                      (account_id,))
+        return cursor.fetchone()
+    
+    def _opening_balance(self, cursor, account_id, date_from):
+        """Balance of an account before a date in minor units, from the rollup"""
+        if not date_from:
+            return 0
+        
+        cursor.execute('''
+            SELECT a.account_type, b.cumulative_debit as debits, b.cumulative_credit as credits
+            FROM chart_of_accounts a
+            JOIN account_period_balances b ON b.account_id = a.account_id
+            WHERE a.account_id = ? AND b.balance_date < ?
+            ORDER BY b.balance_date DESC LIMIT 1
+        ''', (account_id, date_from))
+        
+        result = cursor.fetchone()
+        if not result:
+            return 0
+        elif result['account_type'] in ['Asset', 'Expense']:
+            return result['debits'] - result['credits']
+        else:
+            return result['credits'] - result['debits']
+    
+    def _general_ledger_query(self, columns, account_id, date_from, date_to, after=None, through=None):
+        """Build the general ledger query for an account, optionally after or up to a row key"""
+        query = f'''
+            SELECT {columns}
             FROM journal_entry_lines jel
             JOIN journal_entries je ON jel.entry_id = je.entry_id
             WHERE jel.account_id = ? AND je.status = 'Posted'
@@ -405,27 +968,90 @@ class AccountingManager:
         params = [account_id]
         
         if date_from:
-            query += ' AND je.entry_date >= ?'
+            query += ' AND jel.entry_date >= ?'
             params.append(date_from)
         
         if date_to:
-            query += ' AND je.entry_date <= ?'
+            query += ' AND jel.entry_date <= ?'
             params.append(date_to)
         
-        query += ' ORDER BY je.entry_date, je.entry_number'
+        if after:
+            query += ' AND (jel.entry_date, jel.entry_id, jel.line_id) > (?, ?, ?)'
+            params.extend(after[:3])
         
-        cursor.execute(query, params)
-        transactions = [dict(row) for row in cursor.fetchall()]
+        if through:
+            query += ' AND (jel.entry_date, jel.entry_id, jel.line_id) <= (?, ?, ?)'
+            params.extend(through[:3])
         
-        # Calculate running balance
-        balance = opening_balance
+        return query, params
+    
+    def _add_running_balances(self, account, transactions, balance):
+        """Add running balances to ledger rows, convert their amounts and return the closing balance"""
         for trans in transactions:
             if account['account_type'] in ['Asset', 'Expense']:
                 balance += trans['debit_amount'] - trans['credit_amount']
             else:
                 balance += trans['credit_amount'] - trans['debit_amount']
-            trans['balance'] = balance
+            trans['balance'] = from_minor(balance)
+            trans['debit_amount'] = from_minor(trans['debit_amount'], trans['currency'])
+            trans['credit_amount'] = from_minor(trans['credit_amount'], trans['currency'])
+        return balance
+    
+    def rebuild_period_balances(self):
+        """Rebuild the daily account balance rollup from the journal lines"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        try:
+            row_count = rebuild_period_balances(cursor)
+            conn.commit()
+            return True, row_count, "Account balances rebuilt successfully"
+        except Exception as e:
+            conn.rollback()
+            return False, None, str(e)
+        finally:
+            conn.close()
+    
+    def check_period_balances(self):
+        """
+        Compare the daily balance rollup against the journal lines and return any differences.
+        Amounts are integer pence, so any difference at all is reported.
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        cursor.execute(PERIOD_BALANCES_QUERY)
+        expected = {(row['account_id'], row['balance_date']): row for row in cursor.fetchall()}
+        
+        cursor.execute('''
+            SELECT account_id, balance_date, debit_amount, credit_amount,
+                   cumulative_debit, cumulative_credit
+            FROM account_period_balances
+        ''')
+        actual = {(row['account_id'], row['balance_date']): row for row in cursor.fetchall()}
         
         conn.close()
         
-        return dict(account), transactions, opening_balance
+        columns = ('debit_amount', 'credit_amount', 'cumulative_debit', 'cumulative_credit')
+        discrepancies = []
+        
+        for key in sorted(set(expected) | set(actual)):
+            expected_row = expected.get(key)
+            actual_row = actual.get(key)
+            
+            # Days with no movement carry no information, so an all-zero row is not a difference
+            expected_values = [expected_row[col] if expected_row else 0 for col in columns]
+            actual_values = [actual_row[col] if actual_row else 0 for col in columns]
+            
+            if expected_row is None and actual_row['debit_amount'] == 0 and actual_row['credit_amount'] == 0:
+                continue
+            
+            if expected_values != actual_values:
+                discrepancies.append({
+                    'account_id': key[0],
+                    'balance_date': key[1],
+                    'expected': dict(zip(columns, expected_values)),
+                    'actual': dict(zip(columns, actual_values))
+                })
+        
+        return discrepancies
@@ -3,6 +3,7 @@ from datetime import datetime, timedelta
 from inventory import InventoryManager
 from accounting import AccountingManager
 from transactions import SalesManager, PurchaseManager
+from master_data import invalidate_master_data
 
 def add_sample_data():
     db_path = "accounting_data.db"
@@ -130,6 +131,7 @@ def add_sample_data():
             item_ids[item[0]] = cursor.fetchone()[0]
     
     conn.commit()
+    invalidate_master_data(db_path)
     
     # Add some stock receipts
     print("Adding stock receipts...")
@@ -0,0 +1,240 @@
+from datetime import date, timedelta
+from connection_pool import get_connection
+from money import Money, from_minor
+
+# Parties aged, with their documents and master table
+PARTY_TABLES = {
+    'Customer': {'documents': 'sales_invoices', 'date': 'invoice_date', 'party': 'customer_id',
+                 'table': 'customers', 'code': 'customer_code', 'name': 'customer_name'},
+    'Supplier': {'documents': 'purchase_bills', 'date': 'bill_date', 'party': 'supplier_id',
+                 'table': 'suppliers', 'code': 'supplier_code', 'name': 'supplier_name'},
+}
+
+# Ageing buckets by days past the due date: (label, last day of the bucket or None)
+AGEING_BUCKETS = (
+    ('Current', 0),
+    ('1-30', 30),
+    ('31-60', 60),
+    ('61-90', 90),
+    ('90+', None),
+)
+
+
+def ageing_boundaries(as_of):
+    """
+    AGEING_BUCKETS as due dates for an as_of date: [(label, boundary), ...], where a
+    document due on or after a boundary is in that bucket or a newer one
+    """
+    return [(label, (as_of - timedelta(days=days)).isoformat() if days is not None else '')
+            for label, days in AGEING_BUCKETS]
+
+
+def bucket_sums(boundaries, column):
+    """SQL sums of column per bucket of due dates, newest first, and their parameters"""
+    sums = []
+    parameters = []
+    newer = None
+    for label, boundary in boundaries:
+        if newer is None:
+            sums.append(f'SUM(CASE WHEN due_date >= ? THEN {column} ELSE 0 END)')
+            parameters.append(boundary)
+        else:
+            sums.append(f'SUM(CASE WHEN due_date >= ? AND due_date < ? THEN {column} ELSE 0 END)')
+            parameters.extend((boundary, newer))
+        newer = boundary
+    return sums, parameters
+
+
+def document_base_amount(amount, currency, exchange_rate):
+    """An invoice or bill amount in base currency minor units"""
+    return Money(amount, currency).convert(exchange_rate).minor
+
+
+def due_date_of(document):
+    """Due date an invoice or bill is aged by: documents without one are due on their own date"""
+    return document['due_date'] or document['document_date'] or ''
+
+
+def update_ageing_balances(cursor, party_type, changes):
+    """
+    Record invoices or bills whose amount outstanding changed, one update per party
+    and due date: changes = [(document, old_outstanding, new_outstanding), ...], where
+    document has party_id, currency, exchange_rate, due_date and document_date
+    """
+    balances = {}
+    for document, old_outstanding, new_outstanding in changes:
+        balance = balances.setdefault((document['party_id'], due_date_of(document)), [0, 0])
+        balance[0] += (new_outstanding > 0) - (old_outstanding > 0)
+        # Amounts are in base currency, rounded per document as when recalculated
+        balance[1] += (document_base_amount(new_outstanding, document['currency'], document['exchange_rate']) -
+                       document_base_amount(old_outstanding, document['currency'], document['exchange_rate']))
+
+    changed = [(party_type, party_id, due_date, count, amount)
+               for (party_id, due_date), (count, amount) in sorted(balances.items()) if count or amount]
+    cursor.executemany('''
+        INSERT INTO ageing_balances (party_type, party_id, due_date, count, amount)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(party_type, party_id, due_date) DO UPDATE SET
+            count = count + excluded.count,
+            amount = amount + excluded.amount
+    ''', changed)
+
+    # Due dates whose documents are all paid no longer need a row
+    cursor.executemany('''
+        DELETE FROM ageing_balances
+        WHERE party_type = ? AND party_id = ? AND due_date = ? AND count = 0 AND amount = 0
+    ''', [row[:3] for row in changed if row[3] < 0])
+
+
+def add_ageing_balances(cursor, party_type, documents):
+    """Age new invoices or bills, outstanding in full"""
+    update_ageing_balances(cursor, party_type, [(document, 0, document['total_amount']) for document in documents])
+
+
+def calculate_ageing_balances(cursor):
+    """Recalculate the ageing balances from the documents: {(party_type, party_id, due_date): (count, amount)}"""
+    balances = {}
+    for party_type, columns in PARTY_TABLES.items():
+        cursor.execute(f'''
+            SELECT {columns['party']}, {columns['date']}, due_date, amount_outstanding, currency, exchange_rate
+            FROM {columns['documents']} WHERE amount_outstanding > 0
+        ''')
+        # Migrations run on a plain cursor, so rows are read as tuples
+        for party_id, document_date, due_date, outstanding, currency, exchange_rate in cursor.fetchall():
+            key = (party_type, party_id, due_date_of({'due_date': due_date, 'document_date': document_date}))
+            count, amount = balances.get(key, (0, 0))
+            balances[key] = (count + 1, amount + document_base_amount(outstanding, currency, exchange_rate))
+    return balances
+
+
+def rebuild_ageing_balances(cursor):
+    """Recreate the ageing balances from the documents"""
+    cursor.execute('DELETE FROM ageing_balances')
+    cursor.executemany('''
+        INSERT INTO ageing_balances (party_type, party_id, due_date, count, amount) VALUES (?, ?, ?, ?, ?)
+    ''', [(*key, count, amount) for key, (count, amount) in sorted(calculate_ageing_balances(cursor).items())])
+
+
+def ageing_summary(cursor, party_type, as_of, count, amount):
+    """
+    Ageing of all of a party type's documents as of as_of, given their total count and
+    amount: [(label, count, amount), ...]. Only the due dates of the dated buckets are
+    read, through the due date index; the oldest bucket is the rest of the total.
+    """
+    boundaries = ageing_boundaries(as_of)[:-1]
+    count_sums, count_parameters = bucket_sums(boundaries, 'count')
+    amount_sums, amount_parameters = bucket_sums(boundaries, 'amount')
+    cursor.execute(f'''
+        SELECT {', '.join(count_sums + amount_sums)}
+        FROM ageing_balances
+        WHERE party_type = ? AND due_date >= ?
+    ''', count_parameters + amount_parameters + [party_type, boundaries[-1][1]])
+    row = cursor.fetchone()
+
+    counts = [value or 0 for value in row[:len(boundaries)]]
+    amounts = [value or 0 for value in row[len(boundaries):]]
+    counts.append(count - sum(counts))
+    amounts.append(amount - sum(amounts))
+    return [(label, bucket_count, bucket_amount)
+            for (label, _), bucket_count, bucket_amount in zip(AGEING_BUCKETS, counts, amounts)]
+
+
+class AgeingReport:
+    """
+    Receivables and payables ageing from ageing_balances, the amount outstanding of
+    every customer and supplier per due date in base currency, which invoices, bills
+    and payments update in their own transactions. Buckets are worked out from the
+    due dates when the report is read, so the balances never need re-bucketing.
+    """
+    def __init__(self, db_path="accounting_data.db"):
+        self.db_path = db_path
+
+    def connect(self):
+        return get_connection(self.db_path)
+
+    def get_ageing(self, party_type, as_of=None, party_id=None):
+        """
+        Get the ageing of every customer or supplier with an amount outstanding (or of
+        one party), as of as_of (default today), in one read of ageing_balances:
+        [{'party_id', 'party_code', 'party_name', 'count', 'total', <bucket label>: amount, ...}]
+        """
+        as_of = date.fromisoformat(as_of) if as_of else date.today()
+        columns = PARTY_TABLES[party_type]
+
+        # One sum per bucket, of the due dates from its boundary up to the next newer one
+        sums, parameters = bucket_sums(ageing_boundaries(as_of), 'amount')
+
+        party_filter = 'AND party_id = ?' if party_id is not None else ''
+        parameters.append(party_type)
+        if party_id is not None:
+            parameters.append(party_id)
+
+        conn = self.connect()
+        cursor = conn.cursor()
+        # Rows are read in primary key order, so each party is summed without sorting,
+        # and parties are put in name order afterwards rather than by a sort in SQLite
+        cursor.execute(f'''
+            SELECT b.*, p.{columns['code']} as party_code, p.{columns['name']} as party_name
+            FROM (
+                SELECT party_id, SUM(count) as count, SUM(amount) as total, {', '.join(sums)}
+                FROM ageing_balances
+                WHERE party_type = ? {party_filter}
+                GROUP BY party_id
+            ) b
+            LEFT JOIN {columns['table']} p ON p.{columns['party']} = b.party_id
+        ''', parameters)
+        rows = cursor.fetchall()
+        conn.close()
+
+        ageing = []
+        for row in rows:
+            party = {'party_id': row['party_id'], 'party_code': row['party_code'], 'party_name': row['party_name'],
+                     'count': row['count'], 'total': from_minor(row['total'])}
+            for index, (label, _) in enumerate(AGEING_BUCKETS):
+                party[label] = from_minor(row[3 + index])
+            ageing.append(party)
+        ageing.sort(key=lambda party: (party['party_name'] or '', party['party_id']))
+        return ageing
+
+    def check_ageing_balances(self):
+        """Reconcile the ageing balances against the documents and return any differences"""
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        expected = calculate_ageing_balances(cursor)
+
+        cursor.execute('SELECT party_type, party_id, due_date, count, amount FROM ageing_balances')
+        actual = {(row['party_type'], row['party_id'], row['due_date']): (row['count'], row['amount'])
+                  for row in cursor.fetchall()}
+
+        conn.close()
+
+        discrepancies = []
+        for key in sorted(set(expected) | set(actual)):
+            expected_values = expected.get(key, (0, 0))
+            actual_values = actual.get(key, (0, 0))
+            if expected_values != actual_values:
+                discrepancies.append({
+                    'party_type': key[0],
+                    'party_id': key[1],
+                    'due_date': key[2],
+                    'expected': dict(zip(('count', 'amount'), expected_values)),
+                    'actual': dict(zip(('count', 'amount'), actual_values))
+                })
+
+        return discrepancies
+
+    def rebuild_ageing_balances(self):
+        """Rebuild the ageing balances from the documents"""
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        try:
+            rebuild_ageing_balances(cursor)
+            conn.commit()
+            return True, None, "Ageing balances rebuilt successfully"
+        except Exception as e:
+            conn.rollback()
+            return False, None, str(e)
+        finally:
+            conn.close()
@@ -0,0 +1,1229 @@
+"""
+Performance benchmarks for the accounting engine.
+
+Each benchmark builds a synthetic database in a temporary folder, so it never
+touches accounting_data.db. Usage:
+
+    python benchmarks.py connections --lines 2000000
+    python benchmarks.py indexes --lines 2000000
+    python benchmarks.py rollup --lines 2000000
+    python benchmarks.py sequences --lines 2000000
+    python benchmarks.py money --lines 2000000
+    python benchmarks.py balances --lines 2000000 --accounts 300
+    python benchmarks.py memory --lines 2000000
+    python benchmarks.py periods --lines 2000000
+    python benchmarks.py invoices --invoices 2000
+    python benchmarks.py cogs --invoice-lines 200
+    python benchmarks.py dashboard --invoices 100000
+    python benchmarks.py statements --invoices 100000
+    python benchmarks.py ageing --invoices 200000 --customers 50000
+    python benchmarks.py masters --invoices 2000
+    python benchmarks.py receipts --bill-lines 500
+    python benchmarks.py stock --movements 50000
+    python benchmarks.py transfers --movements 50000
+    python benchmarks.py costing --movements 50000
+    python benchmarks.py snapshots --movements 1000000 --items 5000
+    python benchmarks.py analytics --items 100000 --locations 200 --movements 2000000
+"""
+import argparse
+import csv
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from database import AccountingDatabase, LEDGER_INDEXES, PAGING_INDEXES
+from accounting import AccountingManager, comparative_periods, month_periods, numpy, rebuild_period_balances
+from connection_pool import configure_pool, get_connection
+from costing import FIFO, WEIGHTED_AVERAGE
+from ageing import AgeingReport, ageing_boundaries, bucket_sums, document_base_amount
+from dashboard_metrics import DashboardMetrics, rebuild_dashboard_metrics
+from master_data import MASTER_TABLES, get_master_data
+from payment_allocations import open_documents
+from posting_rules import COGS_BY_ACCOUNT, COGS_BY_ITEM
+from sequences import next_document_number
+from inventory import InventoryManager
+from inventory_analytics import DEMAND_QUERY, InventoryAnalytics
+from session import Session
+from transactions import PurchaseManager, SalesManager
+
+
+def timed(func, *args, repeat=3):
+    """Run func and return the best wall-clock time in milliseconds"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def create_benchmark_database(directory):
+    """Create a fresh database with the default chart of accounts"""
+    db_path = os.path.join(directory, "benchmark.db")
+    db = AccountingDatabase(db_path)
+    db.initialize_database()
+    db.close()
+    db.insert_default_data()
+    return db_path
+
+
+def get_posting_accounts(db_path):
+    """Get ids of leaf accounts that transactions can post to"""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT account_id FROM chart_of_accounts a
+        WHERE NOT EXISTS (SELECT 1 FROM chart_of_accounts c WHERE c.parent_account_id = a.account_id)
+        ORDER BY account_code
+    ''')
+    accounts = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    return accounts
+
+
+def add_benchmark_accounts(db_path, count):
+    """Add child accounts under a few parents, so the chart has a realistic number of accounts"""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    created = datetime.now().isoformat()
+    parents = [('1110', 'Asset'), ('2110', 'Liability'), ('4100', 'Revenue'), ('6100', 'Expense')]
+
+    for n in range(count):
+        parent_code, account_type = parents[n % len(parents)]
+        cursor.execute('SELECT account_id FROM chart_of_accounts WHERE account_code = ?', (parent_code,))
+        parent_id = cursor.fetchone()[0]
+        cursor.execute('''
+            INSERT INTO chart_of_accounts
+            (account_code, account_name, account_type, parent_account_id, created_date)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (f"{parent_code}-{n:04d}", f"Benchmark account {n}", account_type, parent_id, created))
+
+    conn.commit()
+    conn.close()
+
+
+def build_synthetic_ledger(db_path, line_count, days=3 * 365, seed=42):
+    """Bulk load balanced two-line journal entries spread over the given number of days"""
+    rng = random.Random(seed)
+    accounts = get_posting_accounts(db_path)
+    start_date = date(2023, 1, 1)
+    created = datetime.now().isoformat()
+    entry_count = line_count // 2
+
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+
+    def entries():
+        for n in range(1, entry_count + 1):
+            entry_date = (start_date + timedelta(days=n * days // entry_count)).isoformat()
+            yield (n, f"JE-{n:06d}", entry_date, 'Manual', f"SYN-{n}", 'Synthetic entry',
+                   'Posted', created)
+
+    def lines():
+        for n in range(1, entry_count + 1):
+            entry_date = (start_date + timedelta(days=n * days // entry_count)).isoformat()
+            debit_account, credit_account = rng.sample(accounts, 2)
+            amount = rng.randint(100, 500000)  # pence
+            yield (n, debit_account, amount, 0, amount, 0, 'Synthetic debit', entry_date)
+            yield (n, credit_account, 0, amount, 0, amount, 'Synthetic credit', entry_date)
+
+    cursor.executemany('''
+        INSERT INTO journal_entries
+        (entry_id, entry_number, entry_date, entry_type, reference, description, status, created_date)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', entries())
+    cursor.executemany('''
+        INSERT INTO journal_entry_lines
+        (entry_id, account_id, debit_amount, credit_amount,
+         debit_base_currency, credit_base_currency, description, entry_date)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', lines())
+    rebuild_period_balances(cursor)
+    cursor.execute("UPDATE document_sequences SET next_value = ? WHERE sequence_name = 'JE'",
+                   (entry_count + 1,))
+    conn.commit()
+    conn.close()
+    return accounts
+
+
+def create_trading_masters(db_path, item_count=50, opening_quantity=1000000):
+    """Add a customer, a supplier, a location and well-stocked items for posting benchmarks"""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    created = datetime.now().isoformat()
+
+    def account(code):
+        cursor.execute('SELECT account_id FROM chart_of_accounts WHERE account_code = ?', (code,))
+        return cursor.fetchone()[0]
+
+    cursor.execute('''
+        INSERT INTO customers (customer_code, customer_name, receivable_account_id, created_date)
+        VALUES (?, ?, ?, ?)
+    ''', ('BENCH-C', 'Benchmark Customer', account('1121'), created))
+    customer_id = cursor.lastrowid
+
+    cursor.execute('''
+        INSERT INTO suppliers (supplier_code, supplier_name, payable_account_id, created_date)
+        VALUES (?, ?, ?, ?)
+    ''', ('BENCH-S', 'Benchmark Supplier', account('2111'), created))
+    supplier_id = cursor.lastrowid
+
+    cursor.execute('''
+        INSERT INTO inventory_locations (location_code, location_name, created_date)
+        VALUES (?, ?, ?)
+    ''', ('BENCH-WH', 'Benchmark Warehouse', created))
+    location_id = cursor.lastrowid
+
+    item_ids = []
+    for n in range(item_count):
+        cursor.execute('''
+            INSERT INTO inventory_items
+            (item_code, item_name, unit_of_measure, inventory_account_id, cogs_account_id,
+             sales_account_id, created_date)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (f"BENCH-{n:05d}", f"Benchmark Item {n}", 'Each', account('1131'),
+              account('5100'), account('4110'), created))
+        item_ids.append(cursor.lastrowid)
+        cursor.execute('''
+            INSERT INTO inventory_stock
+            (item_id, location_id, quantity, weighted_avg_cost, total_value, last_updated)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (item_ids[-1], location_id, opening_quantity, 10.0, opening_quantity * 10.0, created))
+
+    # Opening stock is written directly, so count it into the dashboard metrics
+    rebuild_dashboard_metrics(cursor)
+    conn.commit()
+    conn.close()
+    return {'customer_id': customer_id, 'supplier_id': supplier_id,
+            'location_id': location_id, 'item_ids': item_ids}
+
+
+def synthetic_invoice_lines(masters, line_count, rng):
+    """Build invoice lines for random stocked items"""
+    return [(item_id, f"Item {item_id}", rng.randint(1, 5), round(rng.uniform(15, 60), 2),
+             20.0, masters['location_id'])
+            for item_id in rng.sample(masters['item_ids'], line_count)]
+
+
+def run_ledger_queries(accounting, accounts):
+    """
+    Time the queries that still read journal_entry_lines, not the balance rollup:
+    general ledger paging and account statements over a date range
+    """
+    account_id = accounts[0]
+    date_from, date_to = '2024-01-01', '2024-12-31'
+    middle = accounting.count_general_ledger(account_id, date_from, date_to) // 2
+    return [
+        ('Ledger first page', timed(accounting.get_general_ledger_page, account_id, date_from, date_to)),
+        ('Ledger seek to middle', timed(accounting.get_general_ledger_cursor, account_id, middle, date_from, date_to)),
+        ('Ledger row count', timed(accounting.count_general_ledger, account_id, date_from, date_to)),
+        ('Statement, one month', timed(accounting.get_general_ledger, account_id, '2024-06-01', '2024-06-30')),
+        ('Statement, one quarter', timed(accounting.get_general_ledger, account_id, '2024-04-01', '2024-06-30')),
+    ]
+
+
+def bench_indexes(args):
+    """Raw ledger query latency with no indexes, with the ledger indexes, and with the paging indexes as well"""
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = create_benchmark_database(directory)
+        print(f"Building synthetic ledger with {args.lines:,} lines...")
+        accounts = build_synthetic_ledger(db_path, args.lines)
+        accounting = AccountingManager(db_path)
+
+        def set_indexes(indexes):
+            conn = sqlite3.connect(db_path)
+            for name, table, columns in LEDGER_INDEXES + PAGING_INDEXES:
+                conn.execute(f'DROP INDEX IF EXISTS {name}')
+            for name, table, columns in indexes:
+                conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})')
+            conn.execute('ANALYZE')
+            conn.commit()
+            conn.close()
+
+        timings = []
+        for indexes in ([], LEDGER_INDEXES, LEDGER_INDEXES + PAGING_INDEXES):
+            set_indexes(indexes)
+            timings.append(run_ledger_queries(accounting, accounts))
+
+        print(f"\n{'Query':<24}{'No indexes (ms)':>17}{'Ledger (ms)':>13}{'+ Paging (ms)':>15}")
+        for (name, none_ms), (_, ledger_ms), (_, paging_ms) in zip(*timings):
+            print(f"{name:<24}{none_ms:>17.1f}{ledger_ms:>13.1f}{paging_ms:>15.1f}")
+
+
+def bench_rollup(args):
+    """Trial balance latency as the ledger grows, served from the daily balance rollup"""
+    print(f"\n{'Ledger lines':>14}{'Trial balance (ms)':>22}{'Account balance (ms)':>24}")
+    for line_count in (args.lines // 4, args.lines // 2, args.lines):
+        with tempfile.TemporaryDirectory() as directory:
+            db_path = create_benchmark_database(directory)
+            accounts = build_synthetic_ledger(db_path, line_count)
+            accounting = AccountingManager(db_path)
+            trial_balance_ms = timed(accounting.get_trial_balance, '2024-12-31')
+            balance_ms = timed(accounting.get_account_balance, accounts[0], '2024-12-31')
+            print(f"{line_count:>14,}{trial_balance_ms:>22.1f}{balance_ms:>24.1f}")
+
+
+def bench_sequences(args):
+    """Stress the document sequence allocator from concurrent writers and compare with COUNT(*) numbering"""
+    threads_count = 8
+    allocations_per_thread = 500
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = create_benchmark_database(directory)
+        build_synthetic_ledger(db_path, args.lines)
+
+        allocated = []
+        errors = []
+
+        def writer():
+            conn = sqlite3.connect(db_path, timeout=60)
+            cursor = conn.cursor()
+            numbers = []
+            try:
+                for _ in range(allocations_per_thread):
+                    numbers.append(next_document_number(cursor, 'JE'))
+                    conn.commit()
+            except Exception as e:
+                errors.append(str(e))
+            finally:
+                conn.close()
+            allocated.extend(numbers)
+
+        start = time.perf_counter()
+        workers = [threading.Thread(target=writer) for _ in range(threads_count)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+        expected = threads_count * allocations_per_thread
+        print(f"\nConcurrent allocation: {threads_count} threads x {allocations_per_thread} numbers "
+              f"in {elapsed:.2f}s")
+        print(f"Allocated: {len(allocated):,}  Unique: {len(set(allocated)):,}  "
+              f"Expected: {expected:,}  Errors: {len(errors)}")
+        if len(set(allocated)) != expected or errors:
+            raise SystemExit("FAILED: duplicate or missing document numbers")
+
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+
+        def allocate():
+            next_document_number(cursor, 'JE')
+            conn.commit()
+
+        def count_rows():
+            cursor.execute('SELECT COUNT(*) FROM journal_entries')
+            cursor.fetchone()
+
+        print(f"\n{'Numbering':<28}{'Latency (ms)':>14}")
+        print(f"{'COUNT(*) on journal_entries':<28}{timed(count_rows):>14.3f}")
+        print(f"{'document_sequences':<28}{timed(allocate):>14.3f}")
+        conn.close()
+
+
+def bench_invoices(args):
+    """Sales invoice throughput: one create_sales_invoice call per invoice against the bulk import"""
+    invoice_count = args.invoices
+    lines_per_invoice = 5
+    rng = random.Random(42)
+    invoices = None
+    timings = []
+
+    for mode in ('per-invoice', 'bulk'):
+        with tempfile.TemporaryDirectory() as directory:
+            db_path = create_benchmark_database(directory)
+            masters = create_trading_masters(db_path)
+            sales = SalesManager(db_path)
+            if invoices is None:
+                invoices = [{
+                    'customer_id': masters['customer_id'], 'invoice_date': '2025-06-01',
+                    'due_date': '2025-07-01', 'currency': 'GBP', 'exchange_rate': 1.0,
+                    'payment_terms': '30 days', 'notes': '',
+                    'lines': synthetic_invoice_lines(masters, lines_per_invoice, rng)
+                } for _ in range(invoice_count)]
+
+            start = time.perf_counter()
+            if mode == 'bulk':
+                results = sales.create_sales_invoices_bulk(invoices)
+            else:
+                results = [sales.create_sales_invoice(
+                    invoice['customer_id'], invoice['invoice_date'], invoice['due_date'],
+                    invoice['currency'], invoice['exchange_rate'], invoice['payment_terms'],
+                    invoice['notes'], invoice['lines']
+                ) for invoice in invoices]
+            elapsed = time.perf_counter() - start
+
+            failures = [msg for success, number, msg in results if not success]
+            if failures:
+                raise SystemExit(f"FAILED: {failures[0]}")
+
+            conn = get_connection(db_path)
+            entries = conn.execute('SELECT COUNT(*) FROM journal_entries').fetchone()[0]
+            journal_lines = conn.execute('SELECT COUNT(*) FROM journal_entry_lines').fetchone()[0]
+            conn.close()
+            timings.append((mode, elapsed, entries, journal_lines))
+
+    print(f"\n{invoice_count:,} invoices x {lines_per_invoice} lines")
+    print(f"{'Path':<14}{'Seconds':>10}{'Invoices/s':>14}{'Entries':>10}{'Lines':>10}")
+    for mode, elapsed, entries, journal_lines in timings:
+        print(f"{mode:<14}{elapsed:>10.2f}{invoice_count / elapsed:>14,.0f}{entries:>10,}{journal_lines:>10,}")
+
+
+def bench_dashboard(args):
+    """Dashboard statistics: scanning invoices, bills and stock against reading the metric counters"""
+    rng = random.Random(42)
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = create_benchmark_database(directory)
+        masters = create_trading_masters(db_path)
+        # Invoices over the last year, so the ageing has due dates in every bucket
+        start = date.today() - timedelta(days=365)
+        results = SalesManager(db_path).create_sales_invoices_bulk({
+            'customer_id': masters['customer_id'],
+            'invoice_date': (start + timedelta(days=number % 365)).isoformat(),
+            'due_date': (start + timedelta(days=number % 365 + 30)).isoformat(),
+            'lines': synthetic_invoice_lines(masters, 2, rng)
+        } for number in range(args.invoices))
+        failures = [msg for success, number, msg in results if not success]
+        if failures:
+            raise SystemExit(f"FAILED: {failures[0]}")
+
+        metrics = DashboardMetrics(db_path)
+
+        def scan():
+            # The same statistics from the source tables, ageing included
+            sums, parameters = bucket_sums(ageing_boundaries(date.today()), 'amount_outstanding')
+            conn = get_connection(db_path)
+            cursor = conn.cursor()
+            for table in ('sales_invoices', 'purchase_bills'):
+                cursor.execute(f'''
+                    SELECT COUNT(*), SUM(amount_outstanding), {', '.join(sums)}
+                    FROM {table} WHERE amount_outstanding > 0
+                ''', parameters)
+                cursor.fetchone()
+            cursor.execute('SELECT SUM(total_value) FROM inventory_stock')
+            cursor.fetchone()
+            conn.close()
+
+        discrepancies = metrics.check_dashboard_metrics()
+        if discrepancies:
+            raise SystemExit(f"FAILED: dashboard counters differ: {discrepancies[0]}")
+
+        print(f"\n{args.invoices:,} open invoices")
+        print(f"{'Dashboard':<22}{'Latency (ms)':>14}")
+        print(f"{'Scan source tables':<22}{timed(scan):>14.3f}")
+        print(f"{'Metric counters':<22}{timed(metrics.get_dashboard_stats):>14.3f}")
+        print(f"{'Reconciliation':<22}{timed(metrics.check_dashboard_metrics, repeat=1):>14.3f}")
+
+
+def bench_statements(args):
+    """Payments spread across invoices, and customer statements from the open-item index against a scan"""
+    rng = random.Random(42)
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = create_benchmark_database(directory)
+        masters = create_trading_masters(db_path)
+        sales = SalesManager(db_path)
+        print(f"Creating {args.invoices:,} invoices...")
+        results = sales.create_sales_invoices_bulk({
+            'customer_id': masters['customer_id'],
+            'invoice_date': (date(2025, 1, 1) + timedelta(days=number * 365 // args.invoices)).isoformat(),
+            'due_date': (date(2025, 1, 31) + timedelta(days=number * 365 // args.invoices)).isoformat(),
+            'lines': synthetic_invoice_lines(masters, 2, rng)
+        } for number in range(args.invoices))
+        failures = [msg for success, number, msg in results if not success]
+        if failures:
+            raise SystemExit(f"FAILED: {failures[0]}")
+
+        conn = get_connection(db_path)
+        cursor = conn.cursor()
+        cursor.execute('SELECT SUM(total_amount) FROM sales_invoices')
+        total = cursor.fetchone()[0]
+        conn.close()
+
+        # Settle about 95% of the ledger, oldest first, in payments of about 20 invoices each
+        payment_amount = round(total / args.invoices * 20 / 100, 2)
+        payment_count = int(args.invoices * 0.95 / 20)
+        start = time.perf_counter()
+        for n in range(payment_count):
+            success, payment_number, msg = sales.receive_payment(
+                masters['customer_id'], '2025-12-31', payment_amount, 'Bank', 5, f"R{n}", 'Benchmark payment')
+            if not success:
+                raise SystemExit(f"FAILED: {msg}")
+        elapsed = time.perf_counter() - start
+
+        def scan():
+            # Open invoices found by status, reading every invoice of the customer
+            conn = get_connection(db_path)
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT invoice_number, invoice_date, due_date, total_amount FROM sales_invoices
+                WHERE customer_id = ? AND status != 'Paid' ORDER BY due_date
+            ''', (masters['customer_id'],))
+            cursor.fetchall()
+            conn.close()
+
+        def index():
+            conn = get_connection(db_path)
+            open_documents(conn.cursor(), 'Invoice', masters['customer_id']).fetchall()
+            conn.close()
+
+        open_items = len(sales.get_customer_statement(masters['customer_id']))
+        discrepancies = DashboardMetrics(db_path).check_dashboard_metrics()
+        if discrepancies:
+            raise SystemExit(f"FAILED: dashboard counters differ: {discrepancies[0]}")
+
+        print(f"\n{payment_count:,} payments of ~20 invoices in {elapsed:.2f}s "
+              f"({payment_count / elapsed:,.0f} payments/s)")
+        print(f"{args.invoices:,} invoices, {open_items:,} open")
+        print(f"{'Customer statement':<26}{'Latency (ms)':>14}")
+        print(f"{'Scan invoices by status':<26}{timed(scan):>14.3f}")
+        print(f"{'Open-item index':<26}{timed(index):>14.3f}")
+        print(f"{'get_customer_statement':<26}"
+              f"{timed(sales.get_customer_statement, masters['customer_id']):>14.3f}")
+
+
+def bench_masters(args):
+    """Master data lookups per posting with the master data cache cold and warm"""
+    rng = random.Random(42)
+    master_tables = {table for table, key_column in MASTER_TABLES.values()}
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = create_benchmark_database(directory)
+        masters = create_trading_masters(db_path)
+        sales = SalesManager(db_path)
+        purchase = PurchaseManager(db_path)
+        cache = get_master_data(db_path)
+        invoices = [synthetic_invoice_lines(masters, 5, rng) for _ in range(args.invoices)]
+
+        # Single-threaded, so the postings reuse this pooled connection
+        statements = []
+        conn = get_connection(db_path)
+        conn.set_trace_callback(statements.append)
+        conn.close()
+
+        def post(lines):
+            success, number, msg = sales.create_sales_invoice(
+                masters['customer_id'], '2025-06-01', '2025-07-01', 'GBP', 1.0, '30 days', '', lines)
+            if not success:
+                raise SystemExit(f"FAILED: {msg}")
+            success, number, msg = purchase.create_purchase_bill(
+                masters['supplier_id'], '2025-06-01', '2025-07-01', 'GBP', 1.0, '', lines)
+            if not success:
+                raise SystemExit(f"FAILED: {msg}")
+
+        print(f"\n{args.invoices:,} invoices and bills x 5 lines")
+        print(f"{'Cache':<8}{'Master queries/posting':>24}{'Version checks/posting':>24}{'Postings/s':>12}")
+        for mode in ('cold', 'warm'):
+            statements.clear()
+            start = time.perf_counter()
+            for lines in invoices:
+                if mode == 'cold':
+                    cache.invalidate()
+                post(lines)
+            elapsed = time.perf_counter() - start
+
+            master_queries = sum(1 for sql in statements
+                                 if sql.lstrip().upper().startswith('SELECT')
+                                 and any(f' {table}' in sql for table in master_tables))
+            version_queries = sum(1 for sql in statements if 'master_data_versions' in sql
+                                  and sql.lstrip().upper().startswith('SELECT'))
+            postings = 2 * len(invoices)
+            print(f"{mode:<8}{master_queries / postings:>24.2f}{version_queries / postings:>24.2f}"
+                  f"{postings / elapsed:>12,.0f}")
+
+        print(f"\n{'Table':<12}{'Hits':>10}{'Misses':>8}{'Version':>9}")
+        for name, counters in cache.stats().items():
+            print(f"{name:<12}{counters['hits']:>10,}{counters['misses']:>8,}{counters['version']:>9}")
+
+
+def bench_cogs(args):
+    """Large sales invoice: latency and journal growth with COGS merged per account or per item"""
+    line_count = args.invoice_lines
+    repeat = 3
+    rng = random.Random(42)
+    timings = []
+
+    for mode in (COGS_BY_ACCOUNT, COGS_BY_ITEM):
+        with tempfile.TemporaryDirectory() as directory:
+            db_path = create_benchmark_database(directory)
+            masters = create_trading_masters(db_path, item_count=line_count)
+            sales = SalesManager(db_path, cogs_mode=mode)
+            lines = synthetic_invoice_lines(masters, line_count, rng)
+
+            def post():
+                success, number, msg = sales.create_sales_invoice(
+                    masters['customer_id'], '2025-06-01', '2025-07-01', 'GBP', 1.0, '30 days', '', lines)
+                if not success:
+                    raise SystemExit(f"FAILED: {msg}")
+
+            latency = timed(post, repeat=repeat)
+            conn = get_connection(db_path)
+            entries = conn.execute('SELECT COUNT(*) FROM journal_entries').fetchone()[0]
+            journal_lines = conn.execute('SELECT COUNT(*) FROM journal_entry_lines').fetchone()[0]
+            conn.close()
+            timings.append((mode, latency, entries / repeat, journal_lines / repeat))
+
+    print(f"\nSales invoice of {line_count:,} lines")
+    print(f"{'COGS mode':<12}{'Latency (ms)':>14}{'Entries':>10}{'Lines':>10}")
+    for mode, latency, entries, journal_lines in timings:
+        print(f"{mode:<12}{latency:>14.1f}{entries:>10,.0f}{journal_lines:>10,.0f}")
+
+
+def bench_receipts(args):
+    """Large supplier delivery: per-line stock receipts against the batch receipt engine"""
+    line_count = args.bill_lines
+    rng = random.Random(42)
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = create_benchmark_database(directory)
+        masters = create_trading_masters(db_path)
+        inventory = InventoryManager(db_path)
+        purchase = PurchaseManager(db_path)
+        receipts = [(rng.choice(masters['item_ids']), masters['location_id'], rng.randint(1, 50),
+                     round(rng.uniform(5, 20), 2), 'BENCH', 'Benchmark receipt', None)
+                    for _ in range(line_count)]
+
+        def per_line():
+            with Session(db_path) as session:
+                for receipt in receipts:
+                    inventory.stock_receipt(*receipt, session=session)
+
+        def batch():
+            with Session(db_path) as session:
+                inventory.stock_receipts_batch(receipts, session)
+
+        def purchase_bill():
+            lines = [(item_id, 'Delivery line', quantity, unit_cost, 20.0, location_id)
+                     for item_id, location_id, quantity, unit_cost, *_ in receipts]
+            success, bill_number, msg = purchase.create_purchase_bill(
+                masters['supplier_id'], '2025-06-01', '2025-07-01', 'GBP', 1.0, '', lines
+            )
+            if not success:
+                raise SystemExit(f"FAILED: {msg}")
+
+        print(f"\nDelivery of {line_count:,} lines")
+        print(f"{'Path':<28}{'Latency (ms)':>14}")
+        print(f"{'per-line stock_receipt':<28}{timed(per_line):>14.1f}")
+        print(f"{'stock_receipts_batch':<28}{timed(batch):>14.1f}")
+        print(f"{'create_purchase_bill':<28}{timed(purchase_bill):>14.1f}")
+
+
+def bench_stock(args):
+    """POS-style stream of stock issues: movements per second through the stock state"""
+    movement_count = args.movements
+    batch_size = 500
+    rng = random.Random(42)
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = create_benchmark_database(directory)
+        masters = create_trading_masters(db_path)
+        inventory = InventoryManager(db_path)
+        issues = [(rng.choice(masters['item_ids']), masters['location_id'], rng.randint(1, 3),
+                   'POS', 'Till sale', None) for _ in range(movement_count)]
+        batches = [issues[start:start + batch_size] for start in range(0, movement_count, batch_size)]
+
+        def per_movement():
+            # One transaction per movement, as a till posting each scan would
+            for issue in issues[:batch_size * 4]:
+                inventory.stock_issue(*issue)
+            return batch_size * 4
+
+        def batched(cold):
+            for batch in batches:
+                if cold:
+                    inventory.stock_state.reset()
+                with Session(db_path) as session:
+                    success, results, msg = inventory.stock_issues_batch(batch, session)
+                    if not success:
+                        raise SystemExit(f"FAILED: {msg}")
+            return movement_count
+
+        print(f"\nStream of {movement_count:,} stock issues, {batch_size} per transaction when batched")
+        print(f"{'Path':<36}{'Movements/s':>14}")
+        for label, func, cold in (('stock_issue per movement', per_movement, None),
+                                  ('batched, stock state reset', batched, True),
+                                  ('batched, stock state warm', batched, False)):
+            start = time.perf_counter()
+            count = func() if cold is None else func(cold)
+            rate = count / (time.perf_counter() - start)
+            print(f"{label:<36}{rate:>14,.0f}")
+
+        print(f"Cached stock rows: {inventory.stock_state.stats()['rows']}")
+
+
+def bench_transfers(args):
+    """Warehouse rebalancing: single-line transfers against bulk transfer documents"""
+    line_count = args.movements
+    lines_per_document = 10
+    rng = random.Random(42)
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = create_benchmark_database(directory)
+        masters = create_trading_masters(db_path)
+        inventory = InventoryManager(db_path)
+        stores = [inventory.add_location(f"STORE-{n}", f"Store {n}", '')[1] for n in range(10)]
+        lines = [(rng.choice(masters['item_ids']), masters['location_id'], rng.choice(stores), rng.randint(1, 5))
+                 for _ in range(line_count)]
+        documents = [{'lines': lines[start:start + lines_per_document], 'reference': 'REBAL',
+                      'description': 'Rebalancing'} for start in range(0, line_count, lines_per_document)]
+
+        def per_line():
+            for line in lines[:2000]:
+                success, trans_number, msg = inventory.stock_transfer(*line, 'REBAL', 'Rebalancing')
+                if not success:
+                    raise SystemExit(f"FAILED: {msg}")
+            return min(line_count, 2000)
+
+        def bulk(movement_rows):
+            for success, trans_numbers, msg in inventory.stock_transfers_bulk(documents, movement_rows=movement_rows):
+                if not success:
+                    raise SystemExit(f"FAILED: {msg}")
+            return line_count
+
+        print(f"\n{line_count:,} transfer lines, {lines_per_document} per document when bulk")
+        print(f"{'Path':<36}{'Lines/s':>14}")
+        for label, func, movement_rows in (('stock_transfer per line', per_line, None),
+                                           ('stock_transfers_bulk', bulk, False),
+                                           ('bulk with issue/receipt rows', bulk, True)):
+            start = time.perf_counter()
+            count = func() if movement_rows is None else func(movement_rows)
+            rate = count / (time.perf_counter() - start)
+            print(f"{label:<36}{rate:>14,.0f}")
+
+
+def bench_costing(args):
+    """Weighted average against FIFO costing on a long history of receipts and issues"""
+    movement_count = args.movements
+    batch_size = 500
+    rng = random.Random(42)
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = create_benchmark_database(directory)
+        masters = create_trading_masters(db_path, item_count=2, opening_quantity=0)
+        inventory = InventoryManager(db_path)
+        inventory.set_costing_method(masters['item_ids'][1], FIFO)
+        location_id = masters['location_id']
+
+        print(f"\n{movement_count:,} receipts then {movement_count:,} issues per item, {batch_size} per transaction")
+        print(f"{'Costing':<10}{'Receipts/s':>14}{'Issues/s':>14}{'Layers left':>14}")
+        for method, item_id in zip((WEIGHTED_AVERAGE, FIFO), masters['item_ids']):
+            # Every receipt at its own cost, so FIFO keeps a layer per receipt
+            receipts = [(item_id, location_id, 10, round(rng.uniform(5, 20), 2), 'BENCH', 'Receipt', None)
+                        for _ in range(movement_count)]
+            issues = [(item_id, location_id, rng.randint(5, 15), 'BENCH', 'Issue', None)
+                      for _ in range(movement_count)]
+
+            start = time.perf_counter()
+            for batch in range(0, movement_count, batch_size):
+                inventory.stock_receipts_batch(receipts[batch:batch + batch_size])
+            receipt_rate = movement_count / (time.perf_counter() - start)
+
+            start = time.perf_counter()
+            for batch in range(0, movement_count, batch_size):
+                success, results, msg = inventory.stock_issues_batch(issues[batch:batch + batch_size])
+                if not success:
+                    raise SystemExit(f"FAILED: {msg}")
+            issue_rate = movement_count / (time.perf_counter() - start)
+
+            conn = get_connection(db_path)
+            layers = conn.execute('SELECT COUNT(*) FROM inventory_cost_layers WHERE item_id = ?',
+                                  (item_id,)).fetchone()[0]
+            conn.close()
+            print(f"{method:<10}{receipt_rate:>14,.0f}{issue_rate:>14,.0f}{layers:>14,}")
+
+
+def build_stock_history(db_path, masters, movement_count, days=2 * 365, seed=42):
+    """Bulk load receipts and issues over the days up to yesterday, and the stock they leave"""
+    rng = random.Random(seed)
+    start_date = date.today() - timedelta(days=days)
+    created = datetime.now().isoformat()
+    location_id = masters['location_id']
+    stock = {item_id: [0, 0.0] for item_id in masters['item_ids']}
+
+    def movements():
+        for n in range(1, movement_count + 1):
+            movement_date = (start_date + timedelta(days=(n - 1) * days // movement_count)).isoformat()
+            item_id = rng.choice(masters['item_ids'])
+            current = stock[item_id]
+            if current[0] < 10 or rng.random() < 0.4:
+                quantity, unit_cost = rng.randint(10, 50), round(rng.uniform(5, 20), 2)
+                current[0] += quantity
+                current[1] += quantity * unit_cost
+                yield (f"STK-IN-{n:07d}", movement_date, 'Receipt', item_id, None, location_id,
+                       quantity, unit_cost, quantity * unit_cost, created)
+            else:
+                quantity, unit_cost = rng.randint(1, 10), current[1] / current[0]
+                current[0] -= quantity
+                current[1] -= quantity * unit_cost
+                yield (f"STK-OUT-{n:07d}", movement_date, 'Issue', item_id, location_id, None,
+                       quantity, unit_cost, quantity * unit_cost, created)
+
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.executemany('''
+        INSERT INTO inventory_transactions
+        (transaction_number, transaction_date, transaction_type, item_id, from_location_id,
+         to_location_id, quantity, unit_cost, total_value, created_date)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', movements())
+    cursor.executemany('''
+        UPDATE inventory_stock SET quantity = ?, weighted_avg_cost = ?, total_value = ?
+        WHERE item_id = ? AND location_id = ?
+    ''', [(quantity, value / quantity if quantity else 0, value, item_id, location_id)
+          for item_id, (quantity, value) in stock.items()])
+    rebuild_dashboard_metrics(cursor)
+    conn.commit()
+    conn.close()
+    return start_date
+
+
+def bench_snapshots(args):
+    """Stock valuation as at past dates, undoing all later movements against starting from snapshots"""
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = create_benchmark_database(directory)
+        masters = create_trading_masters(db_path, item_count=args.items, opening_quantity=0)
+        start_date = build_stock_history(db_path, masters, args.movements)
+        inventory = InventoryManager(db_path)
+        as_of_dates = [(start_date + timedelta(days=days)).isoformat() for days in (100, 250, 400, 550, 700)]
+
+        def valuations():
+            for as_of in as_of_dates:
+                inventory.get_stock_valuation(as_of=as_of)
+
+        print(f"\n{args.movements:,} movements over {len(masters['item_ids']):,} items, "
+              f"valued as at {len(as_of_dates)} dates")
+        print(f"{'Path':<36}{'Per date (ms)':>14}")
+        print(f"{'without snapshots':<36}{timed(valuations, repeat=1) / len(as_of_dates):>14.1f}")
+
+        start = time.perf_counter()
+        success, snapshot_dates, msg = inventory.create_stock_snapshots()
+        print(f"{'taking month-end snapshots':<36}{(time.perf_counter() - start) * 1000:>14.1f}"
+              f"   ({len(snapshot_dates)} snapshots)")
+        print(f"{'from nearest snapshot':<36}{timed(valuations) / len(as_of_dates):>14.1f}")
+
+
+def build_analytics_data(db_path, item_count, location_count, movement_count, days=90, seed=42):
+    """Bulk load items stocked at every location and the issues of the last days against them"""
+    rng = random.Random(seed)
+    created = datetime.now().isoformat()
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute("SELECT account_id FROM chart_of_accounts WHERE account_code IN ('1131', '5100', '4110') "
+                   "ORDER BY account_code")
+    inventory_account, sales_account, cogs_account = [row[0] for row in cursor.fetchall()]
+
+    cursor.executemany('''
+        INSERT INTO inventory_locations (location_code, location_name, created_date) VALUES (?, ?, ?)
+    ''', [(f"BENCH-L{n:03d}", f"Benchmark Location {n}", created) for n in range(location_count)])
+    cursor.execute("SELECT location_id FROM inventory_locations WHERE location_code LIKE 'BENCH-L%'")
+    location_ids = [row[0] for row in cursor.fetchall()]
+
+    cursor.executemany('''
+        INSERT INTO inventory_items
+        (item_code, item_name, unit_of_measure, inventory_account_id, cogs_account_id,
+         sales_account_id, created_date)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [(f"BENCH-{n:06d}", f"Benchmark Item {n}", 'Each', inventory_account, cogs_account,
+           sales_account, created) for n in range(item_count)])
+    cursor.execute("SELECT item_id FROM inventory_items WHERE item_code LIKE 'BENCH-%'")
+    item_ids = [row[0] for row in cursor.fetchall()]
+
+    cursor.executemany('''
+        INSERT INTO inventory_stock
+        (item_id, location_id, quantity, weighted_avg_cost, total_value, last_updated)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', ((item_id, location_id, quantity, 10.0, quantity * 10.0, created)
+          for item_id in item_ids for location_id in location_ids
+          for quantity in (rng.randint(0, 200),)))
+
+    # Demand is skewed towards the first items, as sales usually are
+    start_date = date.today() - timedelta(days=days)
+    cursor.executemany('''
+        INSERT INTO inventory_transactions
+        (transaction_number, transaction_date, transaction_type, item_id, from_location_id,
+         quantity, unit_cost, total_value, created_date)
+        VALUES (?, ?, 'Issue', ?, ?, ?, 10.0, ?, ?)
+    ''', ((f"STK-OUT-{n:08d}", (start_date + timedelta(days=1 + n * days // movement_count)).isoformat(),
+           item_ids[min(int(rng.paretovariate(1.2)) - 1, item_count - 1)], rng.choice(location_ids),
+           quantity, quantity * 10.0, created)
+          for n in range(movement_count) for quantity in (rng.randint(1, 10),)))
+    conn.commit()
+    conn.close()
+
+
+def bench_analytics(args):
+    """ABC class, days of cover and reorder points for every item and location, looped against vectorized"""
+    if numpy is None:
+        print("NumPy is not installed")
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = create_benchmark_database(directory)
+        print(f"Building {args.items:,} items at {args.locations:,} locations with {args.movements:,} issues...")
+        build_analytics_data(db_path, args.items, args.locations, args.movements)
+        analytics = InventoryAnalytics(db_path)
+        as_of = date.today().isoformat()
+        window_start = (date.today() - timedelta(days=90)).isoformat()
+
+        def looped():
+            # The same figures worked out a row at a time in Python
+            conn = get_connection(db_path)
+            cursor = conn.cursor()
+            cursor.execute('SELECT item_id, location_id, quantity, total_value FROM inventory_stock')
+            stock = {(row[0], row[1]): (row[2], row[3]) for row in cursor.fetchall()}
+            cursor.execute(DEMAND_QUERY, (window_start, as_of))
+            demand = {}
+            for item_id, location_id, quantity, value in cursor.fetchall():
+                totals = demand.setdefault((item_id, location_id), [0, 0, 0])
+                totals[0] += quantity
+                totals[1] += quantity * quantity
+                totals[2] += value
+            conn.close()
+
+            results = {}
+            for key in set(stock) | set(demand):
+                quantity, value = stock.get(key, (0, 0))
+                total, squares, demand_value = demand.get(key, (0, 0, 0))
+                average = total / 90
+                std = max(squares / 90 - average * average, 0) ** 0.5
+                results[key] = [quantity / average if average else float('inf'),
+                                demand_value * 365 / 90 / value if value else 0,
+                                average * 14 + 1.6449 * std * 14 ** 0.5, demand_value]
+            by_location = {}
+            for key, result in results.items():
+                by_location.setdefault(key[1], []).append((result[3], key))
+            for entries in by_location.values():
+                entries.sort(reverse=True)
+                total = sum(entry[0] for entry in entries)
+                running = 0
+                for demand_value, key in entries:
+                    share = running / total if total else 1
+                    results[key].append('A' if share < 0.8 else 'B' if share < 0.95 else 'C')
+                    running += demand_value
+            return results
+
+        rows = args.items * args.locations
+        looped_ms = timed(looped, repeat=1)
+        vectorized_ms = timed(analytics.analyze, repeat=1)
+        print(f"\n{'Path':<24}{'Time (ms)':>12}{'Rows/s':>14}")
+        print(f"{'Python loop':<24}{looped_ms:>12.0f}{rows / looped_ms * 1000:>14,.0f}")
+        print(f"{'NumPy (analyze)':<24}{vectorized_ms:>12.0f}{rows / vectorized_ms * 1000:>14,.0f}")
+
+
+def bench_connections(args):
+    """Connection setup overhead, and report throughput while another thread is posting"""
+    duration = 5.0
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = create_benchmark_database(directory)
+        accounts = build_synthetic_ledger(db_path, args.lines)
+
+        def direct_connection():
+            conn = sqlite3.connect(db_path)
+            conn.row_factory = sqlite3.Row
+            conn.execute('SELECT 1').fetchone()
+            conn.close()
+
+        def pooled_connection():
+            conn = get_connection(db_path)
+            conn.execute('SELECT 1').fetchone()
+            conn.close()
+
+        calls = 1000
+        direct_ms = timed(lambda: [direct_connection() for _ in range(calls)])
+        pooled_ms = timed(lambda: [pooled_connection() for _ in range(calls)])
+        print(f"\n{'Connection':<22}{'Per call (us)':>16}")
+        print(f"{'sqlite3.connect':<22}{direct_ms * 1000 / calls:>16.1f}")
+        print(f"{'pooled':<22}{pooled_ms * 1000 / calls:>16.1f}")
+
+        print(f"\n{'Journal mode':<22}{'Posts/s':>10}{'Reports/s':>12}{'Failed posts':>14}")
+        for journal_mode, synchronous in (('DELETE', 'FULL'), ('WAL', 'NORMAL')):
+            configure_pool(db_path, journal_mode=journal_mode, synchronous=synchronous)
+            accounting = AccountingManager(db_path)
+            stop = threading.Event()
+            counts = {'posts': 0, 'failed': 0, 'reports': 0}
+
+            def poster():
+                while not stop.is_set():
+                    success, entry_number, msg = accounting.create_journal_entry(
+                        '2025-06-01', 'Manual', 'BENCH', 'Concurrent posting', 'GBP', 1.0,
+                        [(accounts[0], 10, 0, 'Debit'), (accounts[1], 0, 10, 'Credit')]
+                    )
+                    counts['posts' if success else 'failed'] += 1
+
+            def reporter():
+                while not stop.is_set():
+                    accounting.get_trial_balance('2025-06-30')
+                    accounting.get_general_ledger(accounts[0], '2025-06-01', '2025-06-30')
+                    counts['reports'] += 1
+
+            workers = [threading.Thread(target=poster), threading.Thread(target=reporter)]
+            for worker in workers:
+                worker.start()
+            time.sleep(duration)
+            stop.set()
+            for worker in workers:
+                worker.join()
+
+            print(f"{journal_mode:<22}{counts['posts'] / duration:>10,.0f}"
+                  f"{counts['reports'] / duration:>12,.0f}{counts['failed']:>14,}")
+
+        configure_pool(db_path)
+
+
+def bench_money(args):
+    """Compare per-account ledger sums over integer pence with the same amounts stored as REAL"""
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = create_benchmark_database(directory)
+        print(f"Building synthetic ledger with {args.lines:,} lines...")
+        build_synthetic_ledger(db_path, args.lines)
+
+        conn = sqlite3.connect(db_path)
+        conn.execute('''
+            CREATE TABLE journal_lines_real AS
+            SELECT account_id, debit_base_currency / 100.0 as debit_base_currency,
+                   credit_base_currency / 100.0 as credit_base_currency
+            FROM journal_entry_lines
+        ''')
+        conn.commit()
+
+        query = '''
+            SELECT account_id, SUM(debit_base_currency), SUM(credit_base_currency)
+            FROM {table} GROUP BY account_id
+        '''
+        integer_ms = timed(lambda: conn.execute(query.format(table='journal_entry_lines')).fetchall())
+        real_ms = timed(lambda: conn.execute(query.format(table='journal_lines_real')).fetchall())
+
+        exact = conn.execute(query.format(table='journal_entry_lines')).fetchall()
+        floats = dict((row[0], row[1:]) for row in conn.execute(query.format(table='journal_lines_real')))
+        drift = max(abs(debit / 100 - floats[account_id][0]) + abs(credit / 100 - floats[account_id][1])
+                    for account_id, debit, credit in exact)
+        total_debits = sum(debit for debit, credit in floats.values())
+        total_credits = sum(credit for debit, credit in floats.values())
+        conn.close()
+
+        print(f"\n{'Storage':<18}{'Sum by account (ms)':>22}")
+        print(f"{'INTEGER pence':<18}{integer_ms:>22.1f}")
+        print(f"{'REAL pounds':<18}{real_ms:>22.1f}")
+        print(f"\nLargest per-account float drift: {drift:.10f}")
+        print(f"REAL trial balance difference: {total_debits - total_credits:.10f} "
+              f"(exactly 0 with integer pence)")
+
+
+def bench_ageing(args):
+    """Receivables ageing for every customer: grouping the open invoices against the ageing balances"""
+    rng = random.Random(42)
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = create_benchmark_database(directory)
+        masters = create_trading_masters(db_path)
+
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        cursor.execute("SELECT account_id FROM chart_of_accounts WHERE account_code = '1121'")
+        receivable_account = cursor.fetchone()[0]
+        cursor.executemany('''
+            INSERT INTO customers (customer_code, customer_name, receivable_account_id, created_date)
+            VALUES (?, ?, ?, ?)
+        ''', [(f"BENCH-C{n:06d}", f"Benchmark Customer {n}", receivable_account, datetime.now().isoformat())
+              for n in range(args.customers)])
+        cursor.execute("SELECT customer_id FROM customers WHERE customer_code LIKE 'BENCH-C0%'")
+        customer_ids = [row[0] for row in cursor.fetchall()]
+        conn.commit()
+        conn.close()
+
+        print(f"Creating {args.invoices:,} invoices for {args.customers:,} customers...")
+        sales = SalesManager(db_path)
+        results = sales.create_sales_invoices_bulk({
+            'customer_id': rng.choice(customer_ids),
+            'invoice_date': (date(2025, 1, 1) + timedelta(days=number * 365 // args.invoices)).isoformat(),
+            'due_date': (date(2025, 1, 31) + timedelta(days=number * 365 // args.invoices)).isoformat(),
+            'lines': synthetic_invoice_lines(masters, 1, rng)
+        } for number in range(args.invoices))
+        failures = [msg for success, number, msg in results if not success]
+        if failures:
+            raise SystemExit(f"FAILED: {failures[0]}")
+
+        report = AgeingReport(db_path)
+        discrepancies = report.check_ageing_balances()
+        if discrepancies:
+            raise SystemExit(f"FAILED: ageing balances differ: {discrepancies[0]}")
+
+        as_of = date(2025, 12, 31)
+        boundaries = [boundary for label, boundary in ageing_boundaries(as_of)]
+
+        def scan():
+            # The same buckets worked out from the open invoices themselves
+            conn = get_connection(db_path)
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT customer_id, currency, exchange_rate, COALESCE(due_date, invoice_date) as due_date,
+                       amount_outstanding
+                FROM sales_invoices WHERE amount_outstanding > 0
+            ''')
+            ageing = {}
+            for row in cursor.fetchall():
+                buckets = ageing.setdefault(row['customer_id'], [0] * len(boundaries))
+                bucket = next(index for index, boundary in enumerate(boundaries) if row['due_date'] >= boundary)
+                buckets[bucket] += document_base_amount(row['amount_outstanding'], row['currency'],
+                                                        row['exchange_rate'])
+            conn.close()
+            return ageing
+
+        parties = len(report.get_ageing('Customer', as_of.isoformat()))
+        print(f"\n{parties:,} customers with open invoices")
+        print(f"{'Receivables ageing':<26}{'Latency (ms)':>14}")
+        print(f"{'Scan open invoices':<26}{timed(scan):>14.1f}")
+        print(f"{'Ageing balances':<26}{timed(report.get_ageing, 'Customer', as_of.isoformat()):>14.1f}")
+
+
+def bench_balances(args):
+    """Chart of accounts balances: one get_account_balance call per account against get_all_account_balances"""
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = create_benchmark_database(directory)
+        add_benchmark_accounts(db_path, args.accounts)
+        print(f"Building synthetic ledger with {args.lines:,} lines...")
+        build_synthetic_ledger(db_path, args.lines)
+        accounting = AccountingManager(db_path)
+
+        account_ids = [acc['account_id'] for acc in accounting.get_all_account_balances()]
+        per_account_ms = timed(lambda: [accounting.get_account_balance(account_id) for account_id in account_ids])
+        all_ms = timed(accounting.get_all_account_balances)
+
+        print(f"\n{len(account_ids):,} accounts")
+        print(f"{'Method':<28}{'Latency (ms)':>14}")
+        print(f"{'get_account_balance loop':<28}{per_account_ms:>14.1f}")
+        print(f"{'get_all_account_balances':<28}{all_ms:>14.1f}")
+
+
+def bench_periods(args):
+    """Twelve months of P&L with prior-year comparatives: 24 single-period reports against one multi-period report"""
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = create_benchmark_database(directory)
+        print(f"Building synthetic ledger with {args.lines:,} lines...")
+        build_synthetic_ledger(db_path, args.lines)
+        accounting = AccountingManager(db_path)
+
+        periods = month_periods('2025-01', 12)
+        periods += comparative_periods(periods)
+
+        results = [
+            ('1 period', timed(accounting.get_profit_and_loss, *periods[0])),
+            ('24 single periods', timed(lambda: [accounting.get_profit_and_loss(*period) for period in periods])),
+            ('24 periods, lists', timed(accounting.get_multi_period_profit_and_loss, periods, False)),
+        ]
+        if numpy is not None:
+            results.append(('24 periods, NumPy', timed(accounting.get_multi_period_profit_and_loss, periods, True)))
+
+        print(f"\n{'Profit & Loss':<22}{'Latency (ms)':>14}")
+        for name, ms in results:
+            print(f"{name:<22}{ms:>14.1f}")
+
+
+def export_ledger_peak_rss(db_path, mode):
+    """
+    Export the general ledger of every account to a CSV sink in this process and
+    return (lines exported, peak RSS in MiB). mode is 'list' for get_general_ledger,
+    'iter' for iter_general_ledger, or 'baseline' to only import and connect.
+    """
+    import resource
+
+    # Memory-mapped database pages count towards RSS, so map nothing and keep the page cache small
+    configure_pool(db_path, mmap_size=0, cache_size=-2000)
+    accounting = AccountingManager(db_path)
+    exported = 0
+
+    with open(os.devnull, 'w', newline='') as sink:
+        writer = csv.writer(sink)
+        for account_id in get_posting_accounts(db_path):
+            if mode == 'list':
+                account, transactions, opening_balance = accounting.get_general_ledger(account_id)
+                writer.writerows(trans.values() for trans in transactions)
+                exported += len(transactions)
+            elif mode == 'iter':
+                for row in accounting.iter_general_ledger(account_id):
+                    writer.writerow(row)
+                    exported += 1
+
+    # ru_maxrss is in KiB on Linux
+    return exported, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench_memory(args):
+    """Peak RSS of a whole-ledger export: list-building get_general_ledger against streaming iter_general_ledger"""
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = create_benchmark_database(directory)
+        print(f"Building synthetic ledger with {args.lines:,} lines...")
+        build_synthetic_ledger(db_path, args.lines)
+
+        # Peak RSS only ever grows, so each export runs in a fresh process
+        context = multiprocessing.get_context('spawn')
+        results = {}
+        for mode in ('baseline', 'list', 'iter'):
+            with context.Pool(1) as pool:
+                start = time.perf_counter()
+                exported, peak_mib = pool.apply(export_ledger_peak_rss, (db_path, mode))
+                results[mode] = (exported, peak_mib, (time.perf_counter() - start) * 1000)
+
+        baseline_mib = results['baseline'][1]
+        print(f"\n{'Export':<22}{'Lines':>12}{'Peak RSS (MiB)':>16}{'Above baseline':>16}{'Time (ms)':>12}")
+        for mode, label in (('list', 'get_general_ledger'), ('iter', 'iter_general_ledger')):
+            exported, peak_mib, elapsed = results[mode]
+            print(f"{label:<22}{exported:>12,}{peak_mib:>16.1f}{peak_mib - baseline_mib:>16.1f}{elapsed:>12.0f}")
+        print(f"\nBaseline process (imports and connection only): {baseline_mib:.1f} MiB")
+
+
+BENCHMARKS = {
+    'ageing': bench_ageing,
+    'analytics': bench_analytics,
+    'balances': bench_balances,
+    'cogs': bench_cogs,
+    'connections': bench_connections,
+    'costing': bench_costing,
+    'dashboard': bench_dashboard,
+    'indexes': bench_indexes,
+    'invoices': bench_invoices,
+    'masters': bench_masters,
+    'memory': bench_memory,
+    'money': bench_money,
+    'periods': bench_periods,
+    'receipts': bench_receipts,
+    'rollup': bench_rollup,
+    'sequences': bench_sequences,
+    'snapshots': bench_snapshots,
+    'statements': bench_statements,
+    'stock': bench_stock,
+    'transfers': bench_transfers,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Accounting engine benchmarks")
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--lines', type=int, default=2000000,
+                        help="Number of journal lines in the synthetic ledger")
+    parser.add_argument('--accounts', type=int, default=300,
+                        help="Number of extra accounts in the chart of accounts")
+    parser.add_argument('--invoices', type=int, default=2000,
+                        help="Number of invoices to post")
+    parser.add_argument('--invoice-lines', type=int, default=200,
+                        help="Number of lines on the benchmark sales invoice")
+    parser.add_argument('--bill-lines', type=int, default=500,
+                        help="Number of lines on the benchmark purchase bill")
+    parser.add_argument('--customers', type=int, default=50000,
+                        help="Number of customers for the ageing benchmark")
+    parser.add_argument('--items', type=int, default=5000,
+                        help="Number of stocked items")
+    parser.add_argument('--movements', type=int, default=50000,
+                        help="Number of stock issues or transfer lines to post")
+    parser.add_argument('--locations', type=int, default=20,
+                        help="Number of stock locations for the analytics benchmark")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
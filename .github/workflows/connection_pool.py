@@ -0,0 +1,159 @@
+import sqlite3
+import threading
+import weakref
+
+# Default connection settings, override per database with configure_pool()
+DEFAULT_POOL_SETTINGS = {
+    'pool_size': 8,                     # idle connections kept open per database
+    'timeout': 5.0,                     # seconds to wait for a lock held by another writer
+    'journal_mode': 'WAL',              # readers no longer block the writer
+    'synchronous': 'NORMAL',            # safe with WAL, avoids an fsync per commit
+    'mmap_size': 256 * 1024 * 1024,     # bytes of the database file memory-mapped for reads
+    'cache_size': -64000,               # page cache in KiB when negative (64 MB)
+    'foreign_keys': True,
+}
+
+# Rows fetched per round trip by the streaming iter_* report methods
+ITER_BATCH_SIZE = 1000
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() hands it back to its pool"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = None
+        self.checked_out = False
+        self.open_cursors = weakref.WeakSet()
+
+    def cursor(self, *args, **kwargs):
+        cursor = super().cursor(*args, **kwargs)
+        self.open_cursors.add(cursor)
+        return cursor
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def close_cursors(self):
+        """Close cursors left open, so that no read snapshot outlives the checkout"""
+        for cursor in list(self.open_cursors):
+            cursor.close()
+
+    def close(self):
+        if self.pool is not None:
+            if not self.checked_out:
+                return  # Already back in the pool
+            if self.pool.release(self):
+                return
+        super().close()
+
+
+class ConnectionPool:
+    """
+    Pool of configured connections to one database file.
+    Connections are created with check_same_thread=False so that any thread
+    can use them, but each connection is only handed to one caller at a time.
+    """
+    def __init__(self, db_path, **settings):
+        self.db_path = db_path
+        self.settings = dict(DEFAULT_POOL_SETTINGS, **settings)
+        self.idle = []
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def create_connection(self):
+        """Open a new connection and apply the pool pragmas"""
+        conn = sqlite3.connect(self.db_path, timeout=self.settings['timeout'],
+                               factory=PooledConnection, check_same_thread=False)
+        conn.execute(f"PRAGMA journal_mode = {self.settings['journal_mode']}")
+        conn.execute(f"PRAGMA synchronous = {self.settings['synchronous']}")
+        conn.execute(f"PRAGMA mmap_size = {int(self.settings['mmap_size'])}")
+        conn.execute(f"PRAGMA cache_size = {int(self.settings['cache_size'])}")
+        conn.execute(f"PRAGMA foreign_keys = {'ON' if self.settings['foreign_keys'] else 'OFF'}")
+        conn.pool = self
+        return conn
+
+    def acquire(self):
+        """Get an idle connection, or open a new one if none is free"""
+        with self.lock:
+            conn = self.idle.pop() if self.idle else None
+
+        if conn is None:
+            conn = self.create_connection()
+
+        conn.row_factory = sqlite3.Row
+        conn.checked_out = True
+        return conn
+
+    def release(self, conn):
+        """Take a connection back; returns False if the pool is full and it should be closed"""
+        conn.close_cursors()
+        if conn.in_transaction:
+            conn.rollback()
+
+        conn.checked_out = False
+
+        with self.lock:
+            if not self.closed and len(self.idle) < self.settings['pool_size']:
+                self.idle.append(conn)
+                return True
+
+        conn.pool = None
+        return False
+
+    def close_all(self):
+        """Close every idle connection"""
+        with self.lock:
+            idle, self.idle = self.idle, []
+            self.closed = True
+
+        for conn in idle:
+            conn.pool = None
+            conn.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path):
+    """Get the process-wide pool for a database file"""
+    with _pools_lock:
+        pool = _pools.get(db_path)
+        if pool is None:
+            pool = _pools[db_path] = ConnectionPool(db_path)
+        return pool
+
+
+def configure_pool(db_path, **settings):
+    """Replace the pool for a database file with one using the given settings"""
+    with _pools_lock:
+        old_pool = _pools.get(db_path)
+        _pools[db_path] = ConnectionPool(db_path, **settings)
+
+    if old_pool:
+        old_pool.close_all()
+
+
+def get_connection(db_path):
+    """Get a pooled connection; close() returns it to the pool"""
+    return get_pool(db_path).acquire()
+
+
+def iter_batches(cursor, row_type=None, batch_size=ITER_BATCH_SIZE):
+    """
+    Yield the rows of an executed cursor, fetching batch_size rows at a time so
+    that only one batch is ever held in memory. Rows are plain tuples, or
+    row_type instances (e.g. a namedtuple) when row_type is given.
+    """
+    cursor.row_factory = None
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        if row_type is None:
+            yield from rows
+        else:
+            yield from map(row_type._make, rows)
@@ -0,0 +1,179 @@
+from collections import deque
+
+# Costing methods, set per item in inventory_items.costing_method
+WEIGHTED_AVERAGE = 'WAC'
+FIFO = 'FIFO'
+
+# FIFO layers are read from the front of an item and location this many at a time
+LAYER_PAGE_SIZE = 16
+
+
+class WeightedAverageCost:
+    """Issues at the running weighted average cost of the stock row"""
+    def receive(self, batch, key, current, quantity, unit_cost):
+        current[0] += quantity
+        current[2] += quantity * unit_cost
+        current[1] = current[2] / current[0] if current[0] > 0 else 0
+
+    def issue(self, batch, key, current, quantity):
+        """Take quantity out of stock and return [(quantity, unit_cost), ...] it was costed at"""
+        current[0] -= quantity
+        current[2] -= quantity * current[1]
+        return [(quantity, current[1])]
+
+
+class FifoCost(WeightedAverageCost):
+    """
+    Issues from cost layers, oldest receipt first. The stock row keeps the
+    quantity and value of the layers, and their average cost.
+    """
+    def receive(self, batch, key, current, quantity, unit_cost):
+        super().receive(batch, key, current, quantity, unit_cost)
+        batch.layers(key).add(quantity, unit_cost)
+
+    def issue(self, batch, key, current, quantity):
+        pieces = batch.layers(key).take(quantity, current[1])
+        current[0] -= quantity
+        current[2] -= sum(piece_quantity * unit_cost for piece_quantity, unit_cost in pieces)
+        if current[0] > 0:
+            current[1] = current[2] / current[0]
+        return pieces
+
+
+COSTING_METHODS = {
+    WEIGHTED_AVERAGE: WeightedAverageCost(),
+    FIFO: FifoCost(),
+}
+
+
+class CostLayers:
+    """
+    FIFO layers of one item and location within a CostingBatch. Layers are read
+    from inventory_cost_layers a page at a time as issues reach them, so an issue
+    costs the layers it consumes, not the item's receipt history. Fully consumed
+    layers are deleted and new ones inserted when the batch is flushed.
+    """
+    def __init__(self, cursor, key):
+        self.cursor = cursor
+        self.key = key
+        self.stored = deque()           # [layer_seq, quantity, unit_cost] read and not yet consumed
+        self.last_read = 0              # layer_seq of the last stored layer read
+        self.all_read = False
+        self.consumed_through = None    # stored layers up to this layer_seq are used up
+        self.changed_front = None       # stored layer that was partly consumed
+        self.added = deque()            # [layer_seq, quantity, unit_cost] not yet stored
+        self.next_seq = None
+
+    def add(self, quantity, unit_cost):
+        if self.next_seq is None:
+            self.cursor.execute('''
+                SELECT MAX(layer_seq) FROM inventory_cost_layers
+                WHERE item_id = ? AND location_id = ?
+            ''', self.key)
+            self.next_seq = (self.cursor.fetchone()[0] or 0) + 1
+        self.added.append([self.next_seq, quantity, unit_cost])
+        self.next_seq += 1
+
+    def take(self, quantity, fallback_cost):
+        """Consume quantity from the oldest layers: [(quantity, unit_cost), ...]"""
+        pieces = []
+        while quantity > 0:
+            layer = self._front()
+            if layer is None:
+                # Stock without layers (e.g. held before the item became FIFO) is costed at its average
+                pieces.append((quantity, fallback_cost))
+                break
+
+            used = min(quantity, layer[1])
+            pieces.append((used, layer[2]))
+            layer[1] -= used
+            quantity -= used
+
+            if layer[1] <= 0:
+                if self.stored and layer is self.stored[0]:
+                    self.stored.popleft()
+                    self.consumed_through = layer[0]
+                    self.changed_front = None
+                else:
+                    self.added.popleft()
+            elif self.stored and layer is self.stored[0]:
+                self.changed_front = layer
+        return pieces
+
+    def _front(self):
+        if not self.stored and not self.all_read:
+            self.cursor.execute('''
+                SELECT layer_seq, quantity, unit_cost FROM inventory_cost_layers
+                WHERE item_id = ? AND location_id = ? AND layer_seq > ?
+                ORDER BY layer_seq LIMIT ?
+            ''', (*self.key, self.last_read, LAYER_PAGE_SIZE))
+            rows = self.cursor.fetchall()
+            self.stored.extend([row[0], row[1], row[2]] for row in rows)
+            self.all_read = len(rows) < LAYER_PAGE_SIZE
+            if rows:
+                self.last_read = rows[-1][0]
+
+        if self.stored:
+            return self.stored[0]
+        return self.added[0] if self.added else None
+
+    def flush(self):
+        if self.consumed_through is not None:
+            self.cursor.execute('''
+                DELETE FROM inventory_cost_layers
+                WHERE item_id = ? AND location_id = ? AND layer_seq <= ?
+            ''', (*self.key, self.consumed_through))
+        if self.changed_front is not None:
+            self.cursor.execute('''
+                UPDATE inventory_cost_layers SET quantity = ?
+                WHERE item_id = ? AND location_id = ? AND layer_seq = ?
+            ''', (self.changed_front[1], *self.key, self.changed_front[0]))
+        self.cursor.executemany('''
+            INSERT INTO inventory_cost_layers (item_id, location_id, layer_seq, quantity, unit_cost)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(*self.key, layer_seq, quantity, unit_cost) for layer_seq, quantity, unit_cost in self.added])
+
+
+class CostingBatch:
+    """
+    Costs the receipts, issues and transfers of one posting against running stock
+    rows ([quantity, weighted_avg_cost, total_value], as read from the stock state),
+    by each item's costing method. Call flush() before the posting commits to write
+    the FIFO layers it changed.
+    """
+    def __init__(self, cursor, master_data):
+        self.cursor = cursor
+        self.master_data = master_data
+        self.cost_layers = {}
+
+    def method(self, item_id):
+        item = self.master_data.get(self.cursor, 'items', item_id)
+        return COSTING_METHODS[(item and item.get('costing_method')) or WEIGHTED_AVERAGE]
+
+    def layers(self, key):
+        layers = self.cost_layers.get(key)
+        if layers is None:
+            layers = self.cost_layers[key] = CostLayers(self.cursor, key)
+        return layers
+
+    def receive(self, key, current, quantity, unit_cost):
+        """Add quantity at unit_cost to the stock row current"""
+        self.method(key[0]).receive(self, key, current, quantity, unit_cost)
+
+    def issue(self, key, current, quantity):
+        """Take quantity out of the stock row current and return its cost"""
+        return sum(piece_quantity * unit_cost
+                   for piece_quantity, unit_cost in self.method(key[0]).issue(self, key, current, quantity))
+
+    def transfer(self, from_key, source, to_key, destination, quantity):
+        """Move quantity between stock rows at the source's cost and return its cost"""
+        method = self.method(from_key[0])
+        pieces = method.issue(self, from_key, source, quantity)
+        # FIFO layers arrive as they left, so the destination issues them in the same order
+        for piece_quantity, unit_cost in pieces:
+            method.receive(self, to_key, destination, piece_quantity, unit_cost)
+        return sum(piece_quantity * unit_cost for piece_quantity, unit_cost in pieces)
+
+    def flush(self):
+        for layers in self.cost_layers.values():
+            layers.flush()
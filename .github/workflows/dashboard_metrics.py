@@ -0,0 +1,210 @@
+from datetime import date
+from ageing import ageing_summary, document_base_amount
+from connection_pool import get_connection
+from money import from_minor, to_minor
+
+# Dashboard counters: one row per metric in dashboard_metrics (bucket is always '').
+# Open documents (amount_outstanding > 0) count their outstanding amount; their
+# ageing is read from ageing_balances, which keeps them by party and due date.
+OPEN_INVOICES = 'open_invoices'
+UNPAID_BILLS = 'unpaid_bills'
+STOCK_VALUE = 'stock_value'
+CASH_BALANCE = 'cash_balance'
+
+# Accounts under Cash and Bank (1110) make up the cash balance
+CASH_ACCOUNT_PREFIX = '111'
+
+# Party type each open documents counter is aged by in ageing_balances
+AGEING_PARTIES = {OPEN_INVOICES: 'Customer', UNPAID_BILLS: 'Supplier'}
+
+
+def add_to_metric(cursor, metric, count=0, amount=0):
+    """Add to a dashboard counter in the caller's transaction"""
+    if not count and not amount:
+        return
+
+    cursor.execute('''
+        INSERT INTO dashboard_metrics (metric, bucket, count, amount)
+        VALUES (?, '', ?, ?)
+        ON CONFLICT(metric, bucket) DO UPDATE SET
+            count = count + excluded.count,
+            amount = amount + excluded.amount
+    ''', (metric, count, amount))
+
+
+def update_open_documents(cursor, metric, changes):
+    """
+    Record invoices or bills whose amount outstanding changed:
+    changes = [(document, old_outstanding, new_outstanding), ...], where document has
+    currency and exchange_rate
+    """
+    count = 0
+    amount = 0
+    for document, old_outstanding, new_outstanding in changes:
+        count += (new_outstanding > 0) - (old_outstanding > 0)
+        # Each document counts at its outstanding amount rounded in base currency, as when recalculated
+        amount += (document_base_amount(new_outstanding, document['currency'], document['exchange_rate']) -
+                   document_base_amount(old_outstanding, document['currency'], document['exchange_rate']))
+    add_to_metric(cursor, metric, count, amount)
+
+
+def add_open_documents(cursor, metric, documents):
+    """Count new invoices or bills, outstanding in full, into their open documents counter"""
+    update_open_documents(cursor, metric, [(document, 0, document['total_amount']) for document in documents])
+
+
+def update_stock_value(cursor, revaluations):
+    """Record stock rows whose total_value changed: revaluations = [(old_value, new_value), ...]"""
+    # Each row counts at its value rounded to pence, so the counter matches the rows exactly
+    add_to_metric(cursor, STOCK_VALUE, amount=sum(to_minor(new_value or 0) - to_minor(old_value or 0)
+                                                  for old_value, new_value in revaluations))
+
+
+def update_cash_balance(cursor, account_id, debit, credit, account_code=None):
+    """
+    Record a posting to an account, which moves the cash balance if it is a cash account.
+    Callers that know the account code pass it, which saves looking the account up.
+    """
+    if debit == credit:
+        return
+
+    if account_code is not None:
+        if account_code.startswith(CASH_ACCOUNT_PREFIX):
+            add_to_metric(cursor, CASH_BALANCE, amount=debit - credit)
+        return
+
+    cursor.execute('''
+        INSERT INTO dashboard_metrics (metric, bucket, count, amount)
+        SELECT ?, '', 0, ? FROM chart_of_accounts
+        WHERE account_id = ? AND account_code LIKE ?
+        ON CONFLICT(metric, bucket) DO UPDATE SET amount = amount + excluded.amount
+    ''', (CASH_BALANCE, debit - credit, account_id, CASH_ACCOUNT_PREFIX + '%'))
+
+
+def calculate_dashboard_metrics(cursor):
+    """Recalculate every dashboard counter from the source tables: {metric: (count, amount)}"""
+    metrics = {}
+
+    def add(metric, count, amount):
+        current = metrics.get(metric, (0, 0))
+        metrics[metric] = (current[0] + count, current[1] + amount)
+
+    for metric, table in ((OPEN_INVOICES, 'sales_invoices'), (UNPAID_BILLS, 'purchase_bills')):
+        cursor.execute(f'''
+            SELECT amount_outstanding, currency, exchange_rate FROM {table} WHERE amount_outstanding > 0
+        ''')
+        # Migrations run on a plain cursor, so rows are read as tuples
+        for outstanding, currency, exchange_rate in cursor.fetchall():
+            add(metric, 1, document_base_amount(outstanding, currency, exchange_rate))
+
+    # Stock value is kept as the sum of each stock row's value rounded to pence
+    cursor.execute('SELECT total_value FROM inventory_stock')
+    add(STOCK_VALUE, 0, sum(to_minor(row[0] or 0) for row in cursor.fetchall()))
+
+    cursor.execute('''
+        SELECT COALESCE(SUM(jel.debit_base_currency - jel.credit_base_currency), 0)
+        FROM journal_entry_lines jel
+        JOIN journal_entries je ON jel.entry_id = je.entry_id
+        JOIN chart_of_accounts a ON jel.account_id = a.account_id
+        WHERE a.account_code LIKE ? AND je.status = 'Posted'
+    ''', (CASH_ACCOUNT_PREFIX + '%',))
+    add(CASH_BALANCE, 0, cursor.fetchone()[0])
+
+    return {key: value for key, value in metrics.items() if value != (0, 0)}
+
+
+def rebuild_dashboard_metrics(cursor):
+    """Recreate the dashboard counters from the source tables"""
+    cursor.execute('DELETE FROM dashboard_metrics')
+    cursor.executemany('''
+        INSERT INTO dashboard_metrics (metric, bucket, count, amount) VALUES (?, '', ?, ?)
+    ''', [(metric, count, amount) for metric, (count, amount) in sorted(calculate_dashboard_metrics(cursor).items())])
+
+
+class DashboardMetrics:
+    """
+    Dashboard statistics kept as counters that the posting paths update in their
+    own transactions, so reading them never scans invoices, bills or stock. Each
+    read is a handful of counter rows plus the ageing of recent due dates.
+    """
+    def __init__(self, db_path="accounting_data.db"):
+        self.db_path = db_path
+
+    def connect(self):
+        return get_connection(self.db_path)
+
+    def get_dashboard_stats(self, as_of=None):
+        """
+        Get the dashboard statistics from the counters. Ageing of open invoices and
+        bills is worked out from their due dates as of as_of (default today).
+        """
+        as_of = date.fromisoformat(as_of) if as_of else date.today()
+
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT metric, count, amount FROM dashboard_metrics')
+        totals = {metric: [0, 0] for metric in (OPEN_INVOICES, UNPAID_BILLS, STOCK_VALUE, CASH_BALANCE)}
+        for row in cursor.fetchall():
+            totals[row['metric']] = [row['count'], row['amount']]
+
+        ageing = {metric: ageing_summary(cursor, party_type, as_of, *totals[metric])
+                  for metric, party_type in AGEING_PARTIES.items()}
+        conn.close()
+
+        def ageing_report(metric):
+            return [{'bucket': label, 'count': count, 'amount': from_minor(amount)}
+                    for label, count, amount in ageing[metric]]
+
+        return {
+            'open_invoices': totals[OPEN_INVOICES][0],
+            'open_invoices_amount': from_minor(totals[OPEN_INVOICES][1]),
+            'unpaid_bills': totals[UNPAID_BILLS][0],
+            'unpaid_bills_amount': from_minor(totals[UNPAID_BILLS][1]),
+            'stock_value': from_minor(totals[STOCK_VALUE][1]),
+            'cash_balance': from_minor(totals[CASH_BALANCE][1]),
+            'receivables_ageing': ageing_report(OPEN_INVOICES),
+            'payables_ageing': ageing_report(UNPAID_BILLS),
+        }
+
+    def check_dashboard_metrics(self):
+        """
+        Reconcile the dashboard counters against the source tables and return any
+        differences. Counters and recalculated values are both exact integers.
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        expected = calculate_dashboard_metrics(cursor)
+
+        cursor.execute('SELECT metric, count, amount FROM dashboard_metrics')
+        actual = {row['metric']: (row['count'], row['amount']) for row in cursor.fetchall()}
+
+        conn.close()
+
+        discrepancies = []
+        for metric in sorted(set(expected) | set(actual)):
+            expected_values = expected.get(metric, (0, 0))
+            actual_values = actual.get(metric, (0, 0))
+            if expected_values != actual_values:
+                discrepancies.append({
+                    'metric': metric,
+                    'expected': dict(zip(('count', 'amount'), expected_values)),
+                    'actual': dict(zip(('count', 'amount'), actual_values))
+                })
+
+        return discrepancies
+
+    def rebuild_dashboard_metrics(self):
+        """Rebuild the dashboard counters from the source tables"""
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        try:
+            rebuild_dashboard_metrics(cursor)
+            conn.commit()
+            return True, None, "Dashboard metrics rebuilt successfully"
+        except Exception as e:
+            conn.rollback()
+            return False, None, str(e)
+        finally:
+            conn.close()
@@ -1,6 +1,387 @@
 import sqlite3
 import os
+import re
 from datetime import datetime
+from accounting import rebuild_period_balances
+from ageing import rebuild_ageing_balances
+from dashboard_metrics import rebuild_dashboard_metrics
+from master_data import MASTER_TABLES, invalidate_master_data
+from sequences import seed_document_sequences
+from money import BASE_CURRENCY, to_minor
+
+
+# Secondary indexes on the ledger hot paths: (name, table, columns)
+LEDGER_INDEXES = [
+    ('idx_journal_lines_account', 'journal_entry_lines',
+     'account_id, entry_id, debit_base_currency, credit_base_currency'),
+    ('idx_journal_lines_entry', 'journal_entry_lines', 'entry_id'),
+    ('idx_journal_entries_date_status', 'journal_entries', 'entry_date, status'),
+    ('idx_inventory_trans_item_date', 'inventory_transactions', 'item_id, transaction_date'),
+    ('idx_payments_party', 'payments', 'party_type, party_id'),
+]
+
+# Indexes the general ledger and stock movement pages read in key order
+PAGING_INDEXES = [
+    ('idx_journal_lines_account_date', 'journal_entry_lines',
+     'account_id, entry_date, entry_id, debit_amount, credit_amount'),
+    ('idx_inventory_trans_date', 'inventory_transactions', 'transaction_date'),
+]
+
+
+# Money columns held as integer minor units: table -> {column: SQL expression for its currency}
+MINOR_UNIT_COLUMNS = {
+    'journal_entry_lines': {
+        'debit_amount': '(SELECT currency FROM journal_entries je WHERE je.entry_id = t.entry_id)',
+        'credit_amount': '(SELECT currency FROM journal_entries je WHERE je.entry_id = t.entry_id)',
+        'debit_base_currency': f"'{BASE_CURRENCY}'",
+        'credit_base_currency': f"'{BASE_CURRENCY}'",
+    },
+    'account_period_balances': {
+        'debit_amount': f"'{BASE_CURRENCY}'",
+        'credit_amount': f"'{BASE_CURRENCY}'",
+        'cumulative_debit': f"'{BASE_CURRENCY}'",
+        'cumulative_credit': f"'{BASE_CURRENCY}'",
+    },
+    'sales_invoices': {'subtotal': 'currency', 'vat_amount': 'currency', 'total_amount': 'currency'},
+    'sales_invoice_lines': {
+        'line_total': '(SELECT currency FROM sales_invoices si WHERE si.invoice_id = t.invoice_id)',
+    },
+    'purchase_bills': {'subtotal': 'currency', 'vat_amount': 'currency', 'total_amount': 'currency'},
+    'purchase_bill_lines': {
+        'line_total': '(SELECT currency FROM purchase_bills pb WHERE pb.bill_id = t.bill_id)',
+    },
+    'payments': {'amount': 'currency'},
+}
+
+
+def convert_to_minor_units(cursor):
+    """
+    Rebuild the REAL money columns of an existing database as INTEGER minor units.
+    SQLite cannot change a column type in place, so each table is copied into a new
+    table with the same definition. Run with foreign keys off, as migrate() sets them,
+    so that dropping the old tables does not cascade.
+    """
+    cursor.connection.create_function('to_minor', 2, to_minor, deterministic=True)
+
+    for table, columns in MINOR_UNIT_COLUMNS.items():
+        cursor.execute(f'PRAGMA table_info({table})')
+        table_columns = {row[1]: row[2] for row in cursor.fetchall()}
+        convert = [column for column in columns if table_columns.get(column, '').upper() == 'REAL']
+        if not convert:
+            continue
+
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+        create_sql = cursor.fetchone()[0]
+        for column in convert:
+            create_sql = re.sub(rf'\b{column}\s+REAL\b', f'{column} INTEGER', create_sql)
+        create_sql = re.sub(rf'^CREATE TABLE\s+"?{table}"?', f'CREATE TABLE {table}_minor_units', create_sql)
+
+        # Indexes and the AUTOINCREMENT counter go with the old table, so keep them
+        cursor.execute('''
+            SELECT sql FROM sqlite_master
+            WHERE type IN ('index', 'trigger') AND tbl_name = ? AND sql IS NOT NULL
+        ''', (table,))
+        dependent_sql = [row[0] for row in cursor.fetchall()]
+        cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,))
+        sequence = cursor.fetchone()
+
+        column_list = ', '.join(table_columns)
+        select_list = ', '.join(
+            f'to_minor(t.{column}, {columns[column]})' if column in convert else f't.{column}'
+            for column in table_columns
+        )
+        cursor.execute(create_sql)
+        cursor.execute(f'INSERT INTO {table}_minor_units ({column_list}) SELECT {select_list} FROM {table} t')
+        cursor.execute(f'DROP TABLE {table}')
+        cursor.execute(f'ALTER TABLE {table}_minor_units RENAME TO {table}')
+
+        for sql in dependent_sql:
+            cursor.execute(sql)
+        if sequence:
+            cursor.execute('UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?', (sequence[0], table))
+
+    # Lines converted to base currency one at a time can leave an entry a penny out;
+    # put the difference on the entry's largest credit so every entry balances exactly
+    cursor.execute('''
+        SELECT entry_id, SUM(debit_base_currency) - SUM(credit_base_currency) as difference
+        FROM journal_entry_lines
+        GROUP BY entry_id
+        HAVING difference != 0
+    ''')
+    for entry_id, difference in cursor.fetchall():
+        cursor.execute('''
+            UPDATE journal_entry_lines SET credit_base_currency = credit_base_currency + ?
+            WHERE line_id = (
+                SELECT line_id FROM journal_entry_lines WHERE entry_id = ?
+                ORDER BY credit_base_currency DESC LIMIT 1
+            )
+        ''', (difference, entry_id))
+
+
+def add_journal_line_dates(cursor):
+    """Copy each journal entry's date onto its lines"""
+    cursor.execute('PRAGMA table_info(journal_entry_lines)')
+    if 'entry_date' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE journal_entry_lines ADD COLUMN entry_date TEXT')
+
+    cursor.execute('''
+        UPDATE journal_entry_lines SET entry_date = (
+            SELECT entry_date FROM journal_entries je WHERE je.entry_id = journal_entry_lines.entry_id
+        )
+        WHERE entry_date IS NULL
+    ''')
+
+
+def allocate_legacy_payments(cursor):
+    """
+    Record the payments made before payment allocations against their invoice or
+    bill, found from the description of the payment's receivable or payable line,
+    and work out each document's amount outstanding from them
+    """
+    for document_type, table, id_column, number_column, description in (
+            ('Invoice', 'sales_invoices', 'invoice_id', 'invoice_number', 'Payment from customer - '),
+            ('Bill', 'purchase_bills', 'bill_id', 'bill_number', 'Payment made - ')):
+        cursor.execute(f'''
+            INSERT INTO payment_allocations
+            (payment_id, document_type, document_id, amount, allocation_date, created_date)
+            SELECT p.payment_id, ?, d.{id_column}, p.amount, p.payment_date, p.created_date
+            FROM payments p
+            JOIN journal_entry_lines jel ON jel.entry_id = p.journal_entry_id
+            JOIN {table} d ON d.{number_column} = substr(jel.description, ?)
+            WHERE jel.description LIKE ? AND p.currency IS d.currency
+            ORDER BY p.payment_id
+        ''', (document_type, len(description) + 1, description + '%'))
+
+        # Paid documents were settled by a single payment; partly paid ones owe what is left
+        cursor.execute(f'''
+            UPDATE {table} SET amount_outstanding = CASE
+                WHEN status = 'Paid' THEN 0
+                ELSE MAX(total_amount - COALESCE((
+                    SELECT SUM(amount) FROM payment_allocations pa
+                    WHERE pa.document_type = ? AND pa.document_id = {table}.{id_column}
+                ), 0), 0)
+            END
+        ''', (document_type,))
+        cursor.execute(f'''
+            UPDATE {table} SET status = 'Paid'
+            WHERE amount_outstanding = 0 AND total_amount > 0 AND status = 'Partially Paid'
+        ''')
+
+
+# An Issue or Receipt row (leg) recorded with a Transfer row (t) for the same move:
+# same item, quantity, date and reference, written in the same statement or, before
+# transfers were one transaction, just before the Transfer row (Issue, Receipt, Transfer)
+TRANSFER_LEG_OF_TRANSFER = '''
+    leg.item_id = t.item_id AND leg.quantity = t.quantity
+    AND leg.transaction_date = t.transaction_date AND leg.reference IS t.reference
+    AND ((leg.transaction_type = 'Issue' AND leg.from_location_id = t.from_location_id
+          AND (leg.created_date = t.created_date OR leg.transaction_id = t.transaction_id - 2))
+      OR (leg.transaction_type = 'Receipt' AND leg.to_location_id = t.to_location_id
+          AND (leg.created_date = t.created_date OR leg.transaction_id = t.transaction_id - 1)))
+'''
+
+
+# Versioned schema migrations: (version, description, steps)
+# Each step is an SQL statement or a callable taking the cursor.
+SCHEMA_MIGRATIONS = [
+    (1, 'Ledger hot-path indexes', [
+        f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})'
+        for name, table, columns in LEDGER_INDEXES
+    ] + ['ANALYZE']),
+    (2, 'Daily account balance rollup', [
+        '''
+            CREATE TABLE IF NOT EXISTS account_period_balances (
+                account_id INTEGER NOT NULL,
+                balance_date TEXT NOT NULL,
+                debit_amount REAL DEFAULT 0,
+                credit_amount REAL DEFAULT 0,
+                cumulative_debit REAL DEFAULT 0,
+                cumulative_credit REAL DEFAULT 0,
+                PRIMARY KEY (account_id, balance_date),
+                FOREIGN KEY (account_id) REFERENCES chart_of_accounts(account_id)
+            )
+        ''',
+        rebuild_period_balances,
+    ]),
+    (3, 'Document number sequences', [
+        '''
+            CREATE TABLE IF NOT EXISTS document_sequences (
+                sequence_name TEXT PRIMARY KEY,
+                prefix TEXT NOT NULL,
+                next_value INTEGER NOT NULL DEFAULT 1
+            )
+        ''',
+        seed_document_sequences,
+    ]),
+    (4, 'Money amounts as integer minor units', [
+        convert_to_minor_units,
+        rebuild_period_balances,
+    ]),
+    (5, 'Ledger and stock movement paging indexes', [
+        add_journal_line_dates,
+    ] + [
+        f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})'
+        for name, table, columns in PAGING_INDEXES
+    ] + ['ANALYZE']),
+    (6, 'Dashboard metrics', [
+        '''
+            CREATE TABLE IF NOT EXISTS dashboard_metrics (
+                metric TEXT NOT NULL,
+                bucket TEXT NOT NULL DEFAULT '',
+                count INTEGER NOT NULL DEFAULT 0,
+                amount INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (metric, bucket)
+            )
+        ''',
+        # The counters are filled in by migration 10, once documents have amount_outstanding
+    ]),
+    (7, 'Stock state change counter', [
+        '''
+            CREATE TABLE IF NOT EXISTS stock_state_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL DEFAULT 0
+            )
+        ''',
+        'INSERT OR IGNORE INTO stock_state_version (id, version) VALUES (1, 0)',
+    ] + [
+        f'''
+            CREATE TRIGGER IF NOT EXISTS inventory_stock_{event.lower()}_version
+            AFTER {event} ON inventory_stock
+            BEGIN
+                UPDATE stock_state_version SET version = version + 1;
+            END
+        '''
+        for event in ('INSERT', 'UPDATE', 'DELETE')
+    ]),
+    (8, 'FIFO cost layers', [
+        "ALTER TABLE inventory_items ADD COLUMN costing_method TEXT NOT NULL DEFAULT 'WAC'",
+        '''
+            CREATE TABLE IF NOT EXISTS inventory_cost_layers (
+                item_id INTEGER NOT NULL,
+                location_id INTEGER NOT NULL,
+                layer_seq INTEGER NOT NULL,
+                quantity REAL NOT NULL,
+                unit_cost REAL NOT NULL,
+                PRIMARY KEY (item_id, location_id, layer_seq)
+            ) WITHOUT ROWID
+        ''',
+    ]),
+    (9, 'Stock snapshots', [
+        'ALTER TABLE inventory_transactions ADD COLUMN affects_stock INTEGER NOT NULL DEFAULT 1',
+        # Transfers used to be recorded as an Issue, a Receipt and a Transfer row for the same move
+        f'''
+            UPDATE inventory_transactions AS t SET affects_stock = 0
+            WHERE transaction_type = 'Transfer' AND EXISTS (
+                SELECT 1 FROM inventory_transactions leg WHERE {TRANSFER_LEG_OF_TRANSFER}
+            )
+        ''',
+        '''
+            CREATE TABLE IF NOT EXISTS inventory_snapshot_dates (
+                snapshot_date TEXT PRIMARY KEY,
+                created_date TEXT
+            )
+        ''',
+        '''
+            CREATE TABLE IF NOT EXISTS inventory_stock_snapshots (
+                snapshot_date TEXT NOT NULL,
+                item_id INTEGER NOT NULL,
+                location_id INTEGER NOT NULL,
+                quantity REAL NOT NULL,
+                total_value REAL NOT NULL,
+                PRIMARY KEY (snapshot_date, item_id, location_id)
+            ) WITHOUT ROWID
+        ''',
+    ]),
+    (10, 'Payment allocations', [
+        'ALTER TABLE sales_invoices ADD COLUMN amount_outstanding INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE purchase_bills ADD COLUMN amount_outstanding INTEGER NOT NULL DEFAULT 0',
+        '''
+            CREATE TABLE IF NOT EXISTS payment_allocations (
+                allocation_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payment_id INTEGER NOT NULL,
+                document_type TEXT NOT NULL,
+                document_id INTEGER NOT NULL,
+                amount INTEGER NOT NULL,
+                allocation_date TEXT NOT NULL,
+                created_date TEXT,
+                FOREIGN KEY (payment_id) REFERENCES payments(payment_id)
+            )
+        ''',
+        '''
+            CREATE INDEX IF NOT EXISTS idx_payment_allocations_document
+            ON payment_allocations (document_type, document_id)
+        ''',
+        '''
+            CREATE INDEX IF NOT EXISTS idx_payment_allocations_payment
+            ON payment_allocations (payment_id)
+        ''',
+        allocate_legacy_payments,
+        # Open items only, so statements read a party's open documents and not its history
+        '''
+            CREATE INDEX IF NOT EXISTS idx_sales_invoices_open
+            ON sales_invoices (customer_id, due_date) WHERE amount_outstanding > 0
+        ''',
+        '''
+            CREATE INDEX IF NOT EXISTS idx_purchase_bills_open
+            ON purchase_bills (supplier_id, due_date) WHERE amount_outstanding > 0
+        ''',
+        rebuild_dashboard_metrics,
+    ]),
+    (11, 'Ageing balances', [
+        '''
+            CREATE TABLE IF NOT EXISTS ageing_balances (
+                party_type TEXT NOT NULL,
+                party_id INTEGER NOT NULL,
+                due_date TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                amount INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (party_type, party_id, due_date)
+            ) WITHOUT ROWID
+        ''',
+        rebuild_ageing_balances,
+    ]),
+    (12, 'Dashboard totals from ageing balances', [
+        # Open documents are aged from ageing_balances, so the counters keep one total per metric
+        rebuild_dashboard_metrics,
+        '''
+            CREATE INDEX IF NOT EXISTS idx_ageing_balances_due
+            ON ageing_balances (party_type, due_date, count, amount)
+        ''',
+    ]),
+    (13, 'Master data change counter', [
+        '''
+            CREATE TABLE IF NOT EXISTS master_data_versions (
+                name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0
+            )
+        ''',
+    ] + [
+        f"INSERT OR IGNORE INTO master_data_versions (name, version) VALUES ('{name}', 0)"
+        for name in MASTER_TABLES
+    ] + [
+        f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_version
+            AFTER {event} ON {table}
+            BEGIN
+                UPDATE master_data_versions SET version = version + 1 WHERE name = '{name}';
+            END
+        '''
+        for name, (table, key_column) in MASTER_TABLES.items()
+        for event in ('INSERT', 'UPDATE', 'DELETE')
+    ]),
+    (14, 'Transfer movement flag', [
+        'ALTER TABLE inventory_transactions ADD COLUMN transfer_leg INTEGER NOT NULL DEFAULT 0',
+        # The Issue and Receipt rows of transfers recorded with their own movement rows
+        f'''
+            UPDATE inventory_transactions AS leg SET transfer_leg = 1
+            WHERE transaction_type IN ('Issue', 'Receipt') AND EXISTS (
+                SELECT 1 FROM inventory_transactions t
+                WHERE t.transaction_type = 'Transfer' AND t.affects_stock = 0 AND {TRANSFER_LEG_OF_TRANSFER}
+            )
+        ''',
+    ]),
+]
+
 
 class AccountingDatabase:
     def __init__(self, db_path="accounting_data.db"):
@@ -130,16 +511,19 @@ class AccountingDatabase:
         ''')
         
         # Journal Entry Lines (Detail)
+        # Amounts are integer minor units: entry currency, and GBP for the base columns
+        # entry_date repeats the entry's date so ledger pages can be read in index order
         self.cursor.execute('''
             CREATE TABLE IF NOT EXISTS journal_entry_lines (
                 line_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 entry_id INTEGER NOT NULL,
                 account_id INTEGER NOT NULL,
-                debit_amount REAL DEFAULT 0,
-                credit_amount REAL DEFAULT 0,
-                debit_base_currency REAL DEFAULT 0,
-                credit_base_currency REAL DEFAULT 0,
+                debit_amount INTEGER DEFAULT 0,
+                credit_amount INTEGER DEFAULT 0,
+                debit_base_currency INTEGER DEFAULT 0,
+                credit_base_currency INTEGER DEFAULT 0,
                 description TEXT,
+                entry_date TEXT,
                 FOREIGN KEY (entry_id) REFERENCES journal_entries(entry_id) ON DELETE CASCADE,
                 FOREIGN KEY (account_id) REFERENCES chart_of_accounts(account_id)
             )
@@ -215,9 +599,9 @@ class AccountingDatabase:
                 customer_id INTEGER NOT NULL,
                 currency TEXT DEFAULT 'GBP',
                 exchange_rate REAL DEFAULT 1.0,
-                subtotal REAL DEFAULT 0,
-                vat_amount REAL DEFAULT 0,
-                total_amount REAL DEFAULT 0,
+                subtotal INTEGER DEFAULT 0,
+                vat_amount INTEGER DEFAULT 0,
+                total_amount INTEGER DEFAULT 0,
                 status TEXT DEFAULT 'Unpaid',
                 due_date TEXT,
                 payment_terms TEXT,
@@ -239,7 +623,7 @@ class AccountingDatabase:
                 quantity REAL DEFAULT 0,
                 unit_price REAL DEFAULT 0,
                 vat_rate REAL DEFAULT 0,
-                line_total REAL DEFAULT 0,
+                line_total INTEGER DEFAULT 0,
                 location_id INTEGER,
                 FOREIGN KEY (invoice_id) REFERENCES sales_invoices(invoice_id) ON DELETE CASCADE,
                 FOREIGN KEY (item_id) REFERENCES inventory_items(item_id),
@@ -256,9 +640,9 @@ class AccountingDatabase:
                 supplier_id INTEGER NOT NULL,
                 currency TEXT DEFAULT 'GBP',
                 exchange_rate REAL DEFAULT 1.0,
-                subtotal REAL DEFAULT 0,
-                vat_amount REAL DEFAULT 0,
-                total_amount REAL DEFAULT 0,
+                subtotal INTEGER DEFAULT 0,
+                vat_amount INTEGER DEFAULT 0,
+                total_amount INTEGER DEFAULT 0,
                 status TEXT DEFAULT 'Unpaid',
                 due_date TEXT,
                 notes TEXT,
@@ -279,7 +663,7 @@ class AccountingDatabase:
                 quantity REAL DEFAULT 0,
                 unit_cost REAL DEFAULT 0,
                 vat_rate REAL DEFAULT 0,
-                line_total REAL DEFAULT 0,
+                line_total INTEGER DEFAULT 0,
                 location_id INTEGER,
                 FOREIGN KEY (bill_id) REFERENCES purchase_bills(bill_id) ON DELETE CASCADE,
                 FOREIGN KEY (item_id) REFERENCES inventory_items(item_id),
@@ -296,7 +680,7 @@ class AccountingDatabase:
                 payment_type TEXT NOT NULL,
                 party_type TEXT NOT NULL,
                 party_id INTEGER NOT NULL,
-                amount REAL NOT NULL,
+                amount INTEGER NOT NULL,
                 currency TEXT DEFAULT 'GBP',
                 exchange_rate REAL DEFAULT 1.0,
                 payment_method TEXT,
@@ -323,7 +707,51 @@ class AccountingDatabase:
         ''')
         
         self.conn.commit()
+        self.migrate()
         print("Database initialized successfully!")
+    
+    def get_schema_version(self):
+        """Get the schema version recorded in the database"""
+        self.cursor.execute('PRAGMA user_version')
+        return self.cursor.fetchone()[0]
+    
+    def migrate(self):
+        """Apply pending schema migrations to an existing database"""
+        if not self.conn:
+            self.connect()
+        
+        current_version = self.get_schema_version()
+        
+        # Tables are rebuilt by copying and dropping them, which must not cascade to
+        # the rows referring to them; the pragma has no effect inside a transaction
+        self.cursor.execute('PRAGMA foreign_keys = OFF')
+        
+        for version, description, steps in SCHEMA_MIGRATIONS:
+            if version <= current_version:
+                continue
+            
+            # Each migration runs in its own transaction together with the version bump
+            self.cursor.execute('BEGIN')
+            try:
+                for step in steps:
+                    if callable(step):
+                        step(self.cursor)
+                    else:
+                        self.cursor.execute(step)
+                # With the checks off, make sure every reference still resolves before committing
+                self.cursor.execute('PRAGMA foreign_key_check')
+                violation = self.cursor.fetchone()
+                if violation:
+                    raise sqlite3.IntegrityError(
+                        f"Migration {version} leaves {violation[0]} row {violation[1]} "
+                        f"referring to a missing {violation[2]} row")
+                self.cursor.execute(f'PRAGMA user_version = {version}')
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+            
+            print(f"Applied schema migration {version}: {description}")
         
     def insert_default_data(self):
         """Insert default chart of accounts and currencies"""
@@ -463,6 +891,7 @@ class AccountingDatabase:
             pass
         
         self.conn.commit()
+        invalidate_master_data(self.db_path)
         print("Default data inserted successfully!")
         self.close()
 
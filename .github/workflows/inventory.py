@@ -1,18 +1,91 @@
 import sqlite3
+from collections import namedtuple
 from datetime import datetime
+from connection_pool import ITER_BATCH_SIZE, get_connection, iter_batches
+from sequences import reserve_document_numbers
+from master_data import get_master_data, invalidate_master_data
+from costing import COSTING_METHODS, FIFO, WEIGHTED_AVERAGE, CostingBatch
+from session import Session
+from stock_state import get_stock_state
+from stock_snapshots import create_stock_snapshot, create_stock_snapshots, discard_snapshots_from, stock_as_of
+
+# Movement columns and order (newest first); transaction_id makes the order unique for keyset paging
+MOVEMENT_COLUMNS = '''
+    t.transaction_id,
+    t.transaction_number,
+    t.transaction_date,
+    t.transaction_type,
+    i.item_code,
+    i.item_name,
+    fl.location_name as from_location,
+    tl.location_name as to_location,
+    t.quantity,
+    t.unit_cost,
+    t.total_value,
+    t.reference,
+    t.description
+'''
+MOVEMENT_ORDER = 't.transaction_date DESC, t.transaction_id DESC'
+MOVEMENT_ORDER_REVERSED = 't.transaction_date, t.transaction_id'
+
+STOCK_BY_LOCATION_QUERY = '''
+    SELECT 
+        i.item_code,
+        i.item_name,
+        l.location_code,
+        l.location_name,
+        s.quantity,
+        s.weighted_avg_cost,
+        s.total_value,
+        i.unit_of_measure,
+        i.reorder_level
+    FROM inventory_stock s
+    JOIN inventory_items i ON s.item_id = i.item_id
+    JOIN inventory_locations l ON s.location_id = l.location_id
+'''
+
+STOCK_VALUATION_QUERY = '''
+    SELECT 
+        i.item_code,
+        i.item_name,
+        SUM(s.quantity) as total_quantity,
+        AVG(s.weighted_avg_cost) as avg_cost,
+        SUM(s.total_value) as total_value,
+        i.unit_of_measure
+    FROM inventory_stock s
+    JOIN inventory_items i ON s.item_id = i.item_id
+    WHERE s.quantity > 0
+    GROUP BY s.item_id
+    ORDER BY i.item_name
+'''
+
+# Rows yielded by the streaming iter_* reports, in the column order of the queries above
+StockRow = namedtuple('StockRow', 'item_code item_name location_code location_name quantity '
+                                  'weighted_avg_cost total_value unit_of_measure reorder_level')
+StockValuationRow = namedtuple('StockValuationRow', 'item_code item_name total_quantity avg_cost total_value unit_of_measure')
+MovementRow = namedtuple('MovementRow', 'transaction_id transaction_number transaction_date transaction_type '
+                                        'item_code item_name from_location to_location quantity unit_cost '
+                                        'total_value reference description')
+
 
 class InventoryManager:
     def __init__(self, db_path="accounting_data.db"):
         self.db_path = db_path
+        self.stock_state = get_stock_state(db_path)
+        self.master_data = get_master_data(db_path)
         
-    def connect(self):
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+    def connect(self, session=None):
+        if session is not None:
+            return session.scope()
+        return get_connection(self.db_path)
     
     def add_inventory_item(self, item_code, item_name, description, unit_of_measure, 
-                          reorder_level, inventory_account_id, cogs_account_id, sales_account_id):
+                          reorder_level, inventory_account_id, cogs_account_id, sales_account_id,
+                          costing_method=WEIGHTED_AVERAGE):
         """Add a new inventory item"""
+        if costing_method not in COSTING_METHODS:
+            return False, None, f"Unknown costing method: {costing_method}"
+        
         conn = self.connect()
         cursor = conn.cursor()
         
@@ -20,13 +93,14 @@ class InventoryManager:
             cursor.execute('''
                 INSERT INTO inventory_items 
                 (item_code, item_name, description, unit_of_measure, reorder_level,
-                 inventory_account_id, cogs_account_id, sales_account_id, created_date)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                 inventory_account_id, cogs_account_id, sales_account_id, costing_method, created_date)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', (item_code, item_name, description, unit_of_measure, reorder_level,
-                  inventory_account_id, cogs_account_id, sales_account_id, 
+                  inventory_account_id, cogs_account_id, sales_account_id, costing_method,
                   datetime.now().isoformat()))
             
             conn.commit()
+            invalidate_master_data(self.db_path, 'items')
             item_id = cursor.lastrowid
             return True, item_id, "Item added successfully"
         except sqlite3.IntegrityError:
@@ -34,6 +108,42 @@ class InventoryManager:
         finally:
             conn.close()
     
+    def set_costing_method(self, item_id, costing_method):
+        """
+        Change how an item's issues are costed. Stock held when an item becomes FIFO
+        becomes one cost layer per location at its weighted average cost.
+        """
+        if costing_method not in COSTING_METHODS:
+            return False, None, f"Unknown costing method: {costing_method}"
+        
+        conn = self.connect(Session(self.db_path))
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('DELETE FROM inventory_cost_layers WHERE item_id = ?', (item_id,))
+            
+            if costing_method == FIFO:
+                cursor.execute('''
+                    INSERT INTO inventory_cost_layers (item_id, location_id, layer_seq, quantity, unit_cost)
+                    SELECT item_id, location_id, 1, quantity, weighted_avg_cost
+                    FROM inventory_stock
+                    WHERE item_id = ? AND quantity > 0
+                ''', (item_id,))
+            
+            cursor.execute('UPDATE inventory_items SET costing_method = ? WHERE item_id = ?',
+                           (costing_method, item_id))
+            if cursor.rowcount == 0:
+                raise ValueError("Item not found")
+            
+            conn.commit()
+            invalidate_master_data(self.db_path, 'items')
+            return True, item_id, "Costing method updated successfully"
+        except Exception as e:
+            conn.rollback()
+            return False, None, str(e)
+        finally:
+            conn.close()
+    
     def add_location(self, location_code, location_name, address):
         """Add a new inventory location"""
         conn = self.connect()
@@ -47,6 +157,7 @@ class InventoryManager:
             ''', (location_code, location_name, address, datetime.now().isoformat()))
             
             conn.commit()
+            invalidate_master_data(self.db_path, 'locations')
             location_id = cursor.lastrowid
             return True, location_id, "Location added successfully"
         except sqlite3.IntegrityError:
@@ -54,28 +165,19 @@ class InventoryManager:
         finally:
             conn.close()
     
-    def calculate_weighted_average(self, item_id, location_id, new_quantity, new_cost):
+    def calculate_weighted_average(self, item_id, location_id, new_quantity, new_cost, session=None):
         """Calculate new weighted average cost after stock receipt"""
-        conn = self.connect()
-        cursor = conn.cursor()
-        
-        # Get current stock
-        cursor.execute('''
-            SELECT quantity, weighted_avg_cost, total_value 
-            FROM inventory_stock 
-            WHERE item_id = ? AND location_id = ?
-        ''', (item_id, location_id))
+        session = session or Session(self.db_path)
+        conn = self.connect(session)
         
-        stock = cursor.fetchone()
+        try:
+            # Get current stock
+            stock = self.stock_state.read(conn, [(item_id, location_id)])[(item_id, location_id)]
+            conn.commit()
+        finally:
+            conn.close()
         
-        if stock:
-            current_qty = stock['quantity']
-            current_avg_cost = stock['weighted_avg_cost']
-            current_value = stock['total_value']
-        else:
-            current_qty = 0
-            current_avg_cost = 0
-            current_value = 0
+        current_qty, current_avg_cost, current_value = stock or (0, 0, 0)
         
         # Calculate new weighted average
         new_value = new_quantity * new_cost
@@ -87,265 +189,448 @@ class InventoryManager:
         else:
             new_weighted_avg = 0
         
-        conn.close()
         return new_weighted_avg, total_qty, total_value
     
-    def stock_receipt(self, item_id, location_id, quantity, unit_cost, reference, description, journal_entry_id=None):
+    def stock_receipt(self, item_id, location_id, quantity, unit_cost, reference, description,
+                      journal_entry_id=None, session=None, transaction_date=None):
         """Record stock receipt (purchase) with weighted average calculation"""
-        conn = self.connect()
+        success, trans_numbers, msg = self.stock_receipts_batch(
+            [(item_id, location_id, quantity, unit_cost, reference, description, journal_entry_id)],
+            session, transaction_date
+        )
+        
+        if not success:
+            return False, None, msg
+        
+        return True, trans_numbers[0], msg
+    
+    def stock_receipts_batch(self, receipts, session=None, transaction_date=None):
+        """
+        Record many stock receipts in one pass, dated transaction_date (default today)
+        receipts = [(item_id, location_id, quantity, unit_cost, reference, description, journal_entry_id), ...]
+        Lines are grouped by item and location and the weighted average cost is
+        accumulated in memory, so each stock row is written once per batch.
+        """
+        session = session or Session(self.db_path)
+        conn = self.connect(session)
         cursor = conn.cursor()
         
         try:
-            # Calculate new weighted average
-            new_avg_cost, new_qty, new_value = self.calculate_weighted_average(
-                item_id, location_id, quantity, unit_cost
-            )
+            now = datetime.now().isoformat()
+            transaction_date = transaction_date or datetime.now().date().isoformat()
             
-            # Generate transaction number
-            cursor.execute('SELECT COUNT(*) as count FROM inventory_transactions')
-            count = cursor.fetchone()['count']
-            trans_number = f"STK-IN-{count + 1:06d}"
+            # Current stock of every item and location in the batch
+            stock = self.stock_state.read(conn, [(item_id, location_id) for item_id, location_id, *_ in receipts])
             
-            # Insert inventory transaction
-            cursor.execute('''
+            # Accumulate quantity and value per item and location in receipt order
+            costing = CostingBatch(cursor, self.master_data)
+            for item_id, location_id, quantity, unit_cost, *_ in receipts:
+                current = stock[(item_id, location_id)] = stock[(item_id, location_id)] or [0, 0, 0]
+                costing.receive((item_id, location_id), current, quantity, unit_cost)
+            costing.flush()
+            
+            # Allocate transaction numbers
+            trans_numbers = reserve_document_numbers(cursor, 'STK-IN', len(receipts))
+            
+            cursor.executemany('''
                 INSERT INTO inventory_transactions
                 (transaction_number, transaction_date, transaction_type, item_id,
                  to_location_id, quantity, unit_cost, total_value, reference, description,
                  journal_entry_id, created_date)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (trans_number, datetime.now().date().isoformat(), 'Receipt', item_id,
-                  location_id, quantity, unit_cost, quantity * unit_cost, reference,
-                  description, journal_entry_id, datetime.now().isoformat()))
-            
-            # Update or insert stock record
-            cursor.execute('''
-                SELECT stock_id FROM inventory_stock 
-                WHERE item_id = ? AND location_id = ?
-            ''', (item_id, location_id))
-            
-            existing = cursor.fetchone()
+            ''', [(trans_number, transaction_date, 'Receipt', item_id, location_id, quantity, unit_cost,
+                   quantity * unit_cost, reference, description, journal_entry_id, now)
+                  for trans_number, (item_id, location_id, quantity, unit_cost, reference, description,
+                                     journal_entry_id) in zip(trans_numbers, receipts)])
+            # Snapshots from the movement date on no longer hold if it is back-dated
+            discard_snapshots_from(cursor, transaction_date)
             
-            if existing:
-                cursor.execute('''
-                    UPDATE inventory_stock 
-                    SET quantity = ?, weighted_avg_cost = ?, total_value = ?, last_updated = ?
-                    WHERE item_id = ? AND location_id = ?
-                ''', (new_qty, new_avg_cost, new_value, datetime.now().isoformat(),
-                      item_id, location_id))
-            else:
-                cursor.execute('''
-                    INSERT INTO inventory_stock
-                    (item_id, location_id, quantity, weighted_avg_cost, total_value, last_updated)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (item_id, location_id, new_qty, new_avg_cost, new_value,
-                      datetime.now().isoformat()))
+            # Write each stock row once with its new weighted average
+            self.stock_state.write(conn, stock, now)
             
             conn.commit()
-            return True, trans_number, "Stock received successfully"
+            return True, trans_numbers, "Stock received successfully"
         except Exception as e:
             conn.rollback()
             return False, None, str(e)
         finally:
             conn.close()
     
-    def stock_issue(self, item_id, location_id, quantity, reference, description, journal_entry_id=None):
+    def stock_issue(self, item_id, location_id, quantity, reference, description,
+                    journal_entry_id=None, session=None, transaction_date=None):
         """Issue stock (sale/consumption) using weighted average cost"""
-        conn = self.connect()
+        success, results, msg = self.stock_issues_batch(
+            [(item_id, location_id, quantity, reference, description, journal_entry_id)], session,
+            transaction_date
+        )
+        
+        if not success:
+            return False, None, msg
+        
+        return results[0]  # Returns the unit cost for COGS posting
+    
+    def stock_issues_batch(self, issues, session=None, transaction_date=None):
+        """
+        Issue many lines of stock in one pass, at weighted average cost, dated
+        transaction_date (default today)
+        issues = [(item_id, location_id, quantity, reference, description, journal_entry_id), ...]
+        Lines are applied in order against the running stock, so each stock row is read
+        and written once per batch. Returns one (success, transaction_number, unit_cost
+        or message) per line, as stock_issue does; lines without enough stock are not issued.
+        """
+        session = session or Session(self.db_path)
+        conn = self.connect(session)
         cursor = conn.cursor()
         
         try:
-            # Get current stock
-            cursor.execute('''
-                SELECT quantity, weighted_avg_cost, total_value 
-                FROM inventory_stock 
-                WHERE item_id = ? AND location_id = ?
-            ''', (item_id, location_id))
-            
-            stock = cursor.fetchone()
-            
-            if not stock:
-                return False, None, "No stock available at this location"
-            
-            current_qty = stock['quantity']
-            current_avg_cost = stock['weighted_avg_cost']
-            current_value = stock['total_value']
+            now = datetime.now().isoformat()
+            transaction_date = transaction_date or datetime.now().date().isoformat()
             
-            if current_qty < quantity:
-                return False, None, f"Insufficient stock. Available: {current_qty}"
+            # Current stock of every item and location in the batch
+            stock = self.stock_state.read(conn, [(item_id, location_id) for item_id, location_id, *_ in issues])
             
-            # Calculate issue value at weighted average cost
-            issue_value = quantity * current_avg_cost
-            new_qty = current_qty - quantity
-            new_value = current_value - issue_value
+            # Issue each line against the running stock, at the cost of the item's costing method
+            costing = CostingBatch(cursor, self.master_data)
+            issued = []
+            results = []
+            for item_id, location_id, quantity, reference, description, journal_entry_id in issues:
+                current = stock[(item_id, location_id)]
+                if not current:
+                    results.append((False, None, "No stock available at this location"))
+                    continue
+                if current[0] < quantity:
+                    results.append((False, None, f"Insufficient stock. Available: {current[0]}"))
+                    continue
+                
+                issue_value = costing.issue((item_id, location_id), current, quantity)
+                unit_cost = issue_value / quantity if quantity else current[1]
+                issued.append((len(results), item_id, location_id, quantity, unit_cost, issue_value,
+                               reference, description, journal_entry_id))
+                results.append(None)
+            costing.flush()
             
-            # Generate transaction number
-            cursor.execute('SELECT COUNT(*) as count FROM inventory_transactions')
-            count = cursor.fetchone()['count']
-            trans_number = f"STK-OUT-{count + 1:06d}"
+            # Allocate transaction numbers for the lines issued
+            trans_numbers = reserve_document_numbers(cursor, 'STK-OUT', len(issued))
             
-            # Insert inventory transaction
-            cursor.execute('''
+            cursor.executemany('''
                 INSERT INTO inventory_transactions
                 (transaction_number, transaction_date, transaction_type, item_id,
                  from_location_id, quantity, unit_cost, total_value, reference, description,
                  journal_entry_id, created_date)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (trans_number, datetime.now().date().isoformat(), 'Issue', item_id,
-                  location_id, quantity, current_avg_cost, issue_value, reference,
-                  description, journal_entry_id, datetime.now().isoformat()))
+            ''', [(trans_number, transaction_date, 'Issue', item_id, location_id, quantity, unit_cost, issue_value,
+                   reference, description, journal_entry_id, now)
+                  for trans_number, (index, item_id, location_id, quantity, unit_cost, issue_value, reference,
+                                     description, journal_entry_id) in zip(trans_numbers, issued)])
+            # Snapshots from the movement date on no longer hold if it is back-dated
+            discard_snapshots_from(cursor, transaction_date)
             
-            # Update stock record
-            cursor.execute('''
-                UPDATE inventory_stock 
-                SET quantity = ?, total_value = ?, last_updated = ?
-                WHERE item_id = ? AND location_id = ?
-            ''', (new_qty, new_value, datetime.now().isoformat(), item_id, location_id))
+            for trans_number, (index, item_id, location_id, quantity, unit_cost, *_) in zip(trans_numbers, issued):
+                results[index] = (True, trans_number, unit_cost)
+            
+            # Write each stock row issued from once
+            self.stock_state.write(conn, {(issue[1], issue[2]): stock[(issue[1], issue[2])] for issue in issued}, now)
             
             conn.commit()
-            return True, trans_number, current_avg_cost  # Return cost for COGS posting
+            return True, results, "Stock issued successfully"
         except Exception as e:
             conn.rollback()
             return False, None, str(e)
         finally:
             conn.close()
     
-    def stock_transfer(self, item_id, from_location_id, to_location_id, quantity, reference, description):
+    def stock_transfer(self, item_id, from_location_id, to_location_id, quantity, reference, description,
+                       session=None, movement_rows=False, transaction_date=None):
         """Transfer stock between locations at weighted average cost"""
-        conn = self.connect()
+        success, trans_numbers, msg = self.stock_transfer_document(
+            [(item_id, from_location_id, to_location_id, quantity)], reference, description,
+            session, movement_rows, transaction_date
+        )
+        
+        if not success:
+            return False, None, msg
+        
+        return True, trans_numbers[0], msg
+    
+    def stock_transfer_document(self, lines, reference, description, session=None, movement_rows=False,
+                                transaction_date=None):
+        """
+        Transfer several lines of stock in one transaction
+        lines = [(item_id, from_location_id, to_location_id, quantity), ...]
+        Each line moves stock at the source's weighted average cost, applied in order
+        against the running stock, and is recorded as one Transfer movement. With
+        movement_rows the Issue and Receipt movements of each line are recorded as well.
+        The document posts whole or not at all, dated transaction_date (default today).
+        Returns the Transfer transaction numbers.
+        """
+        session = session or Session(self.db_path)
+        conn = self.connect(session)
         cursor = conn.cursor()
         
         try:
-            # Get stock from source location
-            cursor.execute('''
-                SELECT quantity, weighted_avg_cost 
-                FROM inventory_stock 
-                WHERE item_id = ? AND location_id = ?
-            ''', (item_id, from_location_id))
-            
-            from_stock = cursor.fetchone()
-            
-            if not from_stock:
-                return False, None, "No stock at source location"
-            
-            if from_stock['quantity'] < quantity:
-                return False, None, f"Insufficient stock. Available: {from_stock['quantity']}"
-            
-            transfer_cost = from_stock['weighted_avg_cost']
+            now = datetime.now().isoformat()
+            transaction_date = transaction_date or datetime.now().date().isoformat()
             
-            # Issue from source location
-            success, trans_out, cost = self.stock_issue(
-                item_id, from_location_id, quantity, reference, 
-                f"Transfer Out - {description}", None
-            )
+            # Current stock at every source and destination in the document
+            keys = [key for item_id, from_location_id, to_location_id, quantity in lines
+                    for key in ((item_id, from_location_id), (item_id, to_location_id))]
+            stock = self.stock_state.read(conn, keys)
             
-            if not success:
-                return False, None, cost  # cost contains error message
+            # Move each line against the running stock, at the source cost
+            costing = CostingBatch(cursor, self.master_data)
+            unit_costs = []
+            for number, (item_id, from_location_id, to_location_id, quantity) in enumerate(lines, 1):
+                if from_location_id == to_location_id:
+                    raise ValueError(f"Line {number}: source and destination locations are the same")
+                if quantity <= 0:
+                    raise ValueError(f"Line {number}: quantity must be positive")
+                
+                source = stock[(item_id, from_location_id)]
+                if not source:
+                    raise ValueError(f"Line {number}: no stock at source location")
+                if source[0] < quantity:
+                    raise ValueError(f"Line {number}: insufficient stock. Available: {source[0]}")
+                
+                destination = stock[(item_id, to_location_id)] = stock[(item_id, to_location_id)] or [0, 0, 0]
+                value = costing.transfer((item_id, from_location_id), source, (item_id, to_location_id),
+                                         destination, quantity)
+                unit_costs.append(value / quantity)
+            costing.flush()
             
-            # Receive at destination location
-            success, trans_in, msg = self.stock_receipt(
-                item_id, to_location_id, quantity, transfer_cost, reference,
-                f"Transfer In - {description}", None
-            )
+            # Allocate transaction numbers
+            trans_numbers = reserve_document_numbers(cursor, 'STK-TRF', len(lines))
+            # With its own Issue and Receipt rows, flagged as transfer legs, the Transfer
+            # row only records the transfer
+            movements = [(trans_numbers, 'Transfer', True, True, description, 0 if movement_rows else 1, 0)]
+            if movement_rows:
+                movements += [(reserve_document_numbers(cursor, 'STK-OUT', len(lines)), 'Issue', True, False,
+                               f"Transfer Out - {description}", 1, 1),
+                              (reserve_document_numbers(cursor, 'STK-IN', len(lines)), 'Receipt', False, True,
+                               f"Transfer In - {description}", 1, 1)]
             
-            if not success:
-                return False, None, msg
+            rows = []
+            for (numbers, transaction_type, from_side, to_side, row_description, affects_stock,
+                 transfer_leg) in movements:
+                for trans_number, (item_id, from_location_id, to_location_id, quantity), unit_cost in zip(
+                        numbers, lines, unit_costs):
+                    rows.append((trans_number, transaction_date, transaction_type, item_id,
+                                 from_location_id if from_side else None, to_location_id if to_side else None,
+                                 quantity, unit_cost, quantity * unit_cost, reference, row_description,
+                                 affects_stock, transfer_leg, now))
             
-            # Generate transfer transaction number
-            cursor.execute('SELECT COUNT(*) as count FROM inventory_transactions WHERE transaction_type = "Transfer"')
-            count = cursor.fetchone()['count']
-            trans_number = f"STK-TRF-{count + 1:06d}"
-            
-            # Record transfer transaction
-            cursor.execute('''
+            cursor.executemany('''
                 INSERT INTO inventory_transactions
                 (transaction_number, transaction_date, transaction_type, item_id,
                  from_location_id, to_location_id, quantity, unit_cost, total_value, 
-                 reference, description, created_date)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (trans_number, datetime.now().date().isoformat(), 'Transfer', item_id,
-                  from_location_id, to_location_id, quantity, transfer_cost, 
-                  quantity * transfer_cost, reference, description, datetime.now().isoformat()))
+                 reference, description, affects_stock, transfer_leg, created_date)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            # Snapshots from the movement date on no longer hold if it is back-dated
+            discard_snapshots_from(cursor, transaction_date)
+            
+            # Write each stock row moved once
+            self.stock_state.write(conn, {key: stock[key] for key in keys}, now)
             
             conn.commit()
-            return True, trans_number, "Stock transferred successfully"
+            return True, trans_numbers, "Stock transferred successfully"
         except Exception as e:
             conn.rollback()
             return False, None, str(e)
         finally:
             conn.close()
     
-    def get_stock_by_location(self, item_id=None):
-        """Get current stock levels by location"""
+    def stock_transfers_bulk(self, documents, chunk_size=200, session=None, movement_rows=False):
+        """
+        Post many transfer documents, e.g. from a warehouse rebalancing job
+        documents = iterable of dicts with the stock_transfer_document arguments:
+            {'lines', 'reference', 'description', 'transaction_date' (optional)}
+        Documents post in chunked transactions, each inside its own savepoint, so a
+        document that fails does not stop the rest. Returns one (success,
+        transaction_numbers, message) per document in input order.
+        """
+        documents = list(documents)
+        results = []
+        
+        for start in range(0, len(documents), chunk_size):
+            chunk_session = session or Session(self.db_path)
+            conn = self.connect(chunk_session)
+            
+            try:
+                for document in documents[start:start + chunk_size]:
+                    results.append(self.stock_transfer_document(
+                        document['lines'], document.get('reference'), document.get('description'),
+                        chunk_session, movement_rows, document.get('transaction_date')
+                    ))
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                del results[start:]
+                results += [(False, None, str(e))] * len(documents[start:start + chunk_size])
+            finally:
+                conn.close()
+        
+        return results
+    
+    def get_stock_by_location(self, item_id=None, as_of=None):
+        """Get stock levels by location, currently or at the end of the as_of date"""
         conn = self.connect()
         cursor = conn.cursor()
         
-        if item_id:
-            cursor.execute('''
-                SELECT 
-                    i.item_code,
-                    i.item_name,
-                    l.location_code,
-                    l.location_name,
-                    s.quantity,
-                    s.weighted_avg_cost,
-                    s.total_value,
-                    i.unit_of_measure,
-                    i.reorder_level
-                FROM inventory_stock s
-                JOIN inventory_items i ON s.item_id = i.item_id
-                JOIN inventory_locations l ON s.location_id = l.location_id
-                WHERE s.item_id = ?
-                ORDER BY l.location_name
-            ''', (item_id,))
-        else:
-            cursor.execute('''
-                SELECT 
-                    i.item_code,
-                    i.item_name,
-                    l.location_code,
-                    l.location_name,
-                    s.quantity,
-                    s.weighted_avg_cost,
-                    s.total_value,
-                    i.unit_of_measure,
-                    i.reorder_level
-                FROM inventory_stock s
-                JOIN inventory_items i ON s.item_id = i.item_id
-                JOIN inventory_locations l ON s.location_id = l.location_id
-                WHERE s.quantity > 0
-                ORDER BY i.item_name, l.location_name
-            ''')
+        if as_of:
+            results = self._stock_as_of_rows(cursor, as_of, item_id)
+            conn.close()
+            
+            if item_id:
+                results.sort(key=lambda row: row['location_name'])
+            else:
+                results = [row for row in results if row['quantity'] > 0]
+                results.sort(key=lambda row: (row['item_name'], row['location_name']))
+            return results
         
+        cursor.execute(*self._stock_by_location_query(item_id))
         results = cursor.fetchall()
         conn.close()
         
         return [dict(row) for row in results]
     
-    def get_stock_valuation(self):
-        """Get total stock valuation by item"""
+    def iter_stock_by_location(self, item_id=None, batch_size=ITER_BATCH_SIZE):
+        """Stream current stock levels by location as StockRow tuples, batch_size rows at a time"""
         conn = self.connect()
-        cursor = conn.cursor()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(*self._stock_by_location_query(item_id))
+            yield from iter_batches(cursor, StockRow, batch_size)
+        finally:
+            conn.close()
+    
+    def _stock_by_location_query(self, item_id):
+        if item_id:
+            return STOCK_BY_LOCATION_QUERY + '''
+                WHERE s.item_id = ?
+                ORDER BY l.location_name
+            ''', (item_id,)
         
-        cursor.execute('''
-            SELECT 
-                i.item_code,
-                i.item_name,
-                SUM(s.quantity) as total_quantity,
-                AVG(s.weighted_avg_cost) as avg_cost,
-                SUM(s.total_value) as total_value,
-                i.unit_of_measure
-            FROM inventory_stock s
-            JOIN inventory_items i ON s.item_id = i.item_id
+        return STOCK_BY_LOCATION_QUERY + '''
             WHERE s.quantity > 0
-            GROUP BY s.item_id
-            ORDER BY i.item_name
-        ''')
+            ORDER BY i.item_name, l.location_name
+        ''', ()
+    
+    def get_stock_valuation(self, as_of=None):
+        """Get total stock valuation by item, currently or at the end of the as_of date"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        if as_of:
+            rows = self._stock_as_of_rows(cursor, as_of)
+            conn.close()
+            
+            # Same columns as STOCK_VALUATION_QUERY
+            items = {}
+            for row in rows:
+                if row['quantity'] <= 0:
+                    continue
+                item = items.setdefault(row['item_code'], {
+                    'item_code': row['item_code'], 'item_name': row['item_name'], 'total_quantity': 0,
+                    'avg_cost': [], 'total_value': 0, 'unit_of_measure': row['unit_of_measure']
+                })
+                item['total_quantity'] += row['quantity']
+                item['avg_cost'].append(row['weighted_avg_cost'])
+                item['total_value'] += row['total_value']
+            
+            for item in items.values():
+                item['avg_cost'] = sum(item['avg_cost']) / len(item['avg_cost'])
+            return sorted(items.values(), key=lambda item: item['item_name'])
+        
+        cursor.execute(STOCK_VALUATION_QUERY)
         
         results = cursor.fetchall()
         conn.close()
         
         return [dict(row) for row in results]
     
+    def _stock_as_of_rows(self, cursor, as_of, item_id=None):
+        """Stock rows at the end of as_of as dicts with the columns of STOCK_BY_LOCATION_QUERY"""
+        rows = []
+        for (stock_item_id, location_id), (quantity, value) in stock_as_of(cursor, as_of).items():
+            if item_id and stock_item_id != item_id:
+                continue
+            item = self.master_data.get(cursor, 'items', stock_item_id)
+            location = self.master_data.get(cursor, 'locations', location_id)
+            if not item or not location:
+                continue
+            rows.append({
+                'item_code': item['item_code'],
+                'item_name': item['item_name'],
+                'location_code': location['location_code'],
+                'location_name': location['location_name'],
+                'quantity': quantity,
+                'weighted_avg_cost': value / quantity if quantity else 0,
+                'total_value': value,
+                'unit_of_measure': item['unit_of_measure'],
+                'reorder_level': item['reorder_level'],
+            })
+        return rows
+    
+    def create_stock_snapshots(self, every_movements=None):
+        """
+        Take the stock snapshots that as-of reports start from: one for every month
+        end since the last snapshot, and with every_movements one at the end of each
+        day on which that many movements have built up. Returns the dates taken.
+        """
+        conn = self.connect(Session(self.db_path))
+        cursor = conn.cursor()
+        
+        try:
+            snapshot_dates = create_stock_snapshots(cursor, every_movements)
+            conn.commit()
+            return True, snapshot_dates, f"{len(snapshot_dates)} stock snapshot(s) taken"
+        except Exception as e:
+            conn.rollback()
+            return False, None, str(e)
+        finally:
+            conn.close()
+    
+    def create_stock_snapshot(self, snapshot_date):
+        """Take (or retake) the stock snapshot at the end of one date"""
+        conn = self.connect(Session(self.db_path))
+        cursor = conn.cursor()
+        
+        try:
+            create_stock_snapshot(cursor, snapshot_date)
+            conn.commit()
+            return True, snapshot_date, "Stock snapshot taken"
+        except Exception as e:
+            conn.rollback()
+            return False, None, str(e)
+        finally:
+            conn.close()
+    
+    def delete_stock_snapshots(self, date_from=None):
+        """Delete stock snapshots, from date_from onwards or all, e.g. after back-dated imports"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('DELETE FROM inventory_stock_snapshots WHERE snapshot_date >= ?', (date_from or '',))
+            cursor.execute('DELETE FROM inventory_snapshot_dates WHERE snapshot_date >= ?', (date_from or '',))
+            conn.commit()
+            return True, None, "Stock snapshots deleted"
+        except Exception as e:
+            conn.rollback()
+            return False, None, str(e)
+        finally:
+            conn.close()
+    
+    def iter_stock_valuation(self, batch_size=ITER_BATCH_SIZE):
+        """Stream the stock valuation by item as StockValuationRow tuples, batch_size rows at a time"""
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(STOCK_VALUATION_QUERY)
+            yield from iter_batches(cursor, StockValuationRow, batch_size)
+        finally:
+            conn.close()
+    
     def get_reorder_alerts(self):
         """Get items below reorder level"""
         conn = self.connect()
@@ -376,20 +661,104 @@ class InventoryManager:
         conn = self.connect()
         cursor = conn.cursor()
         
-        query = '''
-            SELECT 
-                t.transaction_number,
-                t.transaction_date,
-                t.transaction_type,
-                i.item_code,
-                i.item_name,
-                fl.location_name as from_location,
-                tl.location_name as to_location,
-                t.quantity,
-                t.unit_cost,
-                t.total_value,
-                t.reference,
-                t.description
+        query, params = self._movements_query(MOVEMENT_COLUMNS, item_id, location_id, date_from, date_to)
+        query += f' ORDER BY {MOVEMENT_ORDER}'
+        
+        cursor.execute(query, params)
+        results = cursor.fetchall()
+        conn.close()
+        
+        return [dict(row) for row in results]
+    
+    def iter_inventory_movements(self, item_id=None, location_id=None, date_from=None, date_to=None,
+                                 batch_size=ITER_BATCH_SIZE):
+        """Stream inventory movement history as MovementRow tuples, batch_size rows at a time"""
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            query, params = self._movements_query(MOVEMENT_COLUMNS, item_id, location_id, date_from, date_to)
+            cursor.execute(query + f' ORDER BY {MOVEMENT_ORDER}', params)
+            yield from iter_batches(cursor, MovementRow, batch_size)
+        finally:
+            conn.close()
+    
+    def get_inventory_movements_page(self, item_id=None, location_id=None, date_from=None, date_to=None,
+                                     after=None, limit=200):
+        """
+        Get one page of inventory movement history, newest first
+        Pages are keyset-paginated: pass the cursor returned with a page as after=
+        to get the next one. Returns (movements, next_cursor); next_cursor is None
+        after the last page.
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        query, params = self._movements_query(MOVEMENT_COLUMNS, item_id, location_id,
+                                              date_from, date_to, after=after)
+        query += f' ORDER BY {MOVEMENT_ORDER} LIMIT ?'
+        params.append(limit)
+        
+        cursor.execute(query, params)
+        movements = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        
+        next_cursor = None
+        if len(movements) == limit:
+            last = movements[-1]
+            next_cursor = (last['transaction_date'], last['transaction_id'])
+        
+        return movements, next_cursor
+    
+    def get_inventory_movements_cursor(self, offset, item_id=None, location_id=None, date_from=None, date_to=None,
+                                       checkpoint=None):
+        """
+        Get the cursor for a movements page starting at row offset, or None for the first row.
+        checkpoint = (checkpoint_offset, cursor) is a cursor already known: rows are
+        counted from it, forwards or backwards, instead of from the first row.
+        """
+        if offset <= 0:
+            return None
+        
+        start_offset, start = checkpoint if checkpoint and checkpoint[1] else (0, None)
+        if offset == start_offset:
+            return start
+        
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        # Key of the last row before the offset, counted from the checkpoint row
+        if offset > start_offset:
+            query, params = self._movements_query('t.transaction_date, t.transaction_id', item_id, location_id,
+                                                  date_from, date_to, after=start)
+            query += f' ORDER BY {MOVEMENT_ORDER} LIMIT 1 OFFSET ?'
+            params.append(offset - start_offset - 1)
+        else:
+            query, params = self._movements_query('t.transaction_date, t.transaction_id', item_id, location_id,
+                                                  date_from, date_to, through=start)
+            query += f' ORDER BY {MOVEMENT_ORDER_REVERSED} LIMIT 1 OFFSET ?'
+            params.append(start_offset - offset)
+        cursor.execute(query, params)
+        key = cursor.fetchone()
+        conn.close()
+        
+        return (key['transaction_date'], key['transaction_id']) if key else None
+    
+    def count_inventory_movements(self, item_id=None, location_id=None, date_from=None, date_to=None):
+        """Count inventory movements, e.g. to size a scrollbar"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        query, params = self._movements_query('COUNT(*)', item_id, location_id, date_from, date_to)
+        cursor.execute(query, params)
+        count = cursor.fetchone()[0]
+        
+        conn.close()
+        return count
+    
+    def _movements_query(self, columns, item_id, location_id, date_from, date_to, after=None, through=None):
+        """Build the inventory movements query, optionally after or up to a row key"""
+        query = f'''
+            SELECT {columns}
             FROM inventory_transactions t
             JOIN inventory_items i ON t.item_id = i.item_id
             LEFT JOIN inventory_locations fl ON t.from_location_id = fl.location_id
@@ -415,10 +784,12 @@ class InventoryManager:
             query += ' AND t.transaction_date <= ?'
             params.append(date_to)
         
-        query += ' ORDER BY t.transaction_date DESC, t.transaction_number DESC'
+        if after:
+            query += ' AND (t.transaction_date, t.transaction_id) < (?, ?)'
+            params.extend(after[:2])
         
-        cursor.execute(query, params)
-        results = cursor.fetchall()
-        conn.close()
+        if through:
+            query += ' AND (t.transaction_date, t.transaction_id) >= (?, ?)'
+            params.extend(through[:2])
         
-        return [dict(row) for row in results]
+        return query, params
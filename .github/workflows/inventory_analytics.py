@@ -0,0 +1,215 @@
+from datetime import date, timedelta
+from itertools import chain
+from connection_pool import get_connection
+from master_data import get_master_data
+from stock_snapshots import stock_as_of
+
+try:
+    import numpy
+except ImportError:  # NumPy is optional, only the analytics need it
+    numpy = None
+
+# Demand is what is issued to customers and production; the Issue rows recorded
+# with a transfer (movement_rows=True, flagged transfer_leg) move stock between
+# locations instead
+DEMAND_QUERY = '''
+    SELECT item_id, from_location_id, SUM(quantity), SUM(total_value)
+    FROM inventory_transactions
+    WHERE transaction_type = 'Issue' AND from_location_id IS NOT NULL
+      AND transaction_date > ? AND transaction_date <= ? AND transfer_leg = 0
+    GROUP BY item_id, from_location_id, transaction_date
+'''
+
+# Cumulative share of demand value up to which items are class A, then B; the rest are C
+ABC_LIMITS = (0.8, 0.95)
+ABC_CLASSES = numpy.array(['A', 'B', 'C']) if numpy is not None else None
+
+# Normal quantiles for the cycle service levels offered for safety stock
+SERVICE_LEVEL_Z = {0.5: 0.0, 0.8: 0.8416, 0.9: 1.2816, 0.95: 1.6449, 0.98: 2.0537, 0.99: 2.3263}
+
+
+def fetch_array(cursor, columns):
+    """The rows of an executed query as a float array, without building a list of them"""
+    return numpy.fromiter(chain.from_iterable(cursor), dtype=float).reshape(-1, columns)
+
+
+def pack_keys(item_ids, location_ids):
+    return (numpy.asarray(item_ids, dtype=numpy.int64) << 32) | numpy.asarray(location_ids, dtype=numpy.int64)
+
+
+def abc_classes(values, groups=None):
+    """
+    ABC class of each value by its share of the total: classes are assigned in
+    descending value order until the cumulative share passes ABC_LIMITS. With
+    groups, values are ranked within each group (e.g. per location).
+    """
+    values = numpy.asarray(values, dtype=float)
+    if groups is None:
+        groups = numpy.zeros(len(values), dtype=numpy.int64)
+
+    # Sort by group, then value descending, and accumulate within each group
+    order = numpy.lexsort((-values, groups))
+    sorted_values = values[order]
+    sorted_groups = groups[order]
+    cumulative = numpy.cumsum(sorted_values)
+    group_number = numpy.cumsum(numpy.r_[0, numpy.diff(sorted_groups) != 0])
+    group_starts = numpy.r_[0, numpy.flatnonzero(numpy.diff(sorted_groups)) + 1]
+    group_offsets = (cumulative[group_starts] - sorted_values[group_starts])[group_number]
+    group_totals = numpy.bincount(group_number, weights=sorted_values)[group_number]
+
+    # A row's class is set by the share of value before it, so the largest row is always A
+    share_before = numpy.divide(cumulative - sorted_values - group_offsets, group_totals,
+                                out=numpy.ones(len(values)), where=group_totals > 0)
+    classes = numpy.empty(len(values), dtype='<U1')
+    classes[order] = ABC_CLASSES[numpy.searchsorted(ABC_LIMITS, share_before, side='right')]
+    return classes
+
+
+class InventoryAnalysis:
+    """
+    Result of InventoryAnalytics.analyze(): one entry per (item, location) in
+    parallel NumPy arrays, and one per item of items in the item_* arrays, where
+    item_index maps each (item, location) entry to its item.
+    """
+    def __init__(self, **arrays):
+        self.__dict__.update(arrays)
+
+    def __len__(self):
+        return len(self.item_ids)
+
+
+class InventoryAnalytics:
+    """
+    Stock analytics over the movement history, worked out on NumPy arrays: ABC
+    class, turnover, days of cover, moving-average demand and reorder points for
+    every item and location. Movements are read with one aggregated query and
+    everything after that is vectorized, so the work does not grow with a Python
+    loop per item.
+    """
+    def __init__(self, db_path="accounting_data.db"):
+        if numpy is None:
+            raise ImportError("NumPy is not installed")
+        self.db_path = db_path
+        self.master_data = get_master_data(db_path)
+
+    def connect(self):
+        return get_connection(self.db_path)
+
+    def analyze(self, as_of=None, days=90, lead_time_days=14, service_level=0.95):
+        """
+        Analyze the demand of the days up to as_of (default today) against the stock
+        at the end of as_of. Demand is the stock issued, excluding transfers.
+            avg_daily_demand  moving average of daily demand over the window
+            days_of_cover     stock / avg_daily_demand (inf without demand)
+            turnover          annualised cost of demand / stock value
+            abc_class         class by demand value within the location
+            item_abc_class    class by demand value of the item across locations
+            reorder_point     demand over the lead time plus safety stock for the
+                              service level, from the daily demand's variation
+        """
+        as_of = as_of or date.today().isoformat()
+        window_start = (date.fromisoformat(as_of) - timedelta(days=days)).isoformat()
+        z = SERVICE_LEVEL_Z[service_level]
+
+        conn = self.connect()
+        cursor = conn.cursor()
+        try:
+            stock_ids, stock_quantity, stock_value = self._stock_columns(cursor, as_of)
+            cursor.execute(DEMAND_QUERY, (window_start, as_of))
+            demand = fetch_array(cursor, 4)
+        finally:
+            conn.close()
+
+        # One dense index over every (item, location) with stock or demand, from keys
+        # packed as item_id << 32 | location_id so that they sort as plain integers
+        demand_ids = pack_keys(demand[:, 0], demand[:, 1])
+        packed, inverse = numpy.unique(numpy.concatenate([stock_ids, demand_ids]), return_inverse=True)
+        stock_index, demand_index = inverse[:len(stock_ids)], inverse[len(stock_ids):]
+        keys = numpy.column_stack([packed >> 32, packed & 0xFFFFFFFF])
+        count = len(keys)
+
+        quantity = numpy.bincount(stock_index, weights=stock_quantity, minlength=count)
+        value = numpy.bincount(stock_index, weights=stock_value, minlength=count)
+        demand_quantity = numpy.bincount(demand_index, weights=demand[:, 2], minlength=count)
+        demand_squares = numpy.bincount(demand_index, weights=demand[:, 2] ** 2, minlength=count)
+        demand_value = numpy.bincount(demand_index, weights=demand[:, 3], minlength=count)
+
+        # Daily demand over the window, counting days without issues as zero
+        avg_daily_demand = demand_quantity / days
+        daily_std = numpy.sqrt(numpy.maximum(demand_squares / days - avg_daily_demand ** 2, 0))
+
+        days_of_cover = numpy.divide(quantity, avg_daily_demand, out=numpy.full(count, numpy.inf),
+                                     where=avg_daily_demand > 0)
+        days_of_cover[(quantity <= 0) & (avg_daily_demand > 0)] = 0
+        turnover = numpy.divide(demand_value * (365 / days), value, out=numpy.zeros(count), where=value > 0)
+        reorder_point = avg_daily_demand * lead_time_days + z * daily_std * numpy.sqrt(lead_time_days)
+
+        items, item_index = numpy.unique(keys[:, 0], return_inverse=True)
+        item_index = item_index.reshape(-1)
+        item_demand_value = numpy.bincount(item_index, weights=demand_value, minlength=len(items))
+
+        return InventoryAnalysis(
+            as_of=as_of,
+            days=days,
+            item_ids=keys[:, 0],
+            location_ids=keys[:, 1],
+            item_index=item_index,
+            quantity=quantity,
+            value=value,
+            demand_quantity=demand_quantity,
+            demand_value=demand_value,
+            avg_daily_demand=avg_daily_demand,
+            daily_demand_std=daily_std,
+            days_of_cover=days_of_cover,
+            turnover=turnover,
+            abc_class=abc_classes(demand_value, keys[:, 1]),
+            reorder_point=reorder_point,
+            reorder_needed=(avg_daily_demand > 0) & (quantity <= reorder_point),
+            item_abc_class=abc_classes(item_demand_value),
+            item_demand_value=item_demand_value,
+            items=items,
+            item_quantity=numpy.bincount(item_index, weights=quantity, minlength=len(items)),
+            item_value=numpy.bincount(item_index, weights=value, minlength=len(items)),
+        )
+
+    def get_reorder_suggestions(self, as_of=None, days=90, lead_time_days=14, service_level=0.95):
+        """Stock at or below its forecast reorder point, lowest days of cover first"""
+        analysis = self.analyze(as_of, days, lead_time_days, service_level)
+        rows = self.rows(analysis, analysis.reorder_needed)
+        return sorted(rows, key=lambda row: (row['days_of_cover'], row['item_name'] or ''))
+
+    def rows(self, analysis, mask=None):
+        """(item, location) entries of an analysis as dicts, optionally only where mask is set"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        try:
+            rows = []
+            for i in (numpy.flatnonzero(mask) if mask is not None else range(len(analysis))):
+                item = self.master_data.get(cursor, 'items', int(analysis.item_ids[i])) or {}
+                location = self.master_data.get(cursor, 'locations', int(analysis.location_ids[i])) or {}
+                rows.append({
+                    'item_code': item.get('item_code'),
+                    'item_name': item.get('item_name'),
+                    'location_name': location.get('location_name'),
+                    'quantity': float(analysis.quantity[i]),
+                    'total_value': float(analysis.value[i]),
+                    'avg_daily_demand': float(analysis.avg_daily_demand[i]),
+                    'days_of_cover': float(analysis.days_of_cover[i]),
+                    'turnover': float(analysis.turnover[i]),
+                    'abc_class': str(analysis.abc_class[i]),
+                    'item_abc_class': str(analysis.item_abc_class[analysis.item_index[i]]),
+                    'reorder_point': float(analysis.reorder_point[i]),
+                })
+            return rows
+        finally:
+            conn.close()
+
+    def _stock_columns(self, cursor, as_of):
+        """Stock at the end of as_of as (packed keys, quantity, value) arrays"""
+        if as_of >= date.today().isoformat():
+            cursor.execute('SELECT item_id, location_id, quantity, total_value FROM inventory_stock')
+            stock = fetch_array(cursor, 4)
+        else:
+            stock = numpy.array([(*key, *amounts) for key, amounts in stock_as_of(cursor, as_of).items()],
+                                dtype=float).reshape(-1, 4)
+        return pack_keys(stock[:, 0], stock[:, 1]), stock[:, 2], stock[:, 3]
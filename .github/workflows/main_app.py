@@ -2,14 +2,23 @@ import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 from datetime import datetime, date
 import sqlite3
+from database import AccountingDatabase
+from connection_pool import get_connection
 from accounting import AccountingManager
 from inventory import InventoryManager
 from transactions import SalesManager, PurchaseManager
+from report_executor import ReportExecutor
+from virtual_grid import VirtualGrid
+from dashboard_metrics import DashboardMetrics
+from ageing import AGEING_BUCKETS
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 from reportlab.lib.units import inch
 import os
 
+# How often the open dashboard re-reads its metric counters
+DASHBOARD_REFRESH_MS = 5000
+
 class AccountingSoftware:
     def __init__(self, root):
         self.root = root
@@ -18,6 +27,12 @@ class AccountingSoftware:
         
         # Database connection
         self.db_path = "accounting_data.db"
+        
+        # Create missing tables and apply pending schema migrations
+        database = AccountingDatabase(self.db_path)
+        database.initialize_database()
+        database.close()
+        
         self.accounting = AccountingManager(self.db_path)
         self.inventory = InventoryManager(self.db_path)
         self.sales = SalesManager(self.db_path)
@@ -26,6 +41,21 @@ class AccountingSoftware:
         # Create main menu
         self.create_menu()
         
+        # Status bar with progress of reports running in the background
+        status_frame = ttk.Frame(root)
+        status_frame.pack(side=tk.BOTTOM, fill=tk.X, padx=10, pady=(0, 5))
+        self.status_label = ttk.Label(status_frame, text="Ready")
+        self.status_label.pack(side=tk.LEFT)
+        # Errors get their own label, shown until dismissed, so report progress does not overwrite them
+        self.error_label = ttk.Label(status_frame, foreground="red")
+        self.error_dismiss = ttk.Button(status_frame, text="×", width=2, command=self.clear_status_error)
+        self.progress_bar = ttk.Progressbar(status_frame, mode='indeterminate', length=150)
+        self.progress_bar.pack(side=tk.RIGHT)
+        
+        self.reports = ReportExecutor(root, on_busy=self.show_report_progress)
+        self.dashboard_refresh = None
+        self.root.protocol("WM_DELETE_WINDOW", self.exit_application)
+        
         # Create main container
         self.main_container = ttk.Frame(root)
         self.main_container.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
@@ -43,7 +73,7 @@ class AccountingSoftware:
         file_menu.add_command(label="Company Settings", command=self.show_company_settings)
         file_menu.add_separator()
         file_menu.add_command(label="Backup Database", command=self.backup_database)
-        file_menu.add_command(label="Exit", command=self.root.quit)
+        file_menu.add_command(label="Exit", command=self.exit_application)
         
         # Transactions Menu
         trans_menu = tk.Menu(menubar, tearoff=0)
@@ -88,9 +118,40 @@ class AccountingSoftware:
         masters_menu.add_command(label="Currencies", command=self.show_currencies)
     
     def clear_main_container(self):
+        # Reports requested by the old screen would draw into destroyed widgets
+        self.reports.cancel_all()
+        if self.dashboard_refresh:
+            self.root.after_cancel(self.dashboard_refresh)
+            self.dashboard_refresh = None
         for widget in self.main_container.winfo_children():
             widget.destroy()
     
+    def show_report_progress(self, running):
+        """Show which background reports are still running"""
+        if running:
+            self.status_label.config(text=f"Running: {', '.join(running)}...")
+            self.progress_bar.start(10)
+        else:
+            self.status_label.config(text="Ready")
+            self.progress_bar.stop()
+    
+    def show_report_error(self, error):
+        messagebox.showerror("Error", f"Report failed: {error}")
+    
+    def show_status_error(self, message):
+        """Show an error in the status bar, for failures that should not interrupt with a dialog"""
+        self.error_label.config(text=message)
+        self.error_label.pack(side=tk.LEFT, padx=(20, 0))
+        self.error_dismiss.pack(side=tk.LEFT, padx=5)
+    
+    def clear_status_error(self):
+        self.error_label.pack_forget()
+        self.error_dismiss.pack_forget()
+    
+    def exit_application(self):
+        self.reports.shutdown()
+        self.root.quit()
+    
     def show_dashboard(self):
         self.clear_main_container()
         
@@ -105,27 +166,45 @@ class AccountingSoftware:
         stats_frame = ttk.LabelFrame(panels_frame, text="Quick Statistics", padding=20)
         stats_frame.grid(row=0, column=0, columnspan=2, sticky="ew", padx=10, pady=10)
         
-        # Get some quick stats
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT COUNT(*) FROM sales_invoices WHERE status = "Unpaid"')
-        unpaid_invoices = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM purchase_bills WHERE status = "Unpaid"')
-        unpaid_bills = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT SUM(total_value) FROM inventory_stock')
-        stock_value = cursor.fetchone()[0] or 0
+        # Quick stats are filled in when the background query finishes
+        stat_labels = {}
+        for column, (name, text) in enumerate((('open_invoices', "Open Invoices"), ('unpaid_bills', "Unpaid Bills"),
+                                               ('stock_value', "Stock Value"), ('cash_balance', "Cash Balance"))):
+            stat_labels[name] = ttk.Label(stats_frame, text=f"{text}: ...", font=("Arial", 12))
+            stat_labels[name].grid(row=0, column=column, padx=20, pady=5)
+        
+        ageing_tree = ttk.Treeview(stats_frame, columns=('Age', 'Receivables', 'Payables'),
+                                   show='headings', height=len(AGEING_BUCKETS))
+        for col in ('Age', 'Receivables', 'Payables'):
+            ageing_tree.heading(col, text=col)
+            ageing_tree.column(col, width=180, anchor=tk.E if col != 'Age' else tk.W)
+        ageing_tree.grid(row=1, column=0, columnspan=4, pady=(10, 0))
+        
+        def show_stats(stats):
+            stat_labels['open_invoices'].config(
+                text=f"Open Invoices: {stats['open_invoices']} (£{stats['open_invoices_amount']:,.2f})")
+            stat_labels['unpaid_bills'].config(
+                text=f"Unpaid Bills: {stats['unpaid_bills']} (£{stats['unpaid_bills_amount']:,.2f})")
+            stat_labels['stock_value'].config(text=f"Stock Value: £{stats['stock_value']:,.2f}")
+            stat_labels['cash_balance'].config(text=f"Cash Balance: £{stats['cash_balance']:,.2f}")
+            
+            ageing_tree.delete(*ageing_tree.get_children())
+            for receivable, payable in zip(stats['receivables_ageing'], stats['payables_ageing']):
+                ageing_tree.insert('', 'end', values=(
+                    receivable['bucket'],
+                    f"{receivable['count']} / £{receivable['amount']:,.2f}",
+                    f"{payable['count']} / £{payable['amount']:,.2f}"
+                ))
+            
+            # The counters are a single small read, so keep them current while the dashboard is open
+            self.dashboard_refresh = self.root.after(DASHBOARD_REFRESH_MS, refresh)
         
-        conn.close()
+        def refresh():
+            self.dashboard_refresh = None
+            self.reports.submit('dashboard', self.get_dashboard_stats, on_done=show_stats,
+                                on_error=self.show_report_error, description="Dashboard")
         
-        ttk.Label(stats_frame, text=f"Unpaid Invoices: {unpaid_invoices}", 
-                 font=("Arial", 12)).grid(row=0, column=0, padx=20, pady=5)
-        ttk.Label(stats_frame, text=f"Unpaid Bills: {unpaid_bills}", 
-                 font=("Arial", 12)).grid(row=0, column=1, padx=20, pady=5)
-        ttk.Label(stats_frame, text=f"Stock Value: £{stock_value:,.2f}", 
-                 font=("Arial", 12)).grid(row=0, column=2, padx=20, pady=5)
+        refresh()
         
         # Quick Actions
         actions_frame = ttk.LabelFrame(panels_frame, text="Quick Actions", padding=20)
@@ -156,6 +235,10 @@ class AccountingSoftware:
         panels_frame.columnconfigure(0, weight=1)
         panels_frame.columnconfigure(1, weight=1)
     
+    def get_dashboard_stats(self):
+        """Get the dashboard quick statistics from the metric counters (runs on a report worker thread)"""
+        return DashboardMetrics(self.db_path).get_dashboard_stats()
+    
     def show_chart_of_accounts(self):
         self.clear_main_container()
         
@@ -188,38 +271,30 @@ class AccountingSoftware:
         tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         
-        # Load accounts
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT account_id, account_code, account_name, account_type, parent_account_id
-            FROM chart_of_accounts WHERE is_active = 1
-            ORDER BY account_code
-        ''')
-        
-        accounts = cursor.fetchall()
-        conn.close()
-        
-        # Build tree structure
-        account_nodes = {}
-        
-        for acc in accounts:
-            balance = self.accounting.get_account_balance(acc['account_id'])
-            balance_str = f"{balance:,.2f}" if balance else "0.00"
+        def show_accounts(accounts):
+            # Build tree structure, parents showing subtotals of their children
+            account_nodes = {}
             
-            if acc['parent_account_id'] is None:
-                node = tree.insert('', 'end', text='',
-                                  values=(acc['account_code'], acc['account_name'], 
-                                         acc['account_type'], balance_str))
-                account_nodes[acc['account_id']] = node
-            else:
-                parent_node = account_nodes.get(acc['parent_account_id'], '')
-                node = tree.insert(parent_node, 'end', text='',
-                                  values=(acc['account_code'], acc['account_name'],
-                                         acc['account_type'], balance_str))
-                account_nodes[acc['account_id']] = node
+            for acc in accounts:
+                balance = acc['total_balance']
+                balance_str = f"{balance:,.2f}" if balance else "0.00"
+            
+                if acc['parent_account_id'] is None:
+                    node = tree.insert('', 'end', text='',
+                                      values=(acc['account_code'], acc['account_name'], 
+                                             acc['account_type'], balance_str))
+                    account_nodes[acc['account_id']] = node
+                else:
+                    parent_node = account_nodes.get(acc['parent_account_id'], '')
+                    node = tree.insert(parent_node, 'end', text='',
+                                      values=(acc['account_code'], acc['account_name'],
+                                             acc['account_type'], balance_str))
+                    account_nodes[acc['account_id']] = node
+        
+        # Load accounts with their balances in the background
+        self.reports.submit('chart_of_accounts', self.accounting.get_all_account_balances,
+                            on_done=show_accounts, on_error=self.show_report_error,
+                            description="Chart of Accounts")
     
     def show_journal_entry(self):
         self.clear_main_container()
@@ -266,8 +341,7 @@ class AccountingSoftware:
         line_entry_frame.pack(fill=tk.X, pady=10)
         
         # Get accounts for dropdown
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
+        conn = get_connection(self.db_path)
         cursor = conn.cursor()
         cursor.execute('SELECT account_id, account_code, account_name FROM chart_of_accounts WHERE is_active = 1 ORDER BY account_code')
         accounts = cursor.fetchall()
@@ -393,7 +467,12 @@ class AccountingSoftware:
         date_entry.pack(side=tk.LEFT, padx=5)
         
         def generate_report():
-            trial_balance, total_dr, total_cr = self.accounting.get_trial_balance(date_entry.get())
+            # Run in the background; regenerating cancels a request still running
+            self.reports.submit('trial_balance', self.accounting.get_trial_balance, date_entry.get(),
+                                on_done=show_report, on_error=self.show_report_error)
+        
+        def show_report(result):
+            trial_balance, total_dr, total_cr = result
             
             # Clear tree
             for item in tree.get_children():
@@ -462,8 +541,13 @@ class AccountingSoftware:
         to_entry.pack(side=tk.LEFT, padx=5)
         
         def generate_report():
-            pl = self.accounting.get_profit_and_loss(from_entry.get(), to_entry.get())
-            
+            # Run in the background; regenerating cancels a request still running
+            self.reports.submit('profit_loss', self.accounting.get_profit_and_loss,
+                                from_entry.get(), to_entry.get(),
+                                on_done=show_report, on_error=self.show_report_error,
+                                description="Profit & Loss")
+        
+        def show_report(pl):
             # Clear tree
             for item in tree.get_children():
                 tree.delete(item)
@@ -548,8 +632,11 @@ class AccountingSoftware:
         date_entry.pack(side=tk.LEFT, padx=5)
         
         def generate_report():
-            bs = self.accounting.get_balance_sheet(date_entry.get())
-            
+            # Run in the background; regenerating cancels a request still running
+            self.reports.submit('balance_sheet', self.accounting.get_balance_sheet, date_entry.get(),
+                                on_done=show_report, on_error=self.show_report_error)
+        
+        def show_report(bs):
             # Clear tree
             for item in tree.get_children():
                 tree.delete(item)
@@ -652,10 +739,189 @@ class AccountingSoftware:
         messagebox.showinfo("Info", "Stock Valuation - Coming Soon")
     
     def show_general_ledger(self):
-        messagebox.showinfo("Info", "General Ledger - Coming Soon")
+        self.clear_main_container()
+        
+        title = ttk.Label(self.main_container, text="General Ledger", font=("Arial", 18, "bold"))
+        title.pack(pady=10)
+        
+        # Account and date selection
+        filter_frame = ttk.Frame(self.main_container)
+        filter_frame.pack(fill=tk.X, padx=20, pady=5)
+        
+        conn = get_connection(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('SELECT account_id, account_code, account_name FROM chart_of_accounts WHERE is_active = 1 ORDER BY account_code')
+        accounts = cursor.fetchall()
+        conn.close()
+        
+        account_map = {f"{acc['account_code']} - {acc['account_name']}": acc['account_id'] for acc in accounts}
+        
+        ttk.Label(filter_frame, text="Account:").pack(side=tk.LEFT, padx=5)
+        account_combo = ttk.Combobox(filter_frame, values=list(account_map), width=35, state='readonly')
+        account_combo.pack(side=tk.LEFT, padx=5)
+        
+        ttk.Label(filter_frame, text="From:").pack(side=tk.LEFT, padx=5)
+        from_entry = ttk.Entry(filter_frame, width=15)
+        from_entry.insert(0, "2025-01-01")
+        from_entry.pack(side=tk.LEFT, padx=5)
+        
+        ttk.Label(filter_frame, text="To:").pack(side=tk.LEFT, padx=5)
+        to_entry = ttk.Entry(filter_frame, width=15)
+        to_entry.insert(0, date.today().isoformat())
+        to_entry.pack(side=tk.LEFT, padx=5)
+        
+        # Filters are read when Load is pressed, so pages always match the count
+        selection = {}
+        
+        def load_ledger():
+            if account_combo.get() not in account_map:
+                messagebox.showerror("Error", "Please select an account")
+                return
+            selection['account_id'] = account_map[account_combo.get()]
+            selection['date_from'] = from_entry.get() or None
+            selection['date_to'] = to_entry.get() or None
+            grid.load()
+        
+        def fetch_page(after, limit):
+            return self.accounting.get_general_ledger_page(
+                selection['account_id'], selection['date_from'], selection['date_to'], after, limit)
+        
+        def seek(offset, checkpoint):
+            return self.accounting.get_general_ledger_cursor(
+                selection['account_id'], offset, selection['date_from'], selection['date_to'], checkpoint)
+        
+        def count():
+            return self.accounting.count_general_ledger(
+                selection['account_id'], selection['date_from'], selection['date_to'])
+        
+        def row_values(trans):
+            return (
+                trans['entry_date'],
+                trans['entry_number'],
+                trans['reference'] or '',
+                trans['description'] or '',
+                f"{trans['debit_amount']:,.2f}" if trans['debit_amount'] else "",
+                f"{trans['credit_amount']:,.2f}" if trans['credit_amount'] else "",
+                f"{trans['balance']:,.2f}"
+            )
+        
+        ttk.Button(filter_frame, text="Load", command=load_ledger).pack(side=tk.LEFT, padx=5)
+        
+        # Only the visible rows are ever inserted into the grid
+        columns = ('Date', 'Entry No', 'Reference', 'Description', 'Debit', 'Credit', 'Balance')
+        grid = VirtualGrid(self.main_container, columns, self.reports, 'general_ledger',
+                           fetch_page, seek, count, row_values, on_error=self.show_status_error)
+        grid.pack(fill=tk.BOTH, expand=True, padx=20, pady=10)
+        
+        grid.column('Date', width=100)
+        grid.column('Entry No', width=120)
+        grid.column('Reference', width=150)
+        grid.column('Description', width=400)
+        grid.column('Debit', width=120)
+        grid.column('Credit', width=120)
+        grid.column('Balance', width=130)
     
     def show_inventory_movements(self):
-        messagebox.showinfo("Info", "Inventory Movements - Coming Soon")
+        self.clear_main_container()
+        
+        title = ttk.Label(self.main_container, text="Inventory Movements", font=("Arial", 18, "bold"))
+        title.pack(pady=10)
+        
+        # Item, location and date selection
+        filter_frame = ttk.Frame(self.main_container)
+        filter_frame.pack(fill=tk.X, padx=20, pady=5)
+        
+        conn = get_connection(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('SELECT item_id, item_code, item_name FROM inventory_items WHERE is_active = 1 ORDER BY item_code')
+        items = cursor.fetchall()
+        cursor.execute('SELECT location_id, location_code, location_name FROM inventory_locations WHERE is_active = 1 ORDER BY location_code')
+        locations = cursor.fetchall()
+        conn.close()
+        
+        item_map = {"All Items": None}
+        item_map.update({f"{item['item_code']} - {item['item_name']}": item['item_id'] for item in items})
+        location_map = {"All Locations": None}
+        location_map.update({f"{loc['location_code']} - {loc['location_name']}": loc['location_id'] for loc in locations})
+        
+        ttk.Label(filter_frame, text="Item:").pack(side=tk.LEFT, padx=5)
+        item_combo = ttk.Combobox(filter_frame, values=list(item_map), width=30, state='readonly')
+        item_combo.current(0)
+        item_combo.pack(side=tk.LEFT, padx=5)
+        
+        ttk.Label(filter_frame, text="Location:").pack(side=tk.LEFT, padx=5)
+        location_combo = ttk.Combobox(filter_frame, values=list(location_map), width=25, state='readonly')
+        location_combo.current(0)
+        location_combo.pack(side=tk.LEFT, padx=5)
+        
+        ttk.Label(filter_frame, text="From:").pack(side=tk.LEFT, padx=5)
+        from_entry = ttk.Entry(filter_frame, width=15)
+        from_entry.pack(side=tk.LEFT, padx=5)
+        
+        ttk.Label(filter_frame, text="To:").pack(side=tk.LEFT, padx=5)
+        to_entry = ttk.Entry(filter_frame, width=15)
+        to_entry.insert(0, date.today().isoformat())
+        to_entry.pack(side=tk.LEFT, padx=5)
+        
+        # Filters are read when Load is pressed, so pages always match the count
+        selection = {}
+        
+        def load_movements():
+            selection['item_id'] = item_map[item_combo.get()]
+            selection['location_id'] = location_map[location_combo.get()]
+            selection['date_from'] = from_entry.get() or None
+            selection['date_to'] = to_entry.get() or None
+            grid.load()
+        
+        def fetch_page(after, limit):
+            return self.inventory.get_inventory_movements_page(
+                selection['item_id'], selection['location_id'], selection['date_from'], selection['date_to'],
+                after, limit)
+        
+        def seek(offset, checkpoint):
+            return self.inventory.get_inventory_movements_cursor(
+                offset, selection['item_id'], selection['location_id'], selection['date_from'], selection['date_to'],
+                checkpoint)
+        
+        def count():
+            return self.inventory.count_inventory_movements(
+                selection['item_id'], selection['location_id'], selection['date_from'], selection['date_to'])
+        
+        def row_values(move):
+            return (
+                move['transaction_date'],
+                move['transaction_number'],
+                move['transaction_type'],
+                f"{move['item_code']} - {move['item_name']}",
+                move['from_location'] or '',
+                move['to_location'] or '',
+                f"{move['quantity']:,.2f}",
+                f"{move['unit_cost']:,.2f}" if move['unit_cost'] is not None else "",
+                f"{move['total_value']:,.2f}" if move['total_value'] is not None else "",
+                move['reference'] or ''
+            )
+        
+        ttk.Button(filter_frame, text="Load", command=load_movements).pack(side=tk.LEFT, padx=5)
+        
+        # Only the visible rows are ever inserted into the grid
+        columns = ('Date', 'Number', 'Type', 'Item', 'From', 'To', 'Quantity', 'Unit Cost', 'Value', 'Reference')
+        grid = VirtualGrid(self.main_container, columns, self.reports, 'inventory_movements',
+                           fetch_page, seek, count, row_values, on_error=self.show_status_error)
+        grid.pack(fill=tk.BOTH, expand=True, padx=20, pady=10)
+        
+        grid.column('Date', width=100)
+        grid.column('Number', width=110)
+        grid.column('Type', width=90)
+        grid.column('Item', width=250)
+        grid.column('From', width=130)
+        grid.column('To', width=130)
+        grid.column('Quantity', width=90)
+        grid.column('Unit Cost', width=90)
+        grid.column('Value', width=110)
+        grid.column('Reference', width=130)
+        
+        # Auto-load on open
+        load_movements()
     
     def show_customers(self):
         messagebox.showinfo("Info", "Customers - Coming Soon")
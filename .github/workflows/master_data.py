@@ -0,0 +1,181 @@
+import threading
+import weakref
+from session import on_begin
+
+# Cached master tables: name -> (table, key column)
+MASTER_TABLES = {
+    'accounts': ('chart_of_accounts', 'account_id'),
+    'customers': ('customers', 'customer_id'),
+    'suppliers': ('suppliers', 'supplier_id'),
+    'items': ('inventory_items', 'item_id'),
+    'locations': ('inventory_locations', 'location_id'),
+    'vat_rates': ('vat_rates', 'vat_id'),
+    'currencies': ('currencies', 'currency_code'),
+}
+
+
+class MasterDataCache:
+    """
+    Process-wide copy of the master tables of one database, so that postings look
+    up accounts, customers, suppliers, items, locations, VAT rates and currencies
+    without querying them.
+
+    Each table is read whole on its first lookup, through the caller's cursor so
+    that it sees the caller's transaction. Code that changes a master table calls
+    invalidate(), which bumps the table's version and drops the copy; a load that
+    was running while the version changed is not kept. A key missing from the copy
+    reloads the table once, which picks up rows added by other processes.
+
+    Triggers on the master tables count every change to them in master_data_versions.
+    The counts are read once when a Session begins its transaction, or once per
+    cursor for lookups made outside a session, and copies read at a different
+    count, changed directly in the database or by another process, are dropped
+    and read again.
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.tables = {}                                # name -> {key: row dict}
+        self.account_codes = {}                         # account_code -> account_id
+        self.versions = dict.fromkeys(MASTER_TABLES, 0)
+        self.persisted = {}                             # name -> master_data_versions count of the copy
+        self.local = threading.local()                  # session or cursor the counts were last read in
+        self.hits = dict.fromkeys(MASTER_TABLES, 0)
+        self.misses = dict.fromkeys(MASTER_TABLES, 0)
+        on_begin(db_path, self._session_begun)
+
+    def get(self, cursor, name, key):
+        """Get a master row as a dict, or None if it does not exist"""
+        self.check(cursor)
+        rows = self.tables.get(name)
+        if rows is not None and key in rows:
+            with self.lock:
+                self.hits[name] += 1
+            return rows[key]
+
+        with self.lock:
+            self.misses[name] += 1
+        return self._load(cursor, name).get(key)
+
+    def rows(self, cursor, name):
+        """All rows of a master table, in key order"""
+        self.check(cursor)
+        rows = self.tables.get(name)
+        if rows is not None:
+            with self.lock:
+                self.hits[name] += 1
+        else:
+            with self.lock:
+                self.misses[name] += 1
+            rows = self._load(cursor, name)
+        return [rows[key] for key in sorted(rows)]
+
+    def account_id(self, cursor, account_code):
+        """Get the account_id for an account code, or None"""
+        self.check(cursor)
+        account_id = self.account_codes.get(account_code) if 'accounts' in self.tables else None
+        if account_id is not None:
+            with self.lock:
+                self.hits['accounts'] += 1
+            return account_id
+
+        with self.lock:
+            self.misses['accounts'] += 1
+        rows = self._load(cursor, 'accounts')
+        return next((account_id for account_id, row in rows.items() if row['account_code'] == account_code), None)
+
+    def account_ids(self, cursor, account_codes):
+        """Get {account_code: account_id} for several codes, raising if any is missing"""
+        accounts = {code: self.account_id(cursor, code) for code in account_codes}
+        missing = [code for code, account_id in accounts.items() if account_id is None]
+        if missing:
+            raise Exception(f"Account(s) not found: {', '.join(missing)}")
+        return accounts
+
+    def invalidate(self, *names):
+        """Drop the cached copies of the named tables (all tables if none are named)"""
+        with self.lock:
+            for name in names or MASTER_TABLES:
+                self._drop(name)
+
+    def stats(self):
+        """Hit and miss counters, versions and cached row counts per table"""
+        with self.lock:
+            return {name: {'hits': self.hits[name], 'misses': self.misses[name],
+                           'version': self.versions[name], 'rows': len(self.tables.get(name) or ())}
+                    for name in MASTER_TABLES}
+
+    def _drop(self, name):
+        # Called with the lock held
+        self.versions[name] += 1
+        self.tables.pop(name, None)
+        if name == 'accounts':
+            self.account_codes = {}
+
+    def check(self, cursor):
+        """
+        Drop copies of tables changed in the database since they were read, unless
+        the counts were already read in the cursor's session transaction or through it
+        """
+        session = self.local.session() if getattr(self.local, 'session', None) else None
+        if session is not None and session.depth and session.conn is cursor.connection:
+            return
+        checked = getattr(self.local, 'cursor', None)
+        if checked is not None and checked() is cursor:
+            return
+
+        self._refresh(cursor)
+        self.local.cursor = weakref.ref(cursor)
+
+    def _session_begun(self, session):
+        self._refresh(session.conn.cursor())
+        self.local.session = weakref.ref(session)
+
+    def _refresh(self, cursor):
+        cursor.execute('SELECT name, version FROM master_data_versions')
+        counts = {row[0]: row[1] for row in cursor.fetchall()}
+        with self.lock:
+            for name in MASTER_TABLES:
+                if name in self.tables and self.persisted.get(name) != counts.get(name, 0):
+                    self._drop(name)
+
+    def _load(self, cursor, name):
+        table, key_column = MASTER_TABLES[name]
+        version = self.versions[name]
+
+        cursor.execute('SELECT version FROM master_data_versions WHERE name = ?', (name,))
+        row = cursor.fetchone()
+        persisted = row[0] if row else 0
+        cursor.execute(f'SELECT * FROM {table}')
+        columns = [column[0] for column in cursor.description]
+        rows = {}
+        for row in cursor.fetchall():
+            row = dict(zip(columns, row))
+            rows[row[key_column]] = row
+
+        with self.lock:
+            # Keep the copy unless the masters changed while it was being read
+            if self.versions[name] == version:
+                self.tables[name] = rows
+                self.persisted[name] = persisted
+                if name == 'accounts':
+                    self.account_codes = {row['account_code']: account_id for account_id, row in rows.items()}
+        return rows
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_master_data(db_path):
+    """Get the process-wide master data cache for a database file"""
+    with _caches_lock:
+        cache = _caches.get(db_path)
+        if cache is None:
+            cache = _caches[db_path] = MasterDataCache(db_path)
+        return cache
+
+
+def invalidate_master_data(db_path, *names):
+    """Tell the cache that master tables changed (all tables if none are named)"""
+    get_master_data(db_path).invalidate(*names)
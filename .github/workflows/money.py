@@ -0,0 +1,163 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+# Base currency of the ledger; *_base_currency columns are held in its minor units
+BASE_CURRENCY = 'GBP'
+
+# Decimal places of each currency's minor unit (pence, cents, fils, ...)
+CURRENCY_MINOR_UNITS = {
+    'GBP': 2,
+    'USD': 2,
+    'EUR': 2,
+    'AED': 2,
+    'JPY': 0,
+    'KWD': 3,
+}
+DEFAULT_MINOR_UNITS = 2
+
+
+def minor_unit_exponent(currency=BASE_CURRENCY):
+    """Number of decimal places of a currency's minor unit"""
+    return CURRENCY_MINOR_UNITS.get(currency or BASE_CURRENCY, DEFAULT_MINOR_UNITS)
+
+
+def to_minor(amount, currency=BASE_CURRENCY):
+    """
+    Convert a major-unit amount (e.g. 12.34 pounds) to integer minor units (1234 pence),
+    rounding half away from zero. Money values are returned as their minor units
+    and None (a NULL column) is passed through.
+    """
+    if amount is None:
+        return None
+
+    if isinstance(amount, Money):
+        if amount.currency != (currency or BASE_CURRENCY):
+            raise ValueError(f"Cannot use {amount.currency} amount as {currency}")
+        return amount.minor
+
+    # str() gives the shortest repr of a float, so 1.005 converts as written
+    exponent = minor_unit_exponent(currency)
+    value = Decimal(str(amount)).scaleb(exponent)
+    return int(value.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_minor(minor, currency=BASE_CURRENCY):
+    """Convert integer minor units back to a major-unit float for display and reports"""
+    if not minor:
+        return 0.0
+    return minor / 10 ** minor_unit_exponent(currency)
+
+
+def allocate_residual(amounts, target):
+    """
+    Adjust a list of integer minor-unit amounts so that they add up to target,
+    putting the rounding difference on the largest amount.
+    """
+    difference = target - sum(amounts)
+    if difference and amounts:
+        largest = max(range(len(amounts)), key=lambda i: amounts[i])
+        amounts[largest] += difference
+    return amounts
+
+
+class Money:
+    """
+    Exact amount of one currency, held as an integer number of minor units.
+    Adding or subtracting amounts of different currencies raises ValueError.
+    """
+    __slots__ = ('minor', 'currency')
+
+    def __init__(self, minor=0, currency=BASE_CURRENCY):
+        if not isinstance(minor, int):
+            raise TypeError("Money is created from integer minor units, use Money.of() for amounts")
+        self.minor = minor
+        self.currency = currency or BASE_CURRENCY
+
+    @classmethod
+    def of(cls, amount, currency=BASE_CURRENCY):
+        """Create Money from a major-unit amount, e.g. Money.of('12.34', 'USD')"""
+        return cls(to_minor(amount, currency), currency)
+
+    @property
+    def amount(self):
+        """Exact major-unit amount as a Decimal"""
+        return Decimal(self.minor).scaleb(-minor_unit_exponent(self.currency))
+
+    def convert(self, exchange_rate, currency=BASE_CURRENCY):
+        """Convert to another currency at an exchange rate, rounding to its minor unit"""
+        return Money(to_minor(self.amount * Decimal(str(exchange_rate)), currency), currency)
+
+    def _check(self, other):
+        if not isinstance(other, Money):
+            return NotImplemented
+        if other.currency != self.currency:
+            raise ValueError(f"Currency mismatch: {self.currency} and {other.currency}")
+        return other
+
+    def __add__(self, other):
+        if isinstance(other, int) and other == 0:
+            return self  # Allows sum() over Money values
+        other = self._check(other)
+        if other is NotImplemented:
+            return other
+        return Money(self.minor + other.minor, self.currency)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        other = self._check(other)
+        if other is NotImplemented:
+            return other
+        return Money(self.minor - other.minor, self.currency)
+
+    def __neg__(self):
+        return Money(-self.minor, self.currency)
+
+    def __abs__(self):
+        return Money(abs(self.minor), self.currency)
+
+    def __eq__(self, other):
+        if isinstance(other, Money):
+            return self.minor == other.minor and self.currency == other.currency
+        return NotImplemented
+
+    def __lt__(self, other):
+        other = self._check(other)
+        if other is NotImplemented:
+            return other
+        return self.minor < other.minor
+
+    def __le__(self, other):
+        other = self._check(other)
+        if other is NotImplemented:
+            return other
+        return self.minor <= other.minor
+
+    def __gt__(self, other):
+        other = self._check(other)
+        if other is NotImplemented:
+            return other
+        return self.minor > other.minor
+
+    def __ge__(self, other):
+        other = self._check(other)
+        if other is NotImplemented:
+            return other
+        return self.minor >= other.minor
+
+    def __hash__(self):
+        return hash((self.minor, self.currency))
+
+    def __bool__(self):
+        return self.minor != 0
+
+    def __float__(self):
+        return from_minor(self.minor, self.currency)
+
+    def __format__(self, spec):
+        return format(self.amount, spec) if spec else str(self)
+
+    def __str__(self):
+        return f"{self.amount} {self.currency}"
+
+    def __repr__(self):
+        return f"Money({self.minor}, {self.currency!r})"
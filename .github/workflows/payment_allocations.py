@@ -0,0 +1,177 @@
+from ageing import update_ageing_balances
+from dashboard_metrics import OPEN_INVOICES, UNPAID_BILLS, update_open_documents
+from money import Money, from_minor
+
+# Documents payments are allocated to: document_type -> table and columns
+DOCUMENT_TABLES = {
+    'Invoice': {'table': 'sales_invoices', 'id': 'invoice_id', 'number': 'invoice_number',
+                'party': 'customer_id', 'date': 'invoice_date', 'metric': OPEN_INVOICES,
+                'party_type': 'Customer'},
+    'Bill': {'table': 'purchase_bills', 'id': 'bill_id', 'number': 'bill_number',
+             'party': 'supplier_id', 'date': 'bill_date', 'metric': UNPAID_BILLS,
+             'party_type': 'Supplier'},
+}
+
+
+def _document_query(document_type):
+    columns = DOCUMENT_TABLES[document_type]
+    return f'''
+        SELECT {columns['id']} as document_id, {columns['number']} as document_number,
+               {columns['party']} as party_id, {columns['date']} as document_date, due_date,
+               currency, exchange_rate, total_amount, amount_outstanding, status
+        FROM {columns['table']}
+    '''
+
+
+def open_documents(cursor, document_type, party_id):
+    """
+    A party's invoices or bills with an amount outstanding, oldest due first. Returns
+    the executed cursor, so a payment reads only as many as it settles.
+    """
+    columns = DOCUMENT_TABLES[document_type]
+    # The condition and order match the partial index on open documents (the row id
+    # follows due_date in it), so rows are read in order without sorting
+    return cursor.execute(_document_query(document_type) + f'''
+        WHERE {columns['party']} = ? AND amount_outstanding > 0
+        ORDER BY due_date, {columns['id']}
+    ''', (party_id,))
+
+
+def find_documents(cursor, document_type, document_numbers):
+    """Invoices or bills by number, in the order given; raises ValueError for an unknown number"""
+    columns = DOCUMENT_TABLES[document_type]
+    documents = []
+    for document_number in document_numbers:
+        cursor.execute(_document_query(document_type) + f"WHERE {columns['number']} = ?", (document_number,))
+        document = cursor.fetchone()
+        if document is None:
+            raise ValueError(f"{document_type} not found: {document_number}")
+        documents.append(document)
+    return documents
+
+
+def check_payment_documents(documents, party_id):
+    """Error message if documents cannot be paid together by one party's payment, else None"""
+    for document in documents:
+        if document['party_id'] != party_id:
+            return f"{document['document_number']} belongs to another party"
+    # A payment is posted in one currency at one exchange rate
+    if len({(document['currency'], document['exchange_rate']) for document in documents}) > 1:
+        return "Documents paid together must have the same currency and exchange rate"
+    return None
+
+
+def find_payment(cursor, party_type, payment_number):
+    """
+    A customer's or supplier's payment by number, with the amount (minor units) not
+    yet allocated to documents; raises ValueError for an unknown number
+    """
+    cursor.execute('''
+        SELECT payment_id, payment_number, party_id, currency, exchange_rate,
+               amount - COALESCE((SELECT SUM(amount) FROM payment_allocations pa
+                                  WHERE pa.payment_id = p.payment_id), 0) as unallocated
+        FROM payments p
+        WHERE payment_number = ? AND party_type = ?
+    ''', (payment_number, party_type))
+    payment = cursor.fetchone()
+    if payment is None:
+        raise ValueError(f"Payment not found: {payment_number}")
+    return payment
+
+
+def check_payment_allocation(payment, documents):
+    """
+    Error message if documents cannot take what is left unallocated on a payment,
+    else None: there must be some left, and the documents must be the party's,
+    open, and in the payment's currency and exchange rate
+    """
+    if payment['unallocated'] <= 0:
+        return f"Nothing is left to allocate on {payment['payment_number']}"
+    for document in documents:
+        if (document['currency'], document['exchange_rate']) != (payment['currency'], payment['exchange_rate']):
+            return f"{document['document_number']} is not in the currency and exchange rate of the payment"
+    return check_payment_documents(documents, payment['party_id']) or check_named_documents(documents)
+
+
+def check_named_documents(documents, unallocated=0):
+    """
+    Error message if a payment for documents named by number does not go to them
+    in full, else None: each must have an amount outstanding, and none of the
+    payment may be left over, as only payments for no document go on account
+    """
+    for document in documents:
+        if document['amount_outstanding'] <= 0:
+            return f"{document['document_number']} has nothing outstanding"
+    if unallocated:
+        amount = from_minor(unallocated, documents[0]['currency'])
+        return f"Payment exceeds the amount outstanding on the documents by {amount:,.2f}"
+    return None
+
+
+def plan_allocations(documents, amount):
+    """
+    Spread amount (minor units) over documents in order, each up to its amount
+    outstanding: ([(document, allocated), ...], amount left unallocated)
+    """
+    allocations = []
+    for document in documents:
+        if amount <= 0:
+            break
+        allocated = min(amount, document['amount_outstanding'])
+        if allocated > 0:
+            allocations.append((document, allocated))
+            amount -= allocated
+    return allocations, amount
+
+
+def payment_postings(allocations, unallocated, currency, exchange_rate, description, payment_number):
+    """
+    Amounts a payment posts to the party's receivable or payable account, one per
+    document it settles and one for any amount left unallocated:
+    [(Money, line description), ...]
+    """
+    postings = [(Money(amount, currency).convert(exchange_rate, currency),
+                 f"{description} - {document['document_number']}") for document, amount in allocations]
+    if unallocated:
+        postings.append((Money(unallocated, currency).convert(exchange_rate, currency),
+                         f"Payment on account - {payment_number}"))
+    return postings
+
+
+def allocate_payment(cursor, document_type, payment_id, allocations, allocation_date, now):
+    """
+    Record a payment's allocations [(document, amount), ...] and reduce the documents'
+    amount outstanding, status, open documents counter and ageing balances to match
+    """
+    if not allocations:
+        return
+
+    columns = DOCUMENT_TABLES[document_type]
+    cursor.executemany('''
+        INSERT INTO payment_allocations
+        (payment_id, document_type, document_id, amount, allocation_date, created_date)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(payment_id, document_type, document['document_id'], amount, allocation_date, now)
+          for document, amount in allocations])
+
+    changes = [(document, document['amount_outstanding'], document['amount_outstanding'] - amount)
+               for document, amount in allocations]
+    cursor.executemany(f'''
+        UPDATE {columns['table']} SET amount_outstanding = ?, status = ?
+        WHERE {columns['id']} = ?
+    ''', [(outstanding, 'Paid' if outstanding == 0 else 'Partially Paid', document['document_id'])
+          for document, _, outstanding in changes])
+    update_open_documents(cursor, columns['metric'], changes)
+    update_ageing_balances(cursor, columns['party_type'], changes)
+
+
+def statement_items(documents):
+    """Open documents as statement lines, with amounts in major units"""
+    return [{
+        'document_number': document['document_number'],
+        'document_date': document['document_date'],
+        'due_date': document['due_date'],
+        'currency': document['currency'],
+        'total_amount': from_minor(document['total_amount'], document['currency']),
+        'amount_outstanding': from_minor(document['amount_outstanding'], document['currency']),
+    } for document in documents]
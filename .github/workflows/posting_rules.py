@@ -0,0 +1,238 @@
+import threading
+from collections import namedtuple
+from money import BASE_CURRENCY, Money, allocate_residual
+from master_data import get_master_data
+
+# Accounts used when an item, customer, supplier or VAT rate has none of its own: role -> account code
+DEFAULT_ACCOUNTS = {
+    'receivable': '1121',
+    'payable': '2111',
+    'revenue': '4110',
+    'cogs': '5100',
+    'inventory': '1131',
+    'purchases': '1131',
+    'output_vat': '2121',
+    'input_vat': '2122',
+}
+
+# Master tables the compiled rules are built from
+RULE_TABLES = ('accounts', 'customers', 'suppliers', 'items', 'vat_rates')
+
+# COGS posting modes: lines merged per account, or a COGS and inventory line per item
+COGS_BY_ACCOUNT = 'account'
+COGS_BY_ITEM = 'item'
+
+ItemAccounts = namedtuple('ItemAccounts', 'revenue cogs inventory')
+
+
+def aggregate_journal_lines(lines):
+    """
+    Merge journal lines that post to the same account, side and description
+    lines = [(account_id, debit, credit, description), ...] with integer minor units
+    Lines keep the order in which their account first appears.
+    """
+    totals = {}
+    for account_id, debit, credit, description in lines:
+        key = (account_id, 'debit' if debit else 'credit', description)
+        total = totals.setdefault(key, [0, 0])
+        total[0] += debit
+        total[1] += credit
+
+    return [(account_id, debit, credit, description)
+            for (account_id, side, description), (debit, credit) in totals.items()
+            if debit or credit]
+
+
+class PostingRules:
+    """
+    Resolves the accounts a document posts to, per item, customer, supplier and
+    VAT rate, from lookup tables compiled out of the master data cache. The tables
+    are recompiled when the cache's version of any master table changes, including
+    changes the cache picks up from other processes.
+    """
+    def __init__(self, master_data):
+        self.master_data = master_data
+        self.lock = threading.Lock()
+        self.compiled_versions = None
+
+    def compile(self, cursor):
+        """Build the lookup tables, unless they are current"""
+        # Master data changed by other processes counts as a new version once the cache sees it
+        self.master_data.check(cursor)
+        versions = tuple(self.master_data.versions[name] for name in RULE_TABLES)
+        if versions == self.compiled_versions:
+            return
+
+        with self.lock:
+            defaults = self.master_data.account_ids(cursor, DEFAULT_ACCOUNTS.values())
+            self.defaults = {role: defaults[code] for role, code in DEFAULT_ACCOUNTS.items()}
+
+            self.receivable_accounts = {row['customer_id']: row['receivable_account_id'] or self.defaults['receivable']
+                                        for row in self.master_data.rows(cursor, 'customers')}
+            self.payable_accounts = {row['supplier_id']: row['payable_account_id'] or self.defaults['payable']
+                                     for row in self.master_data.rows(cursor, 'suppliers')}
+            self.item_accounts = {row['item_id']: self._item_accounts(row)
+                                  for row in self.master_data.rows(cursor, 'items')}
+
+            # Output VAT by rate; the first active VAT rate with an account wins
+            self.output_vat_accounts = {}
+            for row in self.master_data.rows(cursor, 'vat_rates'):
+                if row['is_active'] and row['vat_account_id']:
+                    self.output_vat_accounts.setdefault(float(row['vat_rate']), row['vat_account_id'])
+
+            self.compiled_versions = versions
+
+    def _item_accounts(self, item):
+        return ItemAccounts(item['sales_account_id'] or self.defaults['revenue'],
+                            item['cogs_account_id'] or self.defaults['cogs'],
+                            item['inventory_account_id'] or self.defaults['inventory'])
+
+    def receivable_account(self, cursor, customer_id):
+        account_id = self.receivable_accounts.get(customer_id)
+        if account_id is None:
+            # Customers added since the tables were compiled are looked up on their own
+            customer = self.master_data.get(cursor, 'customers', customer_id)
+            if not customer:
+                raise Exception(f"Customer {customer_id} not found")
+            account_id = self.receivable_accounts[customer_id] = (customer['receivable_account_id']
+                                                                  or self.defaults['receivable'])
+        return account_id
+
+    def payable_account(self, cursor, supplier_id):
+        account_id = self.payable_accounts.get(supplier_id)
+        if account_id is None:
+            supplier = self.master_data.get(cursor, 'suppliers', supplier_id)
+            if not supplier:
+                raise Exception(f"Supplier {supplier_id} not found")
+            account_id = self.payable_accounts[supplier_id] = (supplier['payable_account_id']
+                                                               or self.defaults['payable'])
+        return account_id
+
+    def accounts_for_item(self, cursor, item_id):
+        """ItemAccounts for an item; lines without an item use the default accounts"""
+        if not item_id:
+            return ItemAccounts(self.defaults['revenue'], self.defaults['cogs'], self.defaults['inventory'])
+
+        accounts = self.item_accounts.get(item_id)
+        if accounts is None:
+            item = self.master_data.get(cursor, 'items', item_id)
+            if not item:
+                raise Exception(f"Item {item_id} not found")
+            accounts = self.item_accounts[item_id] = self._item_accounts(item)
+        return accounts
+
+    def output_vat_account(self, vat_rate):
+        return self.output_vat_accounts.get(float(vat_rate or 0), self.defaults['output_vat'])
+
+    def sales_invoice_lines(self, cursor, customer_id, lines, line_totals, line_vat, currency,
+                            exchange_rate, invoice_number):
+        """
+        Journal lines for a sales invoice: the receivable, then revenue per revenue account
+        and VAT per VAT account. VAT takes the exchange rounding so the entry balances.
+        """
+        self.compile(cursor)
+        revenue = {}
+        vat = {}
+        for line, line_total, line_vat_amount in zip(lines, line_totals, line_vat):
+            revenue_account = self.accounts_for_item(cursor, line[0]).revenue
+            revenue[revenue_account] = revenue.get(revenue_account, 0) + line_total
+            if line_vat_amount:
+                vat_account = self.output_vat_account(line[4])
+                vat[vat_account] = vat.get(vat_account, 0) + line_vat_amount
+
+        receivable = _convert(sum(line_totals) + sum(line_vat), currency, exchange_rate)
+        revenue = {account_id: _convert(amount, currency, exchange_rate) for account_id, amount in revenue.items()}
+        vat = _balance_with_residual(vat, revenue, receivable, currency, exchange_rate)
+
+        journal_lines = [(self.receivable_account(cursor, customer_id), receivable, 0,
+                          f"Sales Invoice {invoice_number}")]
+        journal_lines += [(account_id, 0, amount, f"Sales Revenue - {invoice_number}")
+                          for account_id, amount in revenue.items()]
+        journal_lines += [(account_id, 0, amount, f"VAT on Sales - {invoice_number}")
+                          for account_id, amount in vat.items()]
+        return _as_money(journal_lines, currency)
+
+    def purchase_bill_lines(self, cursor, supplier_id, lines, line_totals, line_vat, currency,
+                            exchange_rate, bill_number):
+        """
+        Journal lines for a purchase bill: purchases per inventory account, the payable,
+        then input VAT. VAT takes the exchange rounding so the entry balances.
+        """
+        self.compile(cursor)
+        purchases = {}
+        for line, line_total in zip(lines, line_totals):
+            account_id = self.accounts_for_item(cursor, line[0]).inventory if line[0] else self.defaults['purchases']
+            purchases[account_id] = purchases.get(account_id, 0) + line_total
+
+        payable = _convert(sum(line_totals) + sum(line_vat), currency, exchange_rate)
+        purchases = {account_id: _convert(amount, currency, exchange_rate) for account_id, amount in purchases.items()}
+        vat = {self.defaults['input_vat']: sum(line_vat)} if sum(line_vat) else {}
+        vat = _balance_with_residual(vat, purchases, payable, currency, exchange_rate)
+
+        journal_lines = [(account_id, amount, 0, f"Purchase - {bill_number}")
+                         for account_id, amount in purchases.items()]
+        journal_lines.append((self.payable_account(cursor, supplier_id), 0, payable,
+                              f"Purchase Bill {bill_number}"))
+        journal_lines += [(account_id, amount, 0, f"VAT on Purchase - {bill_number}")
+                          for account_id, amount in vat.items()]
+        return _as_money(journal_lines, currency)
+
+    def cogs_lines(self, cursor, issues, invoice_number, mode=COGS_BY_ACCOUNT):
+        """
+        Journal lines for the cost of goods sold on an invoice, as one balanced set
+        issues = [(item_id, value in base currency minor units), ...]
+        COGS_BY_ACCOUNT gives one line per COGS and inventory account; COGS_BY_ITEM
+        gives a COGS and an inventory line per item, labelled with the item code.
+        """
+        self.compile(cursor)
+        journal_lines = []
+        for item_id, value in issues:
+            accounts = self.accounts_for_item(cursor, item_id)
+            detail = ''
+            if mode == COGS_BY_ITEM:
+                detail = f" - {self.master_data.get(cursor, 'items', item_id)['item_code']}"
+            journal_lines.append((accounts.cogs, value, 0, f"COGS - {invoice_number}{detail}"))
+            journal_lines.append((accounts.inventory, 0, value, f"Inventory Reduction - {invoice_number}{detail}"))
+
+        journal_lines = aggregate_journal_lines(journal_lines)
+        if mode == COGS_BY_ACCOUNT:
+            # Debits first, then credits
+            journal_lines.sort(key=lambda line: not line[1])
+        return _as_money(journal_lines, BASE_CURRENCY)
+
+
+def _convert(minor, currency, exchange_rate):
+    # Document amounts are posted converted at the document rate, as they always have been
+    return Money(minor, currency).convert(exchange_rate, currency).minor
+
+
+def _balance_with_residual(vat, amounts, total, currency, exchange_rate):
+    """Convert VAT per account so that VAT plus amounts add up to total exactly"""
+    if not vat:
+        # Without VAT the net lines take the rounding themselves
+        accounts = list(amounts)
+        balanced = allocate_residual([amounts[account_id] for account_id in accounts], total)
+        amounts.update(zip(accounts, balanced))
+        return {}
+
+    accounts = list(vat)
+    converted = [_convert(vat[account_id], currency, exchange_rate) for account_id in accounts]
+    return dict(zip(accounts, allocate_residual(converted, total - sum(amounts.values()))))
+
+
+def _as_money(journal_lines, currency):
+    return [(account_id, Money(debit, currency), Money(credit, currency), description)
+            for account_id, debit, credit, description in journal_lines]
+
+
+_rules = {}
+_rules_lock = threading.Lock()
+
+
+def get_posting_rules(db_path):
+    """Get the process-wide posting rules for a database file"""
+    with _rules_lock:
+        rules = _rules.get(db_path)
+        if rules is None:
+            rules = _rules[db_path] = PostingRules(get_master_data(db_path))
+        return rules
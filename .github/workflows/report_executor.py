@@ -0,0 +1,132 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ReportRequest:
+    """Handle for one submitted report, returned by ReportExecutor.submit()"""
+    def __init__(self, key, description, on_done=None, on_error=None):
+        self.key = key
+        self.description = description
+        self.on_done = on_done
+        self.on_error = on_error
+        self.cancelled = threading.Event()
+        self.future = None
+
+    def cancel(self):
+        """
+        Drop the request. A report that has not started yet never runs; one that
+        is already running finishes its query but its result is discarded.
+        """
+        self.cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def is_cancelled(self):
+        return self.cancelled.is_set()
+
+
+class ReportExecutor:
+    """
+    Runs report queries on a pool of worker threads so that the Tk main loop never
+    waits for SQLite. Tk widgets may only be touched from the main thread, so workers
+    put their results on a queue that the main thread drains with root.after().
+
+    Requests are submitted under a key such as 'trial_balance'. Submitting a new
+    request with the same key cancels the one it supersedes, so regenerating a
+    report with a different date only ever draws the latest result.
+
+        executor.submit('trial_balance', accounting.get_trial_balance, date_to,
+                        on_done=draw_trial_balance)
+    """
+    def __init__(self, root, max_workers=4, poll_interval=50, on_busy=None):
+        self.root = root
+        self.poll_interval = poll_interval
+        self.on_busy = on_busy          # on_busy(descriptions) when the running set changes
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='report')
+        self.results = queue.Queue()
+        self.pending = {}
+        self.polling = False
+
+    def submit(self, key, func, *args, on_done=None, on_error=None, description=None):
+        """
+        Run func(*args) on a worker thread, then call on_done(result) on the main thread.
+        If func raises, on_error(exception) is called instead (or the error is shown
+        through Tk's error handler). Returns the ReportRequest.
+        """
+        self.cancel(key)
+
+        request = ReportRequest(key, description or key.replace('_', ' ').title(), on_done, on_error)
+        self.pending[key] = request
+
+        request.future = self.pool.submit(self._run, request, func, args)
+        self._busy_changed()
+        self._schedule_poll()
+        return request
+
+    def cancel(self, key):
+        """Cancel the pending request with this key, if any"""
+        request = self.pending.pop(key, None)
+        if request is not None:
+            request.cancel()
+            self._busy_changed()
+
+    def cancel_all(self):
+        """Cancel every pending request, e.g. when the screen that asked for them closes"""
+        for key in list(self.pending):
+            self.cancel(key)
+
+    def shutdown(self):
+        """Cancel pending requests and stop the worker threads without waiting for them"""
+        self.cancel_all()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, request, func, args):
+        # Worker thread: never touch Tk here
+        if request.is_cancelled():
+            return
+        try:
+            result, error = func(*args), None
+        except Exception as e:
+            result, error = None, e
+        self.results.put((request, result, error))
+
+    def _schedule_poll(self):
+        if not self.polling:
+            self.polling = True
+            self.root.after(self.poll_interval, self._poll)
+
+    def _poll(self):
+        # Main thread: deliver finished reports that are still wanted
+        self.polling = False
+
+        while True:
+            try:
+                request, result, error = self.results.get_nowait()
+            except queue.Empty:
+                break
+
+            if request.is_cancelled() or self.pending.get(request.key) is not request:
+                continue
+
+            del self.pending[request.key]
+            self._busy_changed()
+
+            try:
+                if error is not None:
+                    raise error
+                if request.on_done:
+                    request.on_done(result)
+            except Exception as e:
+                # A failing report or callback must not stop the other results arriving
+                if request.on_error and e is error:
+                    request.on_error(e)
+                else:
+                    self.root.report_callback_exception(type(e), e, e.__traceback__)
+
+        if self.pending:
+            self._schedule_poll()
+
+    def _busy_changed(self):
+        if self.on_busy:
+            self.on_busy([request.description for request in self.pending.values()])
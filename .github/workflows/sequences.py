@@ -0,0 +1,80 @@
+# Document numbering: sequence name -> (prefix, table, number column)
+DOCUMENT_SEQUENCES = {
+    'JE': ('JE-', 'journal_entries', 'entry_number'),
+    'INV': ('INV-', 'sales_invoices', 'invoice_number'),
+    'BILL': ('BILL-', 'purchase_bills', 'bill_number'),
+    'STK-IN': ('STK-IN-', 'inventory_transactions', 'transaction_number'),
+    'STK-OUT': ('STK-OUT-', 'inventory_transactions', 'transaction_number'),
+    'STK-TRF': ('STK-TRF-', 'inventory_transactions', 'transaction_number'),
+    'PMT-IN': ('PMT-IN-', 'payments', 'payment_number'),
+    'PMT-OUT': ('PMT-OUT-', 'payments', 'payment_number'),
+}
+
+
+def format_document_number(prefix, value):
+    """Format a sequence value as a document number, e.g. JE-000042"""
+    return f"{prefix}{value:06d}"
+
+
+def seed_document_sequences(cursor):
+    """Create a sequence row for every document type, continuing after existing numbers"""
+    for sequence_name, (prefix, table, column) in DOCUMENT_SEQUENCES.items():
+        cursor.execute(f'''
+            SELECT COALESCE(MAX(CAST(SUBSTR({column}, ?) AS INTEGER)), 0)
+            FROM {table} WHERE {column} LIKE ?
+        ''', (len(prefix) + 1, prefix + '%'))
+        last_value = cursor.fetchone()[0]
+
+        cursor.execute('''
+            INSERT OR IGNORE INTO document_sequences (sequence_name, prefix, next_value)
+            VALUES (?, ?, ?)
+        ''', (sequence_name, prefix, last_value + 1))
+
+
+def reserve_document_numbers(cursor, sequence_name, count):
+    """
+    Reserve a block of consecutive document numbers inside the caller's transaction.
+    The UPDATE takes the database write lock, so concurrent writers queue behind it
+    and can never be handed the same number. Rolling back the transaction returns
+    the numbers to the sequence, which keeps numbering gap-free.
+    """
+    if count < 1:
+        return []
+
+    cursor.execute('''
+        UPDATE document_sequences SET next_value = next_value + ?
+        WHERE sequence_name = ?
+    ''', (count, sequence_name))
+
+    if cursor.rowcount == 0:
+        raise ValueError(f"Unknown document sequence: {sequence_name}")
+
+    cursor.execute('SELECT prefix, next_value FROM document_sequences WHERE sequence_name = ?',
+                   (sequence_name,))
+    prefix, next_value = cursor.fetchone()
+    first_value = next_value - count
+
+    return [format_document_number(prefix, value) for value in range(first_value, next_value)]
+
+
+def next_document_number(cursor, sequence_name):
+    """Allocate the next document number inside the caller's transaction"""
+    return reserve_document_numbers(cursor, sequence_name, 1)[0]
+
+
+def reserve_row_ids(cursor, table, id_column, count):
+    """
+    Reserve consecutive primary keys for a bulk insert, so that child rows can
+    reference their parents without reading back lastrowid one row at a time.
+    Must be called inside a write transaction; AUTOINCREMENT tables continue
+    after the highest id ever used.
+    """
+    cursor.execute(f'SELECT COALESCE(MAX({id_column}), 0) FROM {table}')
+    last_id = cursor.fetchone()[0]
+
+    cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,))
+    sequence = cursor.fetchone()
+    if sequence and sequence[0] > last_id:
+        last_id = sequence[0]
+
+    return list(range(last_id + 1, last_id + 1 + count))
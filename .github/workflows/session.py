@@ -0,0 +1,150 @@
+from connection_pool import get_connection
+
+# Called as hook(session) once a session on the database has begun its transaction: db_path -> [hook, ...]
+_begin_hooks = {}
+
+
+def on_begin(db_path, hook):
+    """Call hook(session) at the start of every session transaction on db_path, e.g. to check a cache"""
+    _begin_hooks.setdefault(db_path, []).append(hook)
+
+
+class Session:
+    """
+    Unit of work shared between managers, so that a business document and all
+    the journal entries and stock movements it creates post in one transaction
+    with a single commit.
+
+    Managers accept the session through their session= argument and open a
+    TransactionScope on it. The outermost scope owns the real transaction and
+    nested scopes run inside savepoints, so a manager call that fails only
+    undoes its own work while the caller decides whether to roll back the rest.
+
+        with Session(db_path) as session:
+            sales.create_sales_invoice(..., session=session)
+            sales.create_sales_invoice(..., session=session)
+    """
+    def __init__(self, db_path="accounting_data.db"):
+        self.db_path = db_path
+        self.conn = None
+        self.depth = 0
+        self.savepoint_count = 0
+        self.root_scope = None
+        self.current_scope = None
+        self.state = {}         # per-transaction state kept by engines such as the stock state
+
+    def open(self):
+        """Connect and begin the transaction, taking the write lock up front"""
+        self.conn = get_connection(self.db_path)
+        self.conn.execute('BEGIN IMMEDIATE')
+        for hook in _begin_hooks.get(self.db_path, ()):
+            hook(self)
+
+    def close(self):
+        """Close the session connection"""
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    def scope(self):
+        """Open a transaction scope for one manager call"""
+        return TransactionScope(self)
+
+    def __enter__(self):
+        self.root_scope = self.scope()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.root_scope.commit()
+        self.root_scope.close()
+        self.root_scope = None
+        return False
+
+
+class TransactionScope:
+    """
+    Connection-like handle returned to a manager by Session.scope().
+    It supports the cursor/commit/rollback/close calls the managers already
+    make on their connections.
+
+    Callbacks registered with on_commit() run once the transaction commits and
+    those registered with on_rollback() run if the scope's work is undone; a nested
+    scope that commits hands its callbacks to the scope around it.
+    """
+    def __init__(self, session):
+        self.session = session
+        self.parent = session.current_scope
+        self.commit_callbacks = []
+        self.rollback_callbacks = []
+
+        if session.depth == 0:
+            session.open()
+            self.savepoint = None
+        else:
+            session.savepoint_count += 1
+            self.savepoint = f"scope_{session.savepoint_count}"
+            session.conn.execute(f'SAVEPOINT {self.savepoint}')
+
+        session.depth += 1
+        session.current_scope = self
+        self.active = True
+
+    def cursor(self):
+        return self.session.conn.cursor()
+
+    def execute(self, *args):
+        return self.session.conn.execute(*args)
+
+    def on_commit(self, callback):
+        """Call callback() after the transaction this scope belongs to commits"""
+        self.commit_callbacks.append(callback)
+
+    def on_rollback(self, callback):
+        """Call callback() if the work of this scope is rolled back"""
+        self.rollback_callbacks.append(callback)
+
+    def commit(self):
+        """Commit the transaction, or release the savepoint of a nested scope"""
+        if not self.active:
+            return
+
+        if self.savepoint:
+            self.session.conn.execute(f'RELEASE SAVEPOINT {self.savepoint}')
+            self.parent.commit_callbacks += self.commit_callbacks
+            self.parent.rollback_callbacks += self.rollback_callbacks
+            self._finish()
+        else:
+            self.session.conn.commit()
+            self._finish()
+            for callback in self.commit_callbacks:
+                callback()
+
+    def rollback(self):
+        """Roll back the transaction, or only the work of this scope if nested"""
+        if not self.active:
+            return
+
+        if self.savepoint:
+            self.session.conn.execute(f'ROLLBACK TO SAVEPOINT {self.savepoint}')
+            self.session.conn.execute(f'RELEASE SAVEPOINT {self.savepoint}')
+        else:
+            self.session.conn.rollback()
+        self._finish()
+
+        for callback in reversed(self.rollback_callbacks):
+            callback()
+
+    def close(self):
+        """Discard uncommitted work like closing a connection would"""
+        self.rollback()
+
+        if self.savepoint is None:
+            self.session.close()
+
+    def _finish(self):
+        self.active = False
+        self.session.depth -= 1
+        self.session.current_scope = self.parent
+        if self.savepoint is None:
+            self.session.state = {}
@@ -0,0 +1,154 @@
+from datetime import date, datetime, timedelta
+
+# Signed quantity and value each movement adds to its locations; Transfer rows
+# recorded next to their own Issue and Receipt rows have affects_stock = 0
+MOVEMENT_DELTAS_QUERY = '''
+    SELECT item_id, location_id, SUM(quantity), SUM(total_value)
+    FROM (
+        SELECT item_id, to_location_id as location_id, quantity, total_value
+        FROM inventory_transactions
+        WHERE transaction_date > ? AND transaction_date <= ?
+          AND to_location_id IS NOT NULL AND affects_stock = 1
+        UNION ALL
+        SELECT item_id, from_location_id, -quantity, -total_value
+        FROM inventory_transactions
+        WHERE transaction_date > ? AND transaction_date <= ?
+          AND from_location_id IS NOT NULL AND affects_stock = 1
+    )
+    GROUP BY item_id, location_id
+'''
+
+
+def stock_movement_deltas(cursor, date_from, date_to):
+    """Net quantity and value moved after date_from up to date_to: {(item_id, location_id): [quantity, value]}"""
+    cursor.execute(MOVEMENT_DELTAS_QUERY, (date_from, date_to, date_from, date_to))
+    return {(row[0], row[1]): [row[2], row[3]] for row in cursor.fetchall()}
+
+
+def count_movements(cursor, date_from, date_to):
+    """Number of movements after date_from up to date_to"""
+    cursor.execute('''
+        SELECT COUNT(*) FROM inventory_transactions
+        WHERE transaction_date > ? AND transaction_date <= ?
+    ''', (date_from, date_to))
+    return cursor.fetchone()[0]
+
+
+def stock_as_of(cursor, as_of):
+    """
+    Quantity and value of every stock row at the end of as_of:
+    {(item_id, location_id): [quantity, value]}
+    Starts from whichever is fewer movements away, the last snapshot on or before
+    as_of (replaying later movements forward) or the first snapshot after it, or
+    the current stock if there is none (undoing later movements).
+    """
+    cursor.execute('SELECT MAX(snapshot_date) FROM inventory_snapshot_dates WHERE snapshot_date <= ?', (as_of,))
+    before = cursor.fetchone()[0]
+    cursor.execute('SELECT MIN(snapshot_date) FROM inventory_snapshot_dates WHERE snapshot_date > ?', (as_of,))
+    after = cursor.fetchone()[0]
+
+    # The current stock is the newest snapshot there is
+    after_date = after or '9999-12-31'
+    if before is not None and count_movements(cursor, before, as_of) <= count_movements(cursor, as_of, after_date):
+        stock = _snapshot_rows(cursor, before)
+        sign, deltas = 1, stock_movement_deltas(cursor, before, as_of)
+    else:
+        if after:
+            stock = _snapshot_rows(cursor, after)
+        else:
+            cursor.execute('SELECT item_id, location_id, quantity, total_value FROM inventory_stock')
+            stock = {(row[0], row[1]): [row[2], row[3]] for row in cursor.fetchall()}
+        sign, deltas = -1, stock_movement_deltas(cursor, as_of, after_date)
+
+    for key, (quantity, value) in deltas.items():
+        current = stock.setdefault(key, [0, 0])
+        current[0] += sign * quantity
+        current[1] += sign * value
+    return stock
+
+
+def _snapshot_rows(cursor, snapshot_date):
+    cursor.execute('''
+        SELECT item_id, location_id, quantity, total_value
+        FROM inventory_stock_snapshots WHERE snapshot_date = ?
+    ''', (snapshot_date,))
+    return {(row[0], row[1]): [row[2], row[3]] for row in cursor.fetchall()}
+
+
+def discard_snapshots_from(cursor, transaction_date):
+    """Delete the snapshots a movement dated transaction_date falls before, which no longer hold"""
+    cursor.execute('DELETE FROM inventory_stock_snapshots WHERE snapshot_date >= ?', (transaction_date,))
+    cursor.execute('DELETE FROM inventory_snapshot_dates WHERE snapshot_date >= ?', (transaction_date,))
+
+
+def create_stock_snapshot(cursor, snapshot_date):
+    """Record the stock at the end of snapshot_date, a day that has ended"""
+    if snapshot_date >= date.today().isoformat():
+        raise ValueError("Snapshots can only be taken of days that have ended")
+
+    # A snapshot taken again is worked out afresh, not from itself
+    cursor.execute('DELETE FROM inventory_stock_snapshots WHERE snapshot_date = ?', (snapshot_date,))
+    cursor.execute('DELETE FROM inventory_snapshot_dates WHERE snapshot_date = ?', (snapshot_date,))
+
+    stock = stock_as_of(cursor, snapshot_date)
+    cursor.executemany('''
+        INSERT INTO inventory_stock_snapshots (snapshot_date, item_id, location_id, quantity, total_value)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(snapshot_date, item_id, location_id, quantity, value)
+          for (item_id, location_id), (quantity, value) in sorted(stock.items()) if quantity or value])
+    cursor.execute('''
+        INSERT INTO inventory_snapshot_dates (snapshot_date, created_date) VALUES (?, ?)
+    ''', (snapshot_date, datetime.now().isoformat()))
+
+
+def due_snapshot_dates(cursor, every_movements=None):
+    """
+    Days after the last snapshot that should get one: every month end, and with
+    every_movements also the end of each day on which that many movements have
+    built up since the previous snapshot. Only days that have ended are included.
+    """
+    cursor.execute('SELECT MAX(snapshot_date) FROM inventory_snapshot_dates')
+    last = cursor.fetchone()[0]
+    cursor.execute('SELECT MIN(transaction_date) FROM inventory_transactions WHERE transaction_date > ?',
+                   (last or '',))
+    first = cursor.fetchone()[0]
+    if first is None:
+        return []
+
+    yesterday = date.today() - timedelta(days=1)
+    day = date.fromisoformat(first)
+    month_ends = []
+    while day <= yesterday:
+        next_month = date(day.year + day.month // 12, day.month % 12 + 1, 1)
+        month_end = next_month - timedelta(days=1)
+        if month_end <= yesterday:
+            month_ends.append(month_end.isoformat())
+        day = next_month
+
+    due = set(month_ends)
+    if every_movements:
+        cursor.execute('''
+            SELECT transaction_date, COUNT(*) FROM inventory_transactions
+            WHERE transaction_date > ? AND transaction_date <= ?
+            GROUP BY transaction_date ORDER BY transaction_date
+        ''', (last or '', yesterday.isoformat()))
+        built_up = 0
+        month = None
+        for transaction_date, count in cursor.fetchall():
+            # Each month starts from its own month-end snapshot
+            if transaction_date[:7] != month:
+                month = transaction_date[:7]
+                built_up = 0
+            built_up += count
+            if built_up >= every_movements:
+                due.add(transaction_date)
+                built_up = 0
+    return sorted(due)
+
+
+def create_stock_snapshots(cursor, every_movements=None):
+    """Take every due snapshot, oldest first so that each starts from the one before"""
+    snapshot_dates = due_snapshot_dates(cursor, every_movements)
+    for snapshot_date in snapshot_dates:
+        create_stock_snapshot(cursor, snapshot_date)
+    return snapshot_dates
@@ -0,0 +1,181 @@
+import threading
+from array import array
+from dashboard_metrics import update_stock_value
+
+# Marks a key the transaction had not touched, for undoing its changes
+MISSING = object()
+
+
+class StockState:
+    """
+    Process-wide quantity, weighted average cost and value of every (item, location)
+    stock row of one database, so that receipts and issues work out costs without
+    reading inventory_stock.
+
+    Rows live in three parallel arrays of doubles indexed by a slot per key. Managers
+    read and write them through read() and write() with the TransactionScope of their
+    posting: changes are kept in the session until its transaction commits, and are
+    written behind to inventory_stock with one executemany per call, in the same
+    transaction. Postings run under the database write lock (BEGIN IMMEDIATE), which
+    serializes updates to a key across threads and processes.
+
+    Triggers on inventory_stock count every change to it in stock_state_version. A
+    transaction that finds the count differing from the one recorded at the last
+    commit (stock changed by other code or another process) drops the arrays and
+    reads rows again as it needs them.
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget every cached stock row"""
+        with self.lock:
+            self.slots = {}                 # (item_id, location_id) -> index into the arrays
+            self.quantity = array('d')
+            self.avg_cost = array('d')
+            self.value = array('d')
+            self.version = None             # stock_state_version the arrays match
+
+    def read(self, scope, keys):
+        """
+        Get {key: [quantity, weighted_avg_cost, total_value]} for (item_id, location_id)
+        keys as the scope's transaction sees them; keys without a stock row map to None
+        """
+        transaction = self._transaction(scope)
+        changes = transaction['changes']
+
+        stock = {}
+        missing = []
+        with self.lock:
+            for key in keys:
+                if key in stock:
+                    continue
+                if key in changes:
+                    current = changes[key]
+                    stock[key] = list(current) if current else None
+                elif key in self.slots:
+                    slot = self.slots[key]
+                    stock[key] = [self.quantity[slot], self.avg_cost[slot], self.value[slot]]
+                else:
+                    missing.append(key)
+
+        if missing:
+            # Rows read here are kept with the transaction and cached when it commits
+            cursor = scope.cursor()
+            for key in missing:
+                cursor.execute('''
+                    SELECT quantity, weighted_avg_cost, total_value
+                    FROM inventory_stock
+                    WHERE item_id = ? AND location_id = ?
+                ''', key)
+                row = cursor.fetchone()
+                current = changes[key] = (row[0], row[1], row[2]) if row else None
+                stock[key] = list(current) if current else None
+            scope.on_commit(lambda: self._apply(transaction))
+
+        return stock
+
+    def write(self, scope, stock, now):
+        """
+        Write changed stock rows {key: [quantity, weighted_avg_cost, total_value]}
+        to inventory_stock and the dashboard stock value, in the scope's transaction
+        """
+        if not stock:
+            return
+
+        transaction = self._transaction(scope)
+        changes = transaction['changes']
+        undo_changes = {key: changes.get(key, MISSING) for key in stock}
+        with self.lock:
+            original_values = {key: self._value(changes, key) for key in stock}
+
+        cursor = scope.cursor()
+        cursor.executemany('''
+            INSERT INTO inventory_stock
+            (item_id, location_id, quantity, weighted_avg_cost, total_value, last_updated)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(item_id, location_id) DO UPDATE SET
+                quantity = excluded.quantity,
+                weighted_avg_cost = excluded.weighted_avg_cost,
+                total_value = excluded.total_value,
+                last_updated = excluded.last_updated
+        ''', [(key[0], key[1], quantity, avg_cost, value, now)
+              for key, (quantity, avg_cost, value) in stock.items()])
+        update_stock_value(cursor, [(original_values[key], current[2]) for key, current in stock.items()])
+
+        previous_version = transaction['version']
+        cursor.execute('SELECT version FROM stock_state_version')
+        transaction['version'] = cursor.fetchone()[0]
+        changes.update((key, tuple(current)) for key, current in stock.items())
+
+        def undo():
+            # The scope's work was rolled back, so are its changes
+            for key, current in undo_changes.items():
+                if current is MISSING:
+                    changes.pop(key, None)
+                else:
+                    changes[key] = current
+            transaction['version'] = previous_version
+
+        scope.on_rollback(undo)
+        scope.on_commit(lambda: self._apply(transaction))
+
+    def _transaction(self, scope):
+        """Changes of the scope's session transaction, checking the cache on first use"""
+        transaction = scope.session.state.get('stock')
+        if transaction is None:
+            cursor = scope.cursor()
+            cursor.execute('SELECT version FROM stock_state_version')
+            version = cursor.fetchone()[0]
+            if version != self.version:
+                self.reset()
+            transaction = scope.session.state['stock'] = {'changes': {}, 'version': version, 'applied': False}
+        return transaction
+
+    def _value(self, changes, key):
+        # Total value of a stock row before a write, 0 for a new row
+        if key in changes:
+            return changes[key][2] if changes[key] else 0
+        if key in self.slots:
+            return self.value[self.slots[key]]
+        return 0
+
+    def _apply(self, transaction):
+        """Copy a committed transaction's stock rows into the arrays"""
+        if transaction['applied']:
+            return
+        transaction['applied'] = True
+
+        with self.lock:
+            for key, current in transaction['changes'].items():
+                if current is None:
+                    continue
+                slot = self.slots.get(key)
+                if slot is None:
+                    slot = self.slots[key] = len(self.quantity)
+                    self.quantity.append(current[0])
+                    self.avg_cost.append(current[1])
+                    self.value.append(current[2])
+                else:
+                    self.quantity[slot], self.avg_cost[slot], self.value[slot] = current
+            self.version = transaction['version']
+
+    def stats(self):
+        """Number of cached stock rows and the version they match"""
+        with self.lock:
+            return {'rows': len(self.slots), 'version': self.version}
+
+
+_states = {}
+_states_lock = threading.Lock()
+
+
+def get_stock_state(db_path):
+    """Get the process-wide stock state for a database file"""
+    with _states_lock:
+        state = _states.get(db_path)
+        if state is None:
+            state = _states[db_path] = StockState(db_path)
+        return state
@@ -1,73 +1,90 @@
-import sqlite3
 from datetime import datetime
-from accounting import AccountingManager
+from itertools import chain
+from decimal import Decimal
+from numbers import Real
+from connection_pool import get_connection
+from accounting import AccountingManager, update_period_balances, journal_line_amounts
+from money import BASE_CURRENCY, Money, to_minor
 from inventory import InventoryManager
+from sequences import next_document_number, reserve_document_numbers, reserve_row_ids
+from session import Session
+from master_data import get_master_data
+from posting_rules import COGS_BY_ACCOUNT, get_posting_rules
+from costing import CostingBatch
+from stock_snapshots import discard_snapshots_from
+from dashboard_metrics import OPEN_INVOICES, UNPAID_BILLS, add_open_documents
+from ageing import AgeingReport, add_ageing_balances
+from payment_allocations import (allocate_payment, check_named_documents, check_payment_allocation,
+                                 check_payment_documents, find_documents, find_payment, open_documents,
+                                 payment_postings, plan_allocations, statement_items)
+
+
+def document_amounts(lines, currency):
+    """
+    Line totals, subtotal, VAT and total of invoice or bill lines in integer minor units
+    lines = [(item_id, description, quantity, unit_price, vat_rate, location_id), ...]
+    VAT is rounded per line.
+    """
+    line_totals = [to_minor(line[2] * line[3], currency) for line in lines]
+    vat_amount = sum(line_vat_amounts(lines, line_totals, currency))
+    subtotal = sum(line_totals)
+    return line_totals, subtotal, vat_amount, subtotal + vat_amount
+
+
+def float_line(line):
+    """Invoice line with a Decimal or Fraction quantity, unit price or VAT rate as a float, which SQLite stores"""
+    item_id, description, quantity, unit_price, vat_rate, location_id = line
+    amounts = [value if isinstance(value, (int, float)) else float(value) for value in (quantity, unit_price, vat_rate)]
+    return (item_id, description, *amounts, location_id)
+
+
+def line_vat_amounts(lines, line_totals, currency):
+    """VAT of each invoice or bill line in integer minor units"""
+    return [to_minor(Money(line_total, currency).amount * Decimal(str(line[4])) / 100, currency)
+            for line, line_total in zip(lines, line_totals)]
+
 
 class SalesManager:
-    def __init__(self, db_path="accounting_data.db"):
+    def __init__(self, db_path="accounting_data.db", cogs_mode=COGS_BY_ACCOUNT):
         self.db_path = db_path
         self.accounting = AccountingManager(db_path)
         self.inventory = InventoryManager(db_path)
+        self.master_data = get_master_data(db_path)
+        self.posting_rules = get_posting_rules(db_path)
+        self.cogs_mode = cogs_mode
         
-    def connect(self):
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+    def connect(self, session=None):
+        if session is not None:
+            return session.scope()
+        return get_connection(self.db_path)
     
     def create_sales_invoice(self, customer_id, invoice_date, due_date, currency, exchange_rate, 
-                            payment_terms, notes, lines):
+                            payment_terms, notes, lines, session=None):
         """
         Create sales invoice with automatic journal posting
         lines = [(item_id, description, quantity, unit_price, vat_rate, location_id), ...]
+        The invoice, its journal entries and stock issues post in a single transaction.
         """
-        conn = self.connect()
+        session = session or Session(self.db_path)
+        conn = self.connect(session)
         cursor = conn.cursor()
         
         try:
-            # Calculate totals
-            subtotal = 0
-            vat_amount = 0
+            # Calculate totals in minor units
+            line_totals, subtotal, vat_amount, total_amount = document_amounts(lines, currency)
             
-            for line in lines:
-                item_id, description, quantity, unit_price, vat_rate, location_id = line
-                line_total = quantity * unit_price
-                line_vat = line_total * (vat_rate / 100)
-                subtotal += line_total
-                vat_amount += line_vat
-            
-            total_amount = subtotal + vat_amount
-            
-            # Generate invoice number
-            cursor.execute('SELECT COUNT(*) as count FROM sales_invoices')
-            count = cursor.fetchone()['count']
-            invoice_number = f"INV-{count + 1:06d}"
-            
-            # Get customer details
-            cursor.execute('SELECT receivable_account_id FROM customers WHERE customer_id = ?', (customer_id,))
-            customer = cursor.fetchone()
-            receivable_account = customer['receivable_account_id']
-            
-            # Get revenue and VAT accounts
-            cursor.execute('SELECT account_id FROM chart_of_accounts WHERE account_code = ?', ('4110',))
-            revenue_account = cursor.fetchone()['account_id']
-            
-            cursor.execute('SELECT account_id FROM chart_of_accounts WHERE account_code = ?', ('2121',))
-            vat_account = cursor.fetchone()['account_id']
-            
-            # Create journal entry
-            journal_lines = [
-                (receivable_account, total_amount * exchange_rate, 0, f"Sales Invoice {invoice_number}"),
-                (revenue_account, 0, subtotal * exchange_rate, f"Sales Revenue - {invoice_number}"),
-            ]
-            
-            if vat_amount > 0:
-                journal_lines.append(
-                    (vat_account, 0, vat_amount * exchange_rate, f"VAT on Sales - {invoice_number}")
-                )
+            # Allocate invoice number
+            invoice_number = next_document_number(cursor, 'INV')
+            
+            # Create journal entry, posting each line to the accounts of its item and VAT rate
+            journal_lines = self.posting_rules.sales_invoice_lines(
+                cursor, customer_id, lines, line_totals, line_vat_amounts(lines, line_totals, currency),
+                currency, exchange_rate, invoice_number
+            )
             
             success, entry_number, msg = self.accounting.create_journal_entry(
                 invoice_date, 'Sales Invoice', invoice_number, 
-                f"Sales Invoice to Customer", currency, exchange_rate, journal_lines
+                f"Sales Invoice to Customer", currency, exchange_rate, journal_lines, session
             )
             
             if not success:
@@ -82,52 +99,53 @@ class SalesManager:
                 INSERT INTO sales_invoices
                 (invoice_number, invoice_date, customer_id, currency, exchange_rate,
                  subtotal, vat_amount, total_amount, status, due_date, payment_terms,
-                 notes, journal_entry_id, created_date)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                 notes, journal_entry_id, created_date, amount_outstanding)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', (invoice_number, invoice_date, customer_id, currency, exchange_rate,
                   subtotal, vat_amount, total_amount, 'Unpaid', due_date, payment_terms,
-                  notes, journal_entry_id, datetime.now().isoformat()))
+                  notes, journal_entry_id, datetime.now().isoformat(), total_amount))
             
             invoice_id = cursor.lastrowid
+            open_invoice = {
+                'total_amount': total_amount, 'currency': currency, 'exchange_rate': exchange_rate,
+                'due_date': due_date, 'document_date': invoice_date, 'party_id': customer_id
+            }
+            add_open_documents(cursor, OPEN_INVOICES, [open_invoice])
+            add_ageing_balances(cursor, 'Customer', [open_invoice])
+            
+            # Insert invoice lines
+            cursor.executemany('''
+                INSERT INTO sales_invoice_lines
+                (invoice_id, item_id, description, quantity, unit_price, vat_rate, 
+                 line_total, location_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [(invoice_id, item_id, description, quantity, unit_price, vat_rate, line_total, location_id)
+                  for (item_id, description, quantity, unit_price, vat_rate, location_id), line_total
+                  in zip(lines, line_totals)])
+            
+            # Issue stock for lines with an item in one batch; lines without enough stock are not issued
+            stocked = [line for line in lines if line[0]]
+            success, results, msg = self.inventory.stock_issues_batch(
+                [(item_id, location_id, quantity, invoice_number, f"Sale - Invoice {invoice_number}", None)
+                 for item_id, description, quantity, unit_price, vat_rate, location_id in stocked], session,
+                invoice_date
+            )
             
-            # Insert invoice lines and issue stock
-            cursor.execute('SELECT account_id FROM chart_of_accounts WHERE account_code = ?', ('5100',))
-            cogs_account = cursor.fetchone()['account_id']
+            if not success:
+                raise Exception(f"Failed to issue stock: {msg}")
             
-            cursor.execute('SELECT account_id FROM chart_of_accounts WHERE account_code = ?', ('1131',))
-            inventory_account = cursor.fetchone()['account_id']
+            issues = [(line[0], to_minor(line[2] * unit_cost))
+                      for line, (issued, trans_number, unit_cost) in zip(stocked, results) if issued]
             
-            for line in lines:
-                item_id, description, quantity, unit_price, vat_rate, location_id = line
-                line_total = quantity * unit_price
-                
-                cursor.execute('''
-                    INSERT INTO sales_invoice_lines
-                    (invoice_id, item_id, description, quantity, unit_price, vat_rate, 
-                     line_total, location_id)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (invoice_id, item_id, description, quantity, unit_price, vat_rate,
-                      line_total, location_id))
+            # Post the cost of every issued line as one COGS entry
+            if issues:
+                success, _, msg = self.accounting.create_journal_entry(
+                    invoice_date, 'COGS', invoice_number, f"Cost of Goods Sold - {invoice_number}", 'GBP', 1.0,
+                    self.posting_rules.cogs_lines(cursor, issues, invoice_number, self.cogs_mode), session
+                )
                 
-                # Issue stock if item_id is provided
-                if item_id:
-                    success, trans_num, cogs_cost = self.inventory.stock_issue(
-                        item_id, location_id, quantity, invoice_number,
-                        f"Sale - Invoice {invoice_number}", None
-                    )
-                    
-                    if success:
-                        # Post COGS entry
-                        cogs_value = quantity * cogs_cost
-                        cogs_lines = [
-                            (cogs_account, cogs_value, 0, f"COGS - {invoice_number}"),
-                            (inventory_account, 0, cogs_value, f"Inventory Reduction - {invoice_number}")
-                        ]
-                        
-                        self.accounting.create_journal_entry(
-                            invoice_date, 'COGS', invoice_number,
-                            f"Cost of Goods Sold - {invoice_number}", 'GBP', 1.0, cogs_lines
-                        )
+                if not success:
+                    raise Exception(f"Failed to post COGS: {msg}")
             
             conn.commit()
             return True, invoice_number, "Invoice created successfully"
@@ -137,38 +155,333 @@ class SalesManager:
         finally:
             conn.close()
     
+    def create_sales_invoices_bulk(self, invoices, chunk_size=500, session=None):
+        """
+        Create many sales invoices with batched posting
+        invoices = iterable of dicts with the create_sales_invoice arguments:
+            {'customer_id', 'invoice_date', 'due_date', 'currency', 'exchange_rate',
+             'payment_terms', 'notes', 'lines'}
+        Every invoice is validated up front, then valid invoices post in chunked
+        transactions with executemany. Returns one (success, invoice_number, message)
+        per invoice in input order; a failed invoice does not stop the rest of the batch.
+        """
+        invoices = list(invoices)
+        results = [None] * len(invoices)
+        
+        # Resolve customers, items and posting rules once for the whole batch
+        conn = self.connect(session)
+        cursor = conn.cursor()
+        
+        try:
+            customer_ids = {invoice.get('customer_id') for invoice in invoices}
+            customers = {customer_id for customer_id in customer_ids
+                         if self.master_data.get(cursor, 'customers', customer_id)}
+            
+            item_ids = {line[0] for invoice in invoices for line in invoice.get('lines') or [] if line and line[0]}
+            items = {item_id for item_id in item_ids if self.master_data.get(cursor, 'items', item_id)}
+            
+            self.posting_rules.compile(cursor)
+        except Exception as e:
+            return [(False, None, str(e))] * len(invoices)
+        finally:
+            conn.close()
+        
+        # Validate everything before posting anything
+        valid = []
+        for index, invoice in enumerate(invoices):
+            error = self._validate_bulk_invoice(invoice, customers, items)
+            if error:
+                results[index] = (False, None, error)
+            else:
+                invoices[index] = dict(invoice, lines=[float_line(line) for line in invoice['lines']])
+                valid.append(index)
+        
+        # Post valid invoices in chunked transactions
+        for start in range(0, len(valid), chunk_size):
+            chunk = valid[start:start + chunk_size]
+            conn = self.connect(session or Session(self.db_path))
+            cursor = conn.cursor()
+            
+            try:
+                invoice_numbers = self._post_invoice_chunk(conn, cursor, [invoices[index] for index in chunk])
+                conn.commit()
+                for index, invoice_number in zip(chunk, invoice_numbers):
+                    results[index] = (True, invoice_number, "Invoice created successfully")
+            except Exception:
+                conn.rollback()
+                # Post the chunk one invoice at a time to isolate the failing records
+                for index in chunk:
+                    invoice = invoices[index]
+                    results[index] = self.create_sales_invoice(
+                        invoice['customer_id'], invoice['invoice_date'], invoice.get('due_date'),
+                        invoice.get('currency', 'GBP'), invoice.get('exchange_rate', 1.0),
+                        invoice.get('payment_terms'), invoice.get('notes'), invoice['lines'], session
+                    )
+            finally:
+                conn.close()
+        
+        return results
+    
+    def _validate_bulk_invoice(self, invoice, customers, items):
+        """Return an error message for an invalid bulk invoice, or None"""
+        if invoice.get('customer_id') not in customers:
+            return "Customer not found"
+        
+        if not invoice.get('invoice_date'):
+            return "Invoice date is required"
+        
+        lines = invoice.get('lines') or []
+        if not lines:
+            return "Invoice has no lines"
+        
+        for number, line in enumerate(lines, 1):
+            if len(line) != 6:
+                return f"Line {number}: expected (item_id, description, quantity, unit_price, vat_rate, location_id)"
+            
+            item_id, description, quantity, unit_price, vat_rate, location_id = line
+            
+            # Decimal is not a numbers.Real, and bool is one only by inheritance
+            if not all(isinstance(value, (Real, Decimal)) and not isinstance(value, bool)
+                       for value in (quantity, unit_price, vat_rate)):
+                return f"Line {number}: quantity, unit price and VAT rate must be numbers"
+            
+            if item_id and item_id not in items:
+                return f"Line {number}: item {item_id} not found"
+            
+            if item_id and not location_id:
+                return f"Line {number}: a location is required for stock items"
+        
+        return None
+    
+    def _post_invoice_chunk(self, conn, cursor, invoices):
+        """
+        Post a chunk of validated invoices with the same journal entries and stock
+        movements as create_sales_invoice, written with executemany.
+        Returns the invoice numbers in chunk order.
+        """
+        now = datetime.now().isoformat()
+        
+        invoice_numbers = reserve_document_numbers(cursor, 'INV', len(invoices))
+        invoice_ids = reserve_row_ids(cursor, 'sales_invoices', 'invoice_id', len(invoices))
+        
+        # Current stock of every item and location the chunk issues from
+        stock = self.inventory.stock_state.read(
+            conn, [(line[0], line[5]) for invoice in invoices for line in invoice['lines'] if line[0]]
+        )
+        costing = CostingBatch(cursor, self.master_data)
+        
+        entries = []        # [entry_date, entry_type, reference, description, currency, exchange_rate, lines]
+        invoice_rows = []
+        invoice_line_rows = []
+        issues = []         # (item_id, location_id, quantity, unit_cost, value, invoice_number, invoice_date)
+        
+        for invoice, invoice_number, invoice_id in zip(invoices, invoice_numbers, invoice_ids):
+            lines = invoice['lines']
+            currency = invoice.get('currency', 'GBP')
+            exchange_rate = invoice.get('exchange_rate', 1.0)
+            invoice_date = invoice['invoice_date']
+            
+            # Calculate totals in minor units
+            line_totals, subtotal, vat_amount, total_amount = document_amounts(lines, currency)
+            
+            journal_lines = self.posting_rules.sales_invoice_lines(
+                cursor, invoice['customer_id'], lines, line_totals, line_vat_amounts(lines, line_totals, currency),
+                currency, exchange_rate, invoice_number
+            )
+            
+            sales_entry_index = len(entries)
+            entries.append([invoice_date, 'Sales Invoice', invoice_number, "Sales Invoice to Customer",
+                            currency, exchange_rate, journal_lines])
+            
+            invoice_rows.append([invoice_id, invoice_number, invoice_date, invoice['customer_id'],
+                                 currency, exchange_rate, subtotal, vat_amount,
+                                 total_amount, 'Unpaid', invoice.get('due_date'),
+                                 invoice.get('payment_terms'), invoice.get('notes'), sales_entry_index, now,
+                                 total_amount])
+            
+            invoice_issues = []
+            for line, line_total in zip(lines, line_totals):
+                item_id, description, quantity, unit_price, vat_rate, location_id = line
+                invoice_line_rows.append((invoice_id, item_id, description, quantity, unit_price,
+                                          vat_rate, line_total, location_id))
+                
+                if not item_id:
+                    continue
+                
+                # Issue stock at weighted average cost, skipping lines without enough stock
+                current = stock.get((item_id, location_id))
+                if not current or current[0] < quantity:
+                    continue
+                
+                issue_value = costing.issue((item_id, location_id), current, quantity)
+                issues.append((item_id, location_id, quantity, issue_value / quantity if quantity else current[1],
+                               issue_value, invoice_number, invoice_date))
+                invoice_issues.append((item_id, to_minor(issue_value)))
+            
+            # One COGS entry for the whole invoice
+            if invoice_issues:
+                entries.append([invoice_date, 'COGS', invoice_number, f"Cost of Goods Sold - {invoice_number}",
+                                'GBP', 1.0, self.posting_rules.cogs_lines(cursor, invoice_issues, invoice_number,
+                                                                          self.cogs_mode)])
+        
+        costing.flush()
+        entry_numbers = reserve_document_numbers(cursor, 'JE', len(entries))
+        entry_ids = reserve_row_ids(cursor, 'journal_entries', 'entry_id', len(entries))
+        
+        entry_rows = []
+        line_rows = []
+        account_totals = {}
+        
+        for entry, entry_number, entry_id in zip(entries, entry_numbers, entry_ids):
+            entry_date, entry_type, reference, description, currency, exchange_rate, journal_lines = entry
+            entry_rows.append((entry_id, entry_number, entry_date, entry_type, reference, description,
+                               currency, exchange_rate, 'Posted', now))
+            
+            for account_id, debit, credit, debit_base, credit_base, line_desc in journal_line_amounts(
+                    journal_lines, currency, exchange_rate):
+                line_rows.append((entry_id, account_id, debit, credit, debit_base, credit_base,
+                                  line_desc, entry_date))
+                
+                totals = account_totals.setdefault((account_id, entry_date), [0, 0])
+                totals[0] += debit_base
+                totals[1] += credit_base
+        
+        cursor.executemany('''
+            INSERT INTO journal_entries
+            (entry_id, entry_number, entry_date, entry_type, reference, description,
+             currency, exchange_rate, status, created_date)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', entry_rows)
+        
+        cursor.executemany('''
+            INSERT INTO journal_entry_lines
+            (entry_id, account_id, debit_amount, credit_amount,
+             debit_base_currency, credit_base_currency, description, entry_date)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', line_rows)
+        
+        for (account_id, entry_date), (debit_base, credit_base) in sorted(account_totals.items()):
+            account = self.master_data.get(cursor, 'accounts', account_id)
+            update_period_balances(cursor, account_id, entry_date, debit_base, credit_base,
+                                   account['account_code'] if account else None)
+        
+        for row in invoice_rows:
+            row[13] = entry_ids[row[13]]
+        
+        cursor.executemany('''
+            INSERT INTO sales_invoices
+            (invoice_id, invoice_number, invoice_date, customer_id, currency, exchange_rate,
+             subtotal, vat_amount, total_amount, status, due_date, payment_terms,
+             notes, journal_entry_id, created_date, amount_outstanding)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', invoice_rows)
+        
+        open_invoices = [
+            {'total_amount': row[8], 'currency': row[4], 'exchange_rate': row[5],
+             'due_date': row[10], 'document_date': row[2], 'party_id': row[3]}
+            for row in invoice_rows
+        ]
+        add_open_documents(cursor, OPEN_INVOICES, open_invoices)
+        add_ageing_balances(cursor, 'Customer', open_invoices)
+        
+        cursor.executemany('''
+            INSERT INTO sales_invoice_lines
+            (invoice_id, item_id, description, quantity, unit_price, vat_rate,
+             line_total, location_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', invoice_line_rows)
+        
+        trans_numbers = reserve_document_numbers(cursor, 'STK-OUT', len(issues))
+        cursor.executemany('''
+            INSERT INTO inventory_transactions
+            (transaction_number, transaction_date, transaction_type, item_id,
+             from_location_id, quantity, unit_cost, total_value, reference, description,
+             journal_entry_id, created_date)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(trans_number, invoice_date, 'Issue', item_id, location_id, quantity, unit_cost, value,
+               invoice_number, f"Sale - Invoice {invoice_number}", None, now)
+              for trans_number, (item_id, location_id, quantity, unit_cost, value, invoice_number, invoice_date)
+              in zip(trans_numbers, issues)])
+        if issues:
+            discard_snapshots_from(cursor, min(issue[6] for issue in issues))
+        
+        issued_keys = {(issue[0], issue[1]) for issue in issues}
+        self.inventory.stock_state.write(conn, {key: stock[key] for key in issued_keys}, now)
+        
+        return invoice_numbers
+    
     def record_payment(self, invoice_number, payment_date, amount, payment_method, 
-                      bank_account_id, reference, description):
+                      bank_account_id, reference, description, session=None):
         """Record payment against sales invoice"""
-        conn = self.connect()
+        return self.receive_payment(None, payment_date, amount, payment_method, bank_account_id,
+                                    reference, description, [invoice_number], session)
+    
+    def receive_payment(self, customer_id, payment_date, amount, payment_method, bank_account_id,
+                        reference, description, invoice_numbers=None, session=None,
+                        currency=None, exchange_rate=None):
+        """
+        Record one payment from a customer across several invoices: those given by
+        number, in that order, or else the customer's open invoices, oldest due first.
+        Each invoice takes up to its amount outstanding. Named invoices must all be
+        open and take the whole payment; otherwise anything left over stays on the
+        payment unallocated, to be allocated later with allocate_payment(). With no
+        invoices open the payment goes on account in full, in currency at exchange_rate
+        (the base currency by default); otherwise it is in the invoices' currency.
+        """
+        session = session or Session(self.db_path)
+        conn = self.connect(session)
         cursor = conn.cursor()
         
         try:
-            # Get invoice details
-            cursor.execute('''
-                SELECT invoice_id, customer_id, total_amount, currency, exchange_rate
-                FROM sales_invoices WHERE invoice_number = ?
-            ''', (invoice_number,))
-            
-            invoice = cursor.fetchone()
-            if not invoice:
-                return False, None, "Invoice not found"
-            
-            # Get customer receivable account
-            cursor.execute('SELECT receivable_account_id FROM customers WHERE customer_id = ?', 
-                          (invoice['customer_id'],))
-            customer = cursor.fetchone()
-            receivable_account = customer['receivable_account_id']
-            
-            # Create journal entry
-            journal_lines = [
-                (bank_account_id, amount * invoice['exchange_rate'], 0, f"Payment received - {invoice_number}"),
-                (receivable_account, 0, amount * invoice['exchange_rate'], f"Payment from customer - {invoice_number}")
-            ]
+            # Get the invoices to allocate to
+            named = find_documents(cursor, 'Invoice', invoice_numbers) if invoice_numbers else None
+            if named:
+                invoices = iter(named)
+            else:
+                invoices = open_documents(cursor, 'Invoice', customer_id)
+            first = next(invoices, None)
+            
+            # Spread the payment, in the currency of the invoices, over as many as it covers
+            if first is None:
+                # With nothing open the whole payment goes on account
+                currency, exchange_rate = currency or BASE_CURRENCY, exchange_rate or 1.0
+                documents = []
+            else:
+                customer_id = customer_id or first['party_id']
+                if (currency and currency != first['currency']
+                        or exchange_rate and exchange_rate != first['exchange_rate']):
+                    return False, None, (f"{first['document_number']} is not in the currency and "
+                                         "exchange rate of the payment")
+                currency, exchange_rate = first['currency'], first['exchange_rate']
+                documents = [first]
+            amount = to_minor(amount, currency)
+            allocations, unallocated = plan_allocations(chain(documents, invoices), amount)
+            # Named invoices must take the whole payment; only a payment for none in particular goes on account
+            if named:
+                error = check_payment_documents(named, customer_id) or check_named_documents(named, unallocated)
+            else:
+                error = check_payment_documents(documents + [invoice for invoice, _ in allocations], customer_id)
+            if error:
+                return False, None, error
+            
+            # Get customer receivable account, or the default one
+            self.posting_rules.compile(cursor)
+            receivable_account = self.posting_rules.receivable_account(cursor, customer_id)
+            
+            # Allocate payment number
+            payment_number = next_document_number(cursor, 'PMT-IN')
+            
+            # Create journal entry, crediting the receivable per invoice
+            postings = payment_postings(allocations, unallocated, currency, exchange_rate,
+                                        "Payment from customer", payment_number)
+            paid_for = allocations[0][0]['document_number'] if len(allocations) == 1 else payment_number
+            journal_lines = [(bank_account_id, sum(posted for posted, _ in postings), 0,
+                              f"Payment received - {paid_for}")]
+            journal_lines += [(receivable_account, 0, posted, line_desc) for posted, line_desc in postings]
             
             success, entry_number, msg = self.accounting.create_journal_entry(
                 payment_date, 'Payment Receipt', reference,
-                description, invoice['currency'], invoice['exchange_rate'], journal_lines
+                description, currency, exchange_rate, journal_lines, session
             )
             
             if not success:
@@ -178,30 +491,20 @@ class SalesManager:
             cursor.execute('SELECT entry_id FROM journal_entries WHERE entry_number = ?', (entry_number,))
             journal_entry_id = cursor.fetchone()['entry_id']
             
-            # Generate payment number
-            cursor.execute('SELECT COUNT(*) as count FROM payments WHERE party_type = "Customer"')
-            count = cursor.fetchone()['count']
-            payment_number = f"PMT-IN-{count + 1:06d}"
-            
             # Record payment
+            now = datetime.now().isoformat()
             cursor.execute('''
                 INSERT INTO payments
                 (payment_number, payment_date, payment_type, party_type, party_id,
                  amount, currency, exchange_rate, payment_method, reference, description,
                  bank_account_id, journal_entry_id, created_date)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (payment_number, payment_date, 'Receipt', 'Customer', invoice['customer_id'],
-                  amount, invoice['currency'], invoice['exchange_rate'], payment_method,
-                  reference, description, bank_account_id, journal_entry_id,
-                  datetime.now().isoformat()))
-            
-            # Update invoice status if fully paid
-            if amount >= invoice['total_amount']:
-                cursor.execute('UPDATE sales_invoices SET status = "Paid" WHERE invoice_id = ?',
-                             (invoice['invoice_id'],))
-            else:
-                cursor.execute('UPDATE sales_invoices SET status = "Partially Paid" WHERE invoice_id = ?',
-                             (invoice['invoice_id'],))
+            ''', (payment_number, payment_date, 'Receipt', 'Customer', customer_id,
+                  amount, currency, exchange_rate, payment_method,
+                  reference, description, bank_account_id, journal_entry_id, now))
+            
+            # Reduce the amounts outstanding and update the invoice statuses
+            allocate_payment(cursor, 'Invoice', cursor.lastrowid, allocations, payment_date, now)
             
             conn.commit()
             return True, payment_number, "Payment recorded successfully"
@@ -210,6 +513,51 @@ class SalesManager:
             return False, None, str(e)
         finally:
             conn.close()
+    
+    def allocate_payment(self, payment_number, invoice_numbers, allocation_date=None, session=None):
+        """
+        Allocate what is left unallocated on a customer payment to invoices given by
+        number, in that order, each up to its amount outstanding. The payment already
+        posted that amount to the receivable account, so no journal entry is made; anything
+        still left over stays on the payment unallocated.
+        """
+        session = session or Session(self.db_path)
+        conn = self.connect(session)
+        cursor = conn.cursor()
+        
+        try:
+            payment = find_payment(cursor, 'Customer', payment_number)
+            invoices = find_documents(cursor, 'Invoice', invoice_numbers)
+            error = check_payment_allocation(payment, invoices)
+            if error:
+                return False, None, error
+            
+            # Reduce the amounts outstanding and update the invoice statuses
+            allocations, _ = plan_allocations(invoices, payment['unallocated'])
+            now = datetime.now().isoformat()
+            allocate_payment(cursor, 'Invoice', payment['payment_id'], allocations,
+                             allocation_date or datetime.now().date().isoformat(), now)
+            
+            conn.commit()
+            return True, payment_number, "Payment allocated successfully"
+        except Exception as e:
+            conn.rollback()
+            return False, None, str(e)
+        finally:
+            conn.close()
+    
+    def get_customer_statement(self, customer_id):
+        """Get a customer's open invoices with their amounts outstanding, oldest due first"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        items = statement_items(open_documents(cursor, 'Invoice', customer_id))
+        conn.close()
+        return items
+    
+    def get_receivables_ageing(self, as_of=None, customer_id=None):
+        """Get the amounts customers owe by ageing bucket, per customer"""
+        return AgeingReport(self.db_path).get_ageing('Customer', as_of, customer_id)
 
 
 class PurchaseManager:
@@ -217,66 +565,41 @@ class PurchaseManager:
         self.db_path = db_path
         self.accounting = AccountingManager(db_path)
         self.inventory = InventoryManager(db_path)
+        self.master_data = get_master_data(db_path)
+        self.posting_rules = get_posting_rules(db_path)
         
-    def connect(self):
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+    def connect(self, session=None):
+        if session is not None:
+            return session.scope()
+        return get_connection(self.db_path)
     
     def create_purchase_bill(self, supplier_id, bill_date, due_date, currency, exchange_rate,
-                            notes, lines):
+                            notes, lines, session=None):
         """
         Create purchase bill with automatic journal posting and stock receipt
         lines = [(item_id, description, quantity, unit_cost, vat_rate, location_id), ...]
+        The bill, its journal entry and stock receipts post in a single transaction.
         """
-        conn = self.connect()
+        session = session or Session(self.db_path)
+        conn = self.connect(session)
         cursor = conn.cursor()
         
         try:
-            # Calculate totals
-            subtotal = 0
-            vat_amount = 0
+            # Calculate totals in minor units
+            line_totals, subtotal, vat_amount, total_amount = document_amounts(lines, currency)
             
-            for line in lines:
-                item_id, description, quantity, unit_cost, vat_rate, location_id = line
-                line_total = quantity * unit_cost
-                line_vat = line_total * (vat_rate / 100)
-                subtotal += line_total
-                vat_amount += line_vat
-            
-            total_amount = subtotal + vat_amount
-            
-            # Generate bill number
-            cursor.execute('SELECT COUNT(*) as count FROM purchase_bills')
-            count = cursor.fetchone()['count']
-            bill_number = f"BILL-{count + 1:06d}"
-            
-            # Get supplier details
-            cursor.execute('SELECT payable_account_id FROM suppliers WHERE supplier_id = ?', (supplier_id,))
-            supplier = cursor.fetchone()
-            payable_account = supplier['payable_account_id']
-            
-            # Get expense and VAT accounts
-            cursor.execute('SELECT account_id FROM chart_of_accounts WHERE account_code = ?', ('1131',))
-            inventory_account = cursor.fetchone()['account_id']
-            
-            cursor.execute('SELECT account_id FROM chart_of_accounts WHERE account_code = ?', ('2122',))
-            vat_input_account = cursor.fetchone()['account_id']
-            
-            # Create journal entry
-            journal_lines = [
-                (inventory_account, subtotal * exchange_rate, 0, f"Purchase - {bill_number}"),
-                (payable_account, 0, total_amount * exchange_rate, f"Purchase Bill {bill_number}"),
-            ]
-            
-            if vat_amount > 0:
-                journal_lines.append(
-                    (vat_input_account, vat_amount * exchange_rate, 0, f"VAT on Purchase - {bill_number}")
-                )
+            # Allocate bill number
+            bill_number = next_document_number(cursor, 'BILL')
+            
+            # Create journal entry, posting each stocked line to its item's inventory account
+            journal_lines = self.posting_rules.purchase_bill_lines(
+                cursor, supplier_id, lines, line_totals, line_vat_amounts(lines, line_totals, currency),
+                currency, exchange_rate, bill_number
+            )
             
             success, entry_number, msg = self.accounting.create_journal_entry(
                 bill_date, 'Purchase Bill', bill_number,
-                f"Purchase Bill from Supplier", currency, exchange_rate, journal_lines
+                f"Purchase Bill from Supplier", currency, exchange_rate, journal_lines, session
             )
             
             if not success:
@@ -291,18 +614,24 @@ class PurchaseManager:
                 INSERT INTO purchase_bills
                 (bill_number, bill_date, supplier_id, currency, exchange_rate,
                  subtotal, vat_amount, total_amount, status, due_date, notes,
-                 journal_entry_id, created_date)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                 journal_entry_id, created_date, amount_outstanding)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', (bill_number, bill_date, supplier_id, currency, exchange_rate,
                   subtotal, vat_amount, total_amount, 'Unpaid', due_date, notes,
-                  journal_entry_id, datetime.now().isoformat()))
+                  journal_entry_id, datetime.now().isoformat(), total_amount))
             
             bill_id = cursor.lastrowid
-            
-            # Insert bill lines and receive stock
-            for line in lines:
+            unpaid_bill = {
+                'total_amount': total_amount, 'currency': currency, 'exchange_rate': exchange_rate,
+                'due_date': due_date, 'document_date': bill_date, 'party_id': supplier_id
+            }
+            add_open_documents(cursor, UNPAID_BILLS, [unpaid_bill])
+            add_ageing_balances(cursor, 'Supplier', [unpaid_bill])
+            
+            # Insert bill lines and receive stock in one batch
+            receipts = []
+            for line, line_total in zip(lines, line_totals):
                 item_id, description, quantity, unit_cost, vat_rate, location_id = line
-                line_total = quantity * unit_cost
                 
                 cursor.execute('''
                     INSERT INTO purchase_bill_lines
@@ -314,10 +643,14 @@ class PurchaseManager:
                 
                 # Receive stock if item_id is provided
                 if item_id:
-                    self.inventory.stock_receipt(
-                        item_id, location_id, quantity, unit_cost, bill_number,
-                        f"Purchase - Bill {bill_number}", None
-                    )
+                    receipts.append((item_id, location_id, quantity, unit_cost, bill_number,
+                                     f"Purchase - Bill {bill_number}", None))
+            
+            if receipts:
+                success, trans_numbers, msg = self.inventory.stock_receipts_batch(receipts, session, bill_date)
+                
+                if not success:
+                    raise Exception(f"Failed to receive stock: {msg}")
             
             conn.commit()
             return True, bill_number, "Purchase bill created successfully"
@@ -327,38 +660,106 @@ class PurchaseManager:
         finally:
             conn.close()
     
+    def create_purchase_bills_bulk(self, bills, chunk_size=100, session=None):
+        """
+        Create many purchase bills with one commit per chunk
+        bills = iterable of dicts with the create_purchase_bill arguments:
+            {'supplier_id', 'bill_date', 'due_date', 'currency', 'exchange_rate', 'notes', 'lines'}
+        Each bill posts in its own savepoint, so a failed bill is rolled back on its own.
+        Returns one (success, bill_number, message) per bill in input order.
+        """
+        bills = list(bills)
+        results = []
+        
+        for start in range(0, len(bills), chunk_size):
+            chunk_session = session or Session(self.db_path)
+            conn = self.connect(chunk_session)
+            
+            try:
+                for bill in bills[start:start + chunk_size]:
+                    results.append(self.create_purchase_bill(
+                        bill['supplier_id'], bill['bill_date'], bill.get('due_date'),
+                        bill.get('currency', 'GBP'), bill.get('exchange_rate', 1.0),
+                        bill.get('notes'), bill['lines'], chunk_session
+                    ))
+                conn.commit()
+            finally:
+                conn.close()
+        
+        return results
+    
     def make_payment(self, bill_number, payment_date, amount, payment_method,
-                    bank_account_id, reference, description):
+                    bank_account_id, reference, description, session=None):
         """Record payment against purchase bill"""
-        conn = self.connect()
+        return self.pay_supplier(None, payment_date, amount, payment_method, bank_account_id,
+                                 reference, description, [bill_number], session)
+    
+    def pay_supplier(self, supplier_id, payment_date, amount, payment_method, bank_account_id,
+                     reference, description, bill_numbers=None, session=None,
+                     currency=None, exchange_rate=None):
+        """
+        Record one payment to a supplier across several bills: those given by number,
+        in that order, or else the supplier's unpaid bills, oldest due first. Each bill
+        takes up to its amount outstanding. Named bills must all be open and take the
+        whole payment; otherwise anything left over stays on the payment unallocated,
+        to be allocated later with allocate_payment(). With no bills unpaid the payment
+        goes on account in full, in currency at exchange_rate (the base currency by
+        default); otherwise it is in the bills' currency.
+        """
+        session = session or Session(self.db_path)
+        conn = self.connect(session)
         cursor = conn.cursor()
         
         try:
-            # Get bill details
-            cursor.execute('''
-                SELECT bill_id, supplier_id, total_amount, currency, exchange_rate
-                FROM purchase_bills WHERE bill_number = ?
-            ''', (bill_number,))
-            
-            bill = cursor.fetchone()
-            if not bill:
-                return False, None, "Bill not found"
-            
-            # Get supplier payable account
-            cursor.execute('SELECT payable_account_id FROM suppliers WHERE supplier_id = ?',
-                          (bill['supplier_id'],))
-            supplier = cursor.fetchone()
-            payable_account = supplier['payable_account_id']
-            
-            # Create journal entry
-            journal_lines = [
-                (payable_account, amount * bill['exchange_rate'], 0, f"Payment made - {bill_number}"),
-                (bank_account_id, 0, amount * bill['exchange_rate'], f"Payment to supplier - {bill_number}")
-            ]
+            # Get the bills to allocate to
+            named = find_documents(cursor, 'Bill', bill_numbers) if bill_numbers else None
+            if named:
+                bills = iter(named)
+            else:
+                bills = open_documents(cursor, 'Bill', supplier_id)
+            first = next(bills, None)
+            
+            # Spread the payment, in the currency of the bills, over as many as it covers
+            if first is None:
+                # With nothing open the whole payment goes on account
+                currency, exchange_rate = currency or BASE_CURRENCY, exchange_rate or 1.0
+                documents = []
+            else:
+                supplier_id = supplier_id or first['party_id']
+                if (currency and currency != first['currency']
+                        or exchange_rate and exchange_rate != first['exchange_rate']):
+                    return False, None, (f"{first['document_number']} is not in the currency and "
+                                         "exchange rate of the payment")
+                currency, exchange_rate = first['currency'], first['exchange_rate']
+                documents = [first]
+            amount = to_minor(amount, currency)
+            allocations, unallocated = plan_allocations(chain(documents, bills), amount)
+            # Named bills must take the whole payment; only a payment for none in particular goes on account
+            if named:
+                error = check_payment_documents(named, supplier_id) or check_named_documents(named, unallocated)
+            else:
+                error = check_payment_documents(documents + [bill for bill, _ in allocations], supplier_id)
+            if error:
+                return False, None, error
+            
+            # Get supplier payable account, or the default one
+            self.posting_rules.compile(cursor)
+            payable_account = self.posting_rules.payable_account(cursor, supplier_id)
+            
+            # Allocate payment number
+            payment_number = next_document_number(cursor, 'PMT-OUT')
+            
+            # Create journal entry, debiting the payable per bill
+            postings = payment_postings(allocations, unallocated, currency, exchange_rate,
+                                        "Payment made", payment_number)
+            paid_for = allocations[0][0]['document_number'] if len(allocations) == 1 else payment_number
+            journal_lines = [(payable_account, posted, 0, line_desc) for posted, line_desc in postings]
+            journal_lines.append((bank_account_id, 0, sum(posted for posted, _ in postings),
+                                  f"Payment to supplier - {paid_for}"))
             
             success, entry_number, msg = self.accounting.create_journal_entry(
                 payment_date, 'Payment', reference,
-                description, bill['currency'], bill['exchange_rate'], journal_lines
+                description, currency, exchange_rate, journal_lines, session
             )
             
             if not success:
@@ -368,30 +769,20 @@ class PurchaseManager:
             cursor.execute('SELECT entry_id FROM journal_entries WHERE entry_number = ?', (entry_number,))
             journal_entry_id = cursor.fetchone()['entry_id']
             
-            # Generate payment number
-            cursor.execute('SELECT COUNT(*) as count FROM payments WHERE party_type = "Supplier"')
-            count = cursor.fetchone()['count']
-            payment_number = f"PMT-OUT-{count + 1:06d}"
-            
             # Record payment
+            now = datetime.now().isoformat()
             cursor.execute('''
                 INSERT INTO payments
                 (payment_number, payment_date, payment_type, party_type, party_id,
                  amount, currency, exchange_rate, payment_method, reference, description,
                  bank_account_id, journal_entry_id, created_date)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (payment_number, payment_date, 'Payment', 'Supplier', bill['supplier_id'],
-                  amount, bill['currency'], bill['exchange_rate'], payment_method,
-                  reference, description, bank_account_id, journal_entry_id,
-                  datetime.now().isoformat()))
-            
-            # Update bill status if fully paid
-            if amount >= bill['total_amount']:
-                cursor.execute('UPDATE purchase_bills SET status = "Paid" WHERE bill_id = ?',
-                             (bill['bill_id'],))
-            else:
-                cursor.execute('UPDATE purchase_bills SET status = "Partially Paid" WHERE bill_id = ?',
-                             (bill['bill_id'],))
+            ''', (payment_number, payment_date, 'Payment', 'Supplier', supplier_id,
+                  amount, currency, exchange_rate, payment_method,
+                  reference, description, bank_account_id, journal_entry_id, now))
+            
+            # Reduce the amounts outstanding and update the bill statuses
+            allocate_payment(cursor, 'Bill', cursor.lastrowid, allocations, payment_date, now)
             
             conn.commit()
             return True, payment_number, "Payment made successfully"
@@ -400,3 +791,48 @@ class PurchaseManager:
             return False, None, str(e)
         finally:
             conn.close()
+    
+    def allocate_payment(self, payment_number, bill_numbers, allocation_date=None, session=None):
+        """
+        Allocate what is left unallocated on a supplier payment to bills given by
+        number, in that order, each up to its amount outstanding. The payment already
+        posted that amount to the payable account, so no journal entry is made; anything
+        still left over stays on the payment unallocated.
+        """
+        session = session or Session(self.db_path)
+        conn = self.connect(session)
+        cursor = conn.cursor()
+        
+        try:
+            payment = find_payment(cursor, 'Supplier', payment_number)
+            bills = find_documents(cursor, 'Bill', bill_numbers)
+            error = check_payment_allocation(payment, bills)
+            if error:
+                return False, None, error
+            
+            # Reduce the amounts outstanding and update the bill statuses
+            allocations, _ = plan_allocations(bills, payment['unallocated'])
+            now = datetime.now().isoformat()
+            allocate_payment(cursor, 'Bill', payment['payment_id'], allocations,
+                             allocation_date or datetime.now().date().isoformat(), now)
+            
+            conn.commit()
+            return True, payment_number, "Payment allocated successfully"
+        except Exception as e:
+            conn.rollback()
+            return False, None, str(e)
+        finally:
+            conn.close()
+    
+    def get_supplier_statement(self, supplier_id):
+        """Get a supplier's unpaid bills with their amounts outstanding, oldest due first"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        items = statement_items(open_documents(cursor, 'Bill', supplier_id))
+        conn.close()
+        return items
+    
+    def get_payables_ageing(self, as_of=None, supplier_id=None):
+        """Get the amounts owed to suppliers by ageing bucket, per supplier"""
+        return AgeingReport(self.db_path).get_ageing('Supplier', as_of, supplier_id)
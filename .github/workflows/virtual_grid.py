@@ -0,0 +1,237 @@
+import tkinter as tk
+from tkinter import ttk
+from collections import OrderedDict
+
+
+class VirtualGrid(ttk.Frame):
+    """
+    Scrollable table for result sets too large to insert into a ttk.Treeview.
+    The Treeview only ever holds the rows that fit on screen; scrolling moves a
+    window over the result and rows are fetched a page at a time on the report
+    executor's worker threads.
+
+    Data comes from three callables, all run off the main thread:
+        fetch_page(after, limit) -> (rows, next_cursor)    keyset-paginated page
+        seek(offset, checkpoint) -> cursor                 cursor for the page at a row offset
+        count()                  -> int                    total rows, sizes the scrollbar
+    and row_values(row) turns a fetched row into the tuple shown in the columns.
+    If a page or the count fails, on_error(message) is called on the main thread,
+    e.g. to show it in the status bar; a failed page is asked for again when it
+    next scrolls into view.
+
+    The cursor returned with each page is kept as the checkpoint of the next one,
+    so paging forward never reads earlier rows again; jumping with the scrollbar
+    asks seek() for a checkpoint instead, passing the nearest one already known as
+    (offset, cursor) to count rows from, and keeps the one it finds.
+    """
+    def __init__(self, parent, columns, executor, key, fetch_page, seek, count, row_values,
+                 page_size=200, cached_pages=20, height=25, on_error=None):
+        super().__init__(parent)
+        self.executor = executor
+        self.key = key
+        self.fetch_page = fetch_page
+        self.seek = seek
+        self.count = count
+        self.row_values = row_values
+        self.on_error = on_error
+        self.page_size = page_size
+        self.cached_pages = cached_pages
+
+        self.tree = ttk.Treeview(self, columns=columns, show='headings', height=height, selectmode='browse')
+        for col in columns:
+            self.tree.heading(col, text=col)
+
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.yview)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        # Scrolling is ours, the Treeview never holds more rows than are visible
+        self.tree.bind('<MouseWheel>', self._on_mousewheel)
+        self.tree.bind('<Button-4>', lambda event: self.yview('scroll', -3, 'units'))
+        self.tree.bind('<Button-5>', lambda event: self.yview('scroll', 3, 'units'))
+        self.tree.bind('<Prior>', lambda event: self.yview('scroll', -1, 'pages'))
+        self.tree.bind('<Next>', lambda event: self.yview('scroll', 1, 'pages'))
+        self.tree.bind('<Configure>', self._on_resize)
+
+        self.visible_rows = height
+        self.items = []
+        self._create_items()
+        self.reset()
+
+    def column(self, col, **options):
+        self.tree.column(col, **options)
+
+    def reset(self):
+        """Forget all loaded rows, e.g. before loading with different filters"""
+        for index in list(getattr(self, 'loading', ())):
+            self.executor.cancel(self._page_key(index))
+        self.executor.cancel(f'{self.key}_count')
+
+        self.pages = OrderedDict()      # page index -> rows, least recently used first
+        self.checkpoints = {0: None}    # page index -> cursor the page starts after
+        self.loading = set()
+        self.total = 0
+        self.total_known = False
+        self.top = 0
+        self._render()
+
+    def load(self):
+        """Load the first page and count the rows in the background"""
+        self.reset()
+        self.executor.submit(f'{self.key}_count', self.count, on_done=self._set_total,
+                             on_error=lambda error: self._show_error('count', error),
+                             description=f"{self.key.replace('_', ' ').title()} count")
+        self._request_page(0)
+
+    def yview(self, *args):
+        """Scrollbar command: ('moveto', fraction) or ('scroll', n, 'units' | 'pages')"""
+        if not args:
+            return self._fraction()
+
+        if args[0] == 'moveto':
+            top = int(float(args[1]) * self.total)
+        elif args[0] == 'scroll':
+            step = int(args[1])
+            if args[2] == 'pages':
+                step *= max(1, self.visible_rows - 1)
+            top = self.top + step
+        else:
+            return
+
+        self.scroll_to(top)
+
+    def scroll_to(self, top):
+        """Show rows from offset top"""
+        top = max(0, min(top, self.total - self.visible_rows))
+        if top != self.top:
+            self.top = top
+            self._render()
+
+    def _create_items(self):
+        # One Treeview item per visible row, reused as the window moves
+        for iid in self.items[self.visible_rows:]:
+            self.tree.delete(iid)
+        del self.items[self.visible_rows:]
+
+        while len(self.items) < self.visible_rows:
+            self.items.append(self.tree.insert('', 'end', values=()))
+
+    def _on_resize(self, event):
+        rowheight = int(ttk.Style().lookup('Treeview', 'rowheight') or 20)
+        visible_rows = max(1, (event.height - rowheight) // rowheight)
+        if visible_rows != self.visible_rows:
+            self.visible_rows = visible_rows
+            self._create_items()
+            self.scroll_to(self.top)
+            self._render()
+
+    def _on_mousewheel(self, event):
+        self.yview('scroll', -3 if event.delta > 0 else 3, 'units')
+        return 'break'
+
+    def _fraction(self):
+        if not self.total:
+            return 0.0, 1.0
+        first = self.top / self.total
+        last = min(1.0, (self.top + self.visible_rows) / self.total)
+        return first, last
+
+    def _render(self):
+        """Fill the visible items from cached pages, requesting the pages that are missing"""
+        needed = set()
+
+        for position, iid in enumerate(self.items):
+            offset = self.top + position
+            if offset >= self.total:
+                self.tree.item(iid, values=())
+                continue
+
+            index, row = divmod(offset, self.page_size)
+            page = self.pages.get(index)
+            if page is None:
+                needed.add(index)
+                self.tree.item(iid, values=('Loading...',))
+            elif row < len(page):
+                self.pages.move_to_end(index)
+                self.tree.item(iid, values=self.row_values(page[row]))
+            else:
+                self.tree.item(iid, values=())
+
+        # Pages scrolled past before they arrived are no longer wanted
+        for index in self.loading - needed:
+            self.executor.cancel(self._page_key(index))
+        self.loading &= needed
+
+        for index in needed:
+            self._request_page(index)
+
+        self.scrollbar.set(*self._fraction())
+
+    def _page_key(self, index):
+        return f'{self.key}_page_{index}'
+
+    def _request_page(self, index):
+        if index in self.loading:
+            return
+        self.loading.add(index)
+
+        if index in self.checkpoints:
+            func, args = self._fetch_after, (self.checkpoints[index],)
+        else:
+            nearest = min(self.checkpoints, key=lambda known: abs(known - index))
+            func, args = self._fetch_at, (index * self.page_size,
+                                          (nearest * self.page_size, self.checkpoints[nearest]))
+
+        self.executor.submit(self._page_key(index), func, *args,
+                             on_done=lambda result: self._page_loaded(index, result),
+                             on_error=lambda error: self._page_failed(index, error),
+                             description=self.key.replace('_', ' ').title())
+
+    def _fetch_after(self, cursor):
+        # Worker thread
+        return self.fetch_page(cursor, self.page_size) + (cursor,)
+
+    def _fetch_at(self, offset, checkpoint):
+        # Worker thread: find the checkpoint first, then read the page after it
+        cursor = self.seek(offset, checkpoint)
+        return self.fetch_page(cursor, self.page_size) + (cursor,)
+
+    def _page_loaded(self, index, result):
+        rows, next_cursor, cursor = result
+        self.loading.discard(index)
+
+        if cursor is not None:
+            self.checkpoints[index] = cursor
+
+        self.pages[index] = rows
+        self.pages.move_to_end(index)
+        while len(self.pages) > self.cached_pages:
+            self.pages.popitem(last=False)
+
+        if next_cursor is not None:
+            self.checkpoints[index + 1] = next_cursor
+
+        # Until the count arrives, size the scrollbar by the rows seen so far
+        if not self.total_known:
+            seen = index * self.page_size + len(rows)
+            self.total = max(self.total, seen + (1 if next_cursor is not None else 0))
+
+        self._render()
+
+    def _page_failed(self, index, error):
+        # Not loading any more, so the page is asked for again when it is next rendered
+        self.loading.discard(index)
+        self._show_error(f'page {index + 1}', error)
+
+    def _show_error(self, what, error):
+        message = f"{self.key.replace('_', ' ').title()} {what} failed: {error}"
+        if self.on_error:
+            self.on_error(message)
+        else:
+            self.executor.root.report_callback_exception(type(error), error, error.__traceback__)
+
+    def _set_total(self, total):
+        self.total = total
+        self.total_known = True
+        self.scroll_to(self.top)
+        self._render()